@@ -1,33 +1,39 @@
 import logging
+import argparse
 from question_generator import QuestionGenerator, CodeQuestionGenerator
 import os
 from files.prompt import question_generation_prompt, question_code_generation_prompt
 from dotenv import load_dotenv
 from openai import OpenAI
 from settings import settings
+import sys
+sys.path.append("../../..")
+from src.llm_providers import client_kwargs
 
 def load_llm(model_name: str) -> OpenAI:
     load_dotenv()
-    if "gemini" in model_name:
-        gemini_key = os.getenv("GEMINI_API_KEY")
-        if not gemini_key:
-            logger.error("Gemini API key not found in environment variables.")
-            raise EnvironmentError("Gemini API key not set in environment.")
-        logger.info("Successfully loaded Gemini API key.")
-        return OpenAI(
-            api_key=gemini_key,
-            base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-            timeout=600,
-            max_retries=3,
-        )
-    else:
+    if "gemini" not in model_name:
         raise ValueError("Invalid model name selected.")
+    try:
+        client = OpenAI(**client_kwargs(model_name, "gemini"), timeout=600, max_retries=3)
+    except EnvironmentError:
+        logger.error("Gemini API key not found in environment variables.")
+        raise
+    logger.info("Successfully loaded Gemini API key.")
+    return client
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate QA pairs for the documents with the settings in settings.py. Example input: --resume")
+    parser.add_argument("--resume", action="store_true", default=False, help="Skip the documents already recorded in <OUTPUT_FILE>.checkpoint.jsonl by an interrupted run. Documents that failed validation are generated again.")
+    parser.add_argument("--skip_failed", action="store_true", default=False, help="With --resume, also skip the recorded documents that failed validation.")
+    args = parser.parse_args()
+
     model_name = settings.model_name
     prompt_type = settings.prompt_type
     output_file = settings.output_file
     logger_file = settings.logger_file
+    concurrency = settings.concurrency
+    checkpoint_file = output_file + ".checkpoint.jsonl"
     LOG_DIR = "logs"
     os.makedirs(LOG_DIR, exist_ok=True)
     logging.basicConfig(
@@ -66,7 +72,7 @@ if __name__ == "__main__":
         }
 
         # 处理文档，生成问题
-        results = generator.process_documents(docs, model_args)
+        results = generator.process_documents(docs, model_args, concurrency=concurrency, checkpoint_file=checkpoint_file, resume=args.resume, skip_failed=args.skip_failed)
 
         # 存储结果
         generator.store_result(results, output_file=output_file)
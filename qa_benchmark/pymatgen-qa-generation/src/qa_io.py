@@ -0,0 +1,196 @@
+import os
+import re
+import json
+import argparse
+from typing import Iterator
+
+_SEPARATOR = re.compile(r"[\s,]*")
+# characters that may follow an array element; a number cut off by a chunk boundary is followed by none of them
+_ELEMENT_END = frozenset(",] \t\n\r")
+INDEX_SUFFIX = ".index.json"
+INDEX_VERSION = 1
+
+def item_source(item: dict) -> str:
+    """The source of a QA item, as used for the per-source rows of the evaluation CSV."""
+    return item["source"]["metadata"]["code_source_file"] + "/" + item["source"]["metadata"]["name"]
+
+def iter_json_array(file_path: str, chunk_size: int = 1 << 20) -> Iterator:
+    """
+    逐个读取 JSON 数组中的元素，无需把整个文件载入内存。
+
+    Args:
+        file_path (str): A file holding one top-level JSON array, e.g. generation_results_code.json.
+        chunk_size (int): Number of characters read from the file at a time.
+
+    Yields:
+        The elements of the array, in file order.
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, "r", encoding="utf-8") as f:
+        buffer = f.read(chunk_size)
+        pos = _SEPARATOR.match(buffer).end()
+        while pos == len(buffer):
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError(f"{file_path} is empty, expected a JSON array.")
+            buffer += chunk
+            pos = _SEPARATOR.match(buffer, pos).end()
+        if buffer[pos] != "[":
+            raise ValueError(f"{file_path} does not contain a JSON array.")
+        pos += 1
+        eof = False
+        while True:
+            pos = _SEPARATOR.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                item, end = None, None
+            # 元素可能被分块截断：读入更多内容后重试。数字（如 1.5 截断为 1.）要等到其后的分隔符读入后才算完整
+            if end is None or (not eof and (end == len(buffer) or buffer[end] not in _ELEMENT_END)):
+                if eof:
+                    raise ValueError(f"{file_path} ends in the middle of the JSON array.")
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield item
+            pos = end
+
+def iter_qa_items(file_path: str) -> Iterator[dict]:
+    """
+    逐个读取 QA 条目，支持 JSON 数组 (.json) 和每行一个条目的 JSONL (.jsonl) 两种格式。
+    """
+    if file_path.endswith(".jsonl"):
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        yield from iter_json_array(file_path)
+
+def convert_to_jsonl(json_file: str, jsonl_file: str) -> int:
+    """
+    把 JSON 数组格式的 QA 文件转换为紧凑的 JSONL 文件，并生成偏移索引。
+    Returns:
+        int: The number of converted items.
+    """
+    count = 0
+    with open(jsonl_file, "w", encoding="utf-8") as f:
+        for item in iter_json_array(json_file):
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            count += 1
+    build_index(jsonl_file)
+    return count
+
+def build_index(jsonl_file: str) -> dict:
+    """
+    扫描 JSONL 文件，记录每个条目的字节偏移、来源和问题编号，写入 <jsonl_file>.index.json。
+    """
+    offsets, sources, question_ids = [], [], []
+    offset = 0
+    with open(jsonl_file, "rb") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                offsets.append(offset)
+                sources.append(item_source(item))
+                question_ids.append([question["question_id"] for question in item["questions"]])
+            offset += len(line)
+    index = {
+        "version": INDEX_VERSION,
+        "data_size": offset,
+        "offsets": offsets,
+        "sources": sources,
+        "question_ids": question_ids,
+    }
+    with open(jsonl_file + INDEX_SUFFIX, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    return index
+
+class QAReader:
+    """
+    按需读取 JSONL 格式的 QA 文件：通过偏移索引随机访问条目，按来源或问题编号查找，惰性迭代。
+    The index is rebuilt automatically when it is missing or does not match the data file.
+    """
+    def __init__(self, jsonl_file: str):
+        if not jsonl_file.endswith(".jsonl"):
+            raise ValueError(f"{jsonl_file} is not a JSONL file. Convert it first with `python qa_io.py convert`.")
+        self.jsonl_file = jsonl_file
+        self.index = self._load_index()
+        self.by_source = {}
+        for item_index, source in enumerate(self.index["sources"]):
+            self.by_source.setdefault(source, []).append(item_index)
+        self.file = open(jsonl_file, "rb")
+
+    def _load_index(self) -> dict:
+        index_file = self.jsonl_file + INDEX_SUFFIX
+        if os.path.exists(index_file):
+            with open(index_file, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            if index.get("version") == INDEX_VERSION and index.get("data_size") == os.path.getsize(self.jsonl_file):
+                return index
+        return build_index(self.jsonl_file)
+
+    def __len__(self) -> int:
+        return len(self.index["offsets"])
+
+    def __getitem__(self, item_index: int) -> dict:
+        """Read one item by its position in the file."""
+        self.file.seek(self.index["offsets"][item_index])
+        return json.loads(self.file.readline())
+
+    def __iter__(self) -> Iterator[dict]:
+        return self.iter_items()
+
+    def iter_items(self, item_indices=None) -> Iterator[dict]:
+        """Lazily yield all items, or only the given item indices (e.g. a sample or a shard) in the given order."""
+        if item_indices is None:
+            yield from iter_qa_items(self.jsonl_file)
+        else:
+            for item_index in item_indices:
+                yield self[item_index]
+
+    def sources(self) -> list:
+        """The distinct sources, in order of first appearance."""
+        return list(self.by_source)
+
+    def items_for_source(self, source: str) -> list:
+        """All items generated from the given source, e.g. 'pymatgen/core/structure.py/Structure'."""
+        return [self[item_index] for item_index in self.by_source.get(source, [])]
+
+    def get_question(self, item_index: int, question_id: str | int) -> dict:
+        """
+        Return one question, addressed by its item index and the question_id within that item.
+        Ids are compared as strings, so 1 and "1" address the same question.
+        """
+        question_id = str(question_id)
+        if question_id not in map(str, self.index["question_ids"][item_index]):
+            raise KeyError(f"Item {item_index} has no question {question_id}.")
+        return next(question for question in self[item_index]["questions"] if str(question["question_id"]) == question_id)
+
+    def iter_questions(self, item_indices=None) -> Iterator[tuple]:
+        """Lazily yield (item_index, source, question) for every question of the selected items."""
+        item_indices = range(len(self)) if item_indices is None else item_indices
+        for item_index in item_indices:
+            item = self[item_index]
+            for question in item["questions"]:
+                yield item_index, self.index["sources"][item_index], question
+
+    def close(self):
+        self.file.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert QA benchmark files to indexed JSONL. Example input: convert ../../generated_qa/generation_results_code.json ../../generated_qa/generation_results_code.jsonl")
+    parser.add_argument("command", choices=["convert", "index"], help="convert: JSON array -> JSONL plus index; index: rebuild the index of a JSONL file.")
+    parser.add_argument("input", type=str, help="The JSON file to convert, or the JSONL file to index.")
+    parser.add_argument("output", type=str, nargs="?", default=None, help="convert: the JSONL file to write. Default replaces .json by .jsonl.")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        output = args.output or os.path.splitext(args.input)[0] + ".jsonl"
+        print(f"Converted {convert_to_jsonl(args.input, output)} items into {output}")
+    else:
+        print(f"Indexed {len(build_index(args.input)['offsets'])} items of {args.input}")
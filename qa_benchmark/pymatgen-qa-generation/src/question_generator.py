@@ -1,7 +1,13 @@
 from abc import ABC, abstractmethod
+import os
 import json
 import re
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
+from qa_io import build_index
 
 class BaseQuestionGenerator(ABC):
     
@@ -66,15 +72,131 @@ class BaseQuestionGenerator(ABC):
 
     def store_result(self, result: list, output_file: str):
         try:
-            with open(output_file, "w") as file:
-                json.dump(result, file, indent=4)
+            if output_file.endswith(".jsonl"):
+                # 每行一个条目，并生成偏移索引，便于按来源或问题随机访问
+                with open(output_file, "w", encoding="utf-8") as file:
+                    for entry in result:
+                        file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                build_index(output_file)
+            else:
+                with open(output_file, "w") as file:
+                    json.dump(result, file, indent=4)
             self.logger.info(f"Results successfully stored in {output_file}.")
         except Exception as e:
             self.logger.error(f"Failed to store results: {e}", exc_info=True)
             raise
     
+    @staticmethod
+    def document_id(doc: dict, index: int) -> str:
+        """
+        Stable id of a document, used to resume generation: its position in the document list and its 'id' field if present,
+        otherwise a hash of its content. The position keeps documents with identical text apart.
+        """
+        content_id = str(doc["id"]) if "id" in doc else hashlib.sha256(json.dumps(doc, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:32]
+        return f"{index}:{content_id}"
+
+    def load_checkpoint(self, checkpoint_file: str) -> dict:
+        """
+        Read the per-document records of an interrupted run.
+        A trailing line left incomplete by a crash is cut off, so that records appended later stay readable.
+        A document recorded more than once keeps its last record.
+        """
+        records = {}
+        if not os.path.exists(checkpoint_file):
+            return records
+        valid_size = 0
+        with open(checkpoint_file, "rb") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                records[record["doc_id"]] = record
+                valid_size += len(line)
+        with open(checkpoint_file, "r+b") as file:
+            file.truncate(valid_size)
+        self.logger.info(f"Loaded {len(records)} finished documents from {checkpoint_file}.")
+        return records
+
+    def generate_document_questions(self, idx: int, total: int, doc: dict, model_args: dict, max_retries: int = 3):
+        """Generate and validate the questions of one document, retrying invalid answers up to max_retries times."""
+        retry_count = 0
+        is_valid = False
+        data = None
+
+        self.logger.info(f"Processing document {idx+1}/{total}: {doc['metadata']['code_source_file']}")
+
+        while retry_count < max_retries and not is_valid:
+            try:
+                question = self.generate_question_for_document(doc, model_args)
+                is_valid, data = self.check_answer(question)
+                if not is_valid:
+                    self.logger.warning(f"Invalid question format on attempt {retry_count + 1}")
+            except Exception as e:
+                self.logger.error(f"Error generating question for document {idx+1}: {e}", exc_info=True)
+            retry_count += 1
+
+        if is_valid:
+            self.logger.info(f"Successfully generated valid questions for document {idx+1}.")
+            return data
+        self.logger.warning(f"Failed to generate valid questions for document {idx+1} after {max_retries} retries.")
+        return None
+
+    def process_documents(self, docs: list, model_args: dict, concurrency: int = 1, checkpoint_file: str | None = None, resume: bool = False, skip_failed: bool = False):
+        """
+        Generate questions for all documents with up to `concurrency` documents in flight.
+        Every finished document is appended to checkpoint_file right away, so with resume=True documents recorded
+        by an interrupted run are not sent to the LLM again. Documents that failed validation are retried,
+        unless skip_failed is set.
+        Returns:
+            list: The valid {"source", "questions"} entries in document order, whatever order they finished in.
+        """
+        records = self.load_checkpoint(checkpoint_file) if checkpoint_file and resume else {}
+        checkpoint = open(checkpoint_file, "a" if resume else "w", encoding="utf-8") if checkpoint_file else None
+        lock = threading.Lock()
+
+        def process(idx, doc, doc_id):
+            data = self.generate_document_questions(idx, len(docs), doc, model_args)
+            record = {"doc_id": doc_id, "index": idx, "questions": data}
+            with lock:
+                records[doc_id] = record
+                if checkpoint:
+                    checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    checkpoint.flush()
+                    os.fsync(checkpoint.fileno())
+
+        window = max(1, concurrency) * 4
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        try:
+            for idx, doc in enumerate(docs):
+                doc_id = self.document_id(doc, idx)
+                if doc_id in records and (records[doc_id]["questions"] is not None or skip_failed):
+                    continue
+                pending.append(executor.submit(process, idx, doc, doc_id))
+                while len(pending) > window:
+                    pending.popleft().result()
+            while pending:
+                pending.popleft().result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            if checkpoint:
+                checkpoint.close()
+
+        qa_result = []
+        for idx, doc in enumerate(docs):
+            record = records.get(self.document_id(doc, idx))
+            if record and record["questions"] is not None:
+                qa_result.append({
+                    "source": doc,
+                    "questions": record["questions"]
+                })
+        return qa_result
+
     @abstractmethod
-    def process_documents(self, docs: list, model_args: dict):
+    def generate_question_for_document(self, doc: dict, model_args: dict) -> str:
         pass
     
     @abstractmethod
@@ -96,37 +218,9 @@ class QuestionGenerator(BaseQuestionGenerator):
             self.logger.error(f"Failed to generate question: {e}", exc_info=True)
             raise
 
-    def process_documents(self, docs: list, model_args: dict):
-        qa_result = []
-        for idx, doc in enumerate(docs):
-            doc_segment = "Code Source File: " + doc['metadata']['code_source_file'] + "\n\n" + "Document: \n" + doc["page_content"]
-            max_retries = 3
-            retry_count = 0
-            is_valid = False
-            data = None
-
-            self.logger.info(f"Processing document {idx+1}/{len(docs)}: {doc['metadata']['code_source_file']}")
-
-            while retry_count < max_retries and not is_valid:
-                try:
-                    question = self.generate_question(doc_segment, model_args)
-                    is_valid, data = self.check_answer(question)
-                    if not is_valid:
-                        self.logger.warning(f"Invalid question format on attempt {retry_count + 1}")
-                except Exception as e:
-                    self.logger.error(f"Error generating question for document {idx+1}: {e}", exc_info=True)
-                retry_count += 1
-
-            if is_valid:
-                qa_result.append({
-                    "source": doc,
-                    "questions": data
-                })
-                self.logger.info(f"Successfully generated valid questions for document {idx+1}.")
-            else:
-                self.logger.warning(f"Failed to generate valid questions for document {idx+1} after {max_retries} retries.")
-
-        return qa_result
+    def generate_question_for_document(self, doc: dict, model_args: dict) -> str:
+        doc_segment = "Code Source File: " + doc['metadata']['code_source_file'] + "\n\n" + "Document: \n" + doc["page_content"]
+        return self.generate_question(doc_segment, model_args)
         
 
 
@@ -145,35 +239,5 @@ class CodeQuestionGenerator(BaseQuestionGenerator):
             self.logger.error(f"Failed to generate question: {e}", exc_info=True)
             raise
 
-    def process_documents(self, docs: list, model_args: dict):
-        qa_result = []
-        for idx, doc in enumerate(docs):
-            code_source_file = doc['metadata']['code_source_file']
-            code_segment = doc["metadata"]["code_content"]
-            max_retries = 3
-            retry_count = 0
-            is_valid = False
-            data = None
-
-            self.logger.info(f"Processing document {idx+1}/{len(docs)}: {doc['metadata']['code_source_file']}")
-
-            while retry_count < max_retries and not is_valid:
-                try:
-                    question = self.generate_question(code_source_file, code_segment, model_args)
-                    is_valid, data = self.check_answer(question)
-                    if not is_valid:
-                        self.logger.warning(f"Invalid question format on attempt {retry_count + 1}")
-                except Exception as e:
-                    self.logger.error(f"Error generating question for document {idx+1}: {e}", exc_info=True)
-                retry_count += 1
-
-            if is_valid:
-                qa_result.append({
-                    "source": doc,
-                    "questions": data
-                })
-                self.logger.info(f"Successfully generated valid questions for document {idx+1}.")
-            else:
-                self.logger.warning(f"Failed to generate valid questions for document {idx+1} after {max_retries} retries.")
-
-        return qa_result
\ No newline at end of file
+    def generate_question_for_document(self, doc: dict, model_args: dict) -> str:
+        return self.generate_question(doc['metadata']['code_source_file'], doc["metadata"]["code_content"], model_args)
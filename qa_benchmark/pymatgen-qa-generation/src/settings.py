@@ -6,6 +6,7 @@ CONFIG = {
     "MODEL_NAME": "gemini-2.0-flash",
     "LOGGER_FILE": "question_generator_code.log",
     "OUTPUT_FILE": "files/generation_results_code.json",
+    "CONCURRENCY": 1,
 }
 
 TEST_CONFIG = {
@@ -14,6 +15,9 @@ TEST_CONFIG = {
     "LOGGER_FILE": "question_evaluation_code_gemini-2-0-flash.log",
     "CSV_FILE_NAME": "evaluation_results_gemini-2-0-flash.csv",
     "TEST_FILE_PATH": "generation_results_doc.json",
+    "LLM_CACHE": None,
+    "LLM_CACHE_TTL": None,
+    "CONCURRENCY": 1,
 }
 
 class Settings(BaseModel):
@@ -21,6 +25,7 @@ class Settings(BaseModel):
     model_name: str = Field("gemini-2.0-flash", description="Model name to use")
     logger_file: str = Field("question_generator_doc.log", description="Logger file to save logs")
     output_file: str = Field("files/generation_results_doc.json", description="Output file to save results")
+    concurrency: int = Field(1, description="Number of documents sent to the model at once")
 
     @classmethod
     def load(cls):
@@ -29,6 +34,7 @@ class Settings(BaseModel):
             model_name=CONFIG.get("MODEL_NAME", "gemini-2.0-flash"),
             logger_file=CONFIG.get("LOGGER_FILE", "question_generator_code.log"),
             output_file=CONFIG.get("OUTPUT_FILE", "files/generation_results_code.json"),
+            concurrency=CONFIG.get("CONCURRENCY", 1),
         )
 
 settings = Settings.load()
@@ -40,6 +46,9 @@ class TestSettings(BaseModel):
     csv_filename: str = Field("evaluation_results_gemini-2-0-flash.csv", description="CSV file to save results")
     test_file_path: str = Field("test.json", description="Test file path")
     model_type: str = Field("remote", description="Type of model to use")
+    llm_cache: str | None = Field(None, description="SQLite file of an LLM response cache, e.g. llm_cache/responses.sqlite3")
+    llm_cache_ttl: float | None = Field(None, description="Seconds after which cached responses are requested again, None for no expiry")
+    concurrency: int = Field(1, description="Number of questions sent to the model at once")
     
     @classmethod
     def load(cls):
@@ -49,6 +58,9 @@ class TestSettings(BaseModel):
             csv_filename=TEST_CONFIG.get("CSV_FILE_NAME", "evaluation_results_gemini-2-0-flash.csv"),
             test_file_path=TEST_CONFIG.get("TEST_FILE_PATH", "test.json"),
             model_type=CONFIG.get("MODEL_TYPE", "remote"),
+            llm_cache=TEST_CONFIG.get("LLM_CACHE"),
+            llm_cache_ttl=TEST_CONFIG.get("LLM_CACHE_TTL"),
+            concurrency=TEST_CONFIG.get("CONCURRENCY", 1),
         )
 
 test_settings = TestSettings.load()
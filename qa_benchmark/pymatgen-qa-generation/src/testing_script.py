@@ -2,57 +2,51 @@ import json
 import logging
 import os
 import csv
+import sys
+import zlib
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from openai import OpenAI
 from dotenv import load_dotenv
 from files.prompt import question_test_prompt
 from settings import test_settings
+from qa_io import iter_qa_items, item_source
+sys.path.append("../../..")
+from src.llm_cache import CachedOpenAI, get_response_cache
+from src.llm_providers import PROVIDERS, client_kwargs
 
 class LLMEvaluator:
-    def __init__(self, model_args, logger, model_type):
+    def __init__(self, model_args, logger, model_type, llm_cache=None, llm_cache_ttl=None):
         self.logger = logger
         self.llm = self.load_llm(model_args["model"], model_type)
+        if llm_cache:
+            # 相同的请求直接从本地缓存返回
+            self.llm = CachedOpenAI(self.llm, get_response_cache(llm_cache, llm_cache_ttl))
+            self.logger.info(f"Using LLM response cache: {llm_cache}")
         self.model_args = model_args
         
     def load_llm(self, model_name: str, model_type: str) -> OpenAI:
         load_dotenv()
         if model_type == "remote":
             if "gemini" in model_name:
-                gemini_key = os.getenv("GEMINI_API_KEY")
-                if not gemini_key:
-                    self.logger.error("Gemini API key not found in environment variables.")
-                    raise EnvironmentError("Gemini API key not set in environment.")
-                self.logger.info("Successfully loaded Gemini API key.")
-                return OpenAI(
-                    api_key=gemini_key,
-                    base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-                    timeout=600,
-                    max_retries=3,
-                )
+                provider = "gemini"
             elif "deepseek" in model_name:
-                deepseek_key = os.getenv("DEEPSEEK_API_KEY")
-                if not deepseek_key:
-                    self.logger.error("DeepSeek API key not found in environment variables.")
-                    raise EnvironmentError("DeepSeek API key not set in environment.")
-                self.logger.info("Successfully loaded DeepSeek API key.")
-                return OpenAI(
-                    api_key=deepseek_key,
-                    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-                    timeout=600,
-                    max_retries=3,
-                )
+                provider = "dashscope"
             else:
                 raise ValueError("Invalid model name selected.")
         elif model_type == "local":
-            client = OpenAI(
-                base_url="http://localhost:8000/v1",
-                api_key="token-abc123",
-                timeout=600,
-                max_retries=3,
-            )
-            self.logger.info("Successfully loaded local LLM.")
-            return client
+            provider = "local"
         else:
             raise ValueError("Invalid model name selected.")
+        # 同一服务商的客户端共享连接池和请求配额, 见 src/llm_providers.py
+        try:
+            client = OpenAI(**client_kwargs(model_name, provider), timeout=600, max_retries=3)
+        except EnvironmentError:
+            self.logger.error(f"API key of {PROVIDERS[provider]['label']} not found in environment variables.")
+            raise
+        self.logger.info(f"Successfully loaded {PROVIDERS[provider]['label']} client.")
+        return client
 
     def ask_llm(self, question_prompt: str) -> str:
         """向 LLM 发送格式化后的问题并获取答案"""
@@ -62,54 +56,94 @@ class LLMEvaluator:
         )
         return response.choices[0].message.content.strip()
 
-    def evaluate_questions(self, json_file: str, csv_store_name: str):
-        """评估所有问题并记录结果"""
-        with open(json_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+    def format_question(self, question_data: dict) -> str:
+        """生成格式化的问题"""
+        return question_test_prompt.format(
+            question=question_data["question"],
+            first_choice=question_data["choices"]['A'],
+            second_choice=question_data["choices"]['B'],
+            third_choice=question_data["choices"]['C'],
+            fourth_choice=question_data["choices"]['D'],
+        )
+
+    def evaluate_questions(self, json_file: str, csv_store_name: str, concurrency: int = 1, shard: tuple | None = None, resume: bool = False):
+        """
+        评估所有问题并记录结果。
+        Items are read from json_file (a JSON array or JSONL file) one at a time and up to `concurrency` questions are in flight at once,
+        with at most 4 * concurrency questions queued. Answers are graded and logged in file order, and the
+        CSV row of a source is written as soon as its questions and all earlier ones are graded, so the
+        CSV and the log match a sequential run.
 
+        Args:
+            shard (tuple, optional): (i, N) evaluates only the sources assigned to shard i of N, see shard_of.
+            resume (bool): Skip the items recorded in the checkpoint of a previous, interrupted run.
+        """
         results = {}
-        csv_results = []
         total_correct = 0
         total_questions = 0
+        window = max(1, concurrency) * 4
+        pending = deque()
+
+        csv_filename = f"files/{csv_store_name}"
+        checkpoint_filename = csv_filename + ".checkpoint.jsonl"
+        done_items = set()
+        csvfile = open(csv_filename, "w", newline="", encoding="utf-8")
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(["Source", "Total Questions", "Correct Answers", "Incorrect Answers", "Accuracy"])
 
-        for item in data:
-            source_name = item["source"]["metadata"]["code_source_file"] + "/" + item["source"]["metadata"]["name"]
+        def write_row(source_name):
+            # 计算正确率
+            source_results = results[source_name]
+            accuracy = (source_results["correct"] / source_results["total"]) * 100 if source_results["total"] > 0 else 0
+            csv_writer.writerow([source_name, source_results["total"], source_results["correct"],
+                                 source_results["incorrect"], f"{accuracy:.2f}%"])
+            csvfile.flush()
+
+        def add_counts(source_name, correct, incorrect):
+            nonlocal total_correct, total_questions
             if source_name not in results:
                 results[source_name] = {"correct": 0, "incorrect": 0, "total": 0}
+            results[source_name]["correct"] += correct
+            results[source_name]["incorrect"] += incorrect
+            results[source_name]["total"] += correct + incorrect
+            total_correct += correct
+            total_questions += correct + incorrect
+
+        # 从检查点恢复已完成的条目，并按原顺序重写它们的 CSV 行
+        if resume and os.path.exists(checkpoint_filename):
+            valid_size = 0
+            with open(checkpoint_filename, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    if not line.endswith(b"\n"):
+                        break
+                    done_items.add(record["index"])
+                    add_counts(record["source"], record["correct"], record["incorrect"])
+                    write_row(record["source"])
+                    valid_size += len(line)
+            # 截掉崩溃时写了一半的末行，否则新记录会接在它后面，下次恢复时全部丢失
+            with open(checkpoint_filename, "r+b") as f:
+                f.truncate(valid_size)
+            logging.info(f"Resumed {len(done_items)} items ({total_questions} questions) from {checkpoint_filename}")
+        checkpoint = open(checkpoint_filename, "a" if resume else "w", encoding="utf-8")
 
-            for question_data in item["questions"]:
+        def grade(item_record, question_data, future, is_last):
+            if question_data is not None:
                 question = question_data["question"]
                 correct_answer = question_data["correct_answer"]
-                first_choice = question_data["choices"]['A']
-                second_choice = question_data["choices"]['B']
-                third_choice = question_data["choices"]['C']
-                fourth_choice = question_data["choices"]['D']
-
-                # 生成格式化的问题
-                formatted_question = question_test_prompt.format(
-                    question=question,
-                    first_choice=first_choice,
-                    second_choice=second_choice,
-                    third_choice=third_choice,
-                    fourth_choice=fourth_choice,
-                )
-
                 # 发送到 LLM 获取答案
-                llm_answer = self.ask_llm(formatted_question)
+                llm_answer = future.result()
 
                 # 解析 LLM 的回答，只提取 <answer> 标签中的内容
                 extracted_answer = llm_answer.strip().replace("<answer>", "").replace("</answer>", "").strip()
 
                 # 评估是否正确
                 is_correct = extracted_answer == correct_answer
-
-                results[source_name]["total"] += 1
-                total_questions += 1
-                if is_correct:
-                    results[source_name]["correct"] += 1
-                    total_correct += 1
-                else:
-                    results[source_name]["incorrect"] += 1
+                add_counts(item_record["source"], int(is_correct), int(not is_correct))
+                item_record["correct" if is_correct else "incorrect"] += 1
 
                 # 记录日志
                 logging.info(f"Question: {question}")
@@ -117,33 +151,115 @@ class LLMEvaluator:
                 logging.info(f"Correct Answer: {correct_answer}")
                 logging.info(f"Result: {'✔ Correct' if is_correct else '❌ Incorrect'}\n")
 
-            # 计算正确率
-            accuracy = (results[source_name]["correct"] / results[source_name]["total"]) * 100
-            csv_results.append([source_name, results[source_name]["total"], results[source_name]["correct"],
-                                results[source_name]["incorrect"], f"{accuracy:.2f}%"])
-        
-        # 计算整体成功率
-        overall_accuracy = (total_correct / total_questions) * 100 if total_questions > 0 else 0
-        logging.info(f"Overall Accuracy: {overall_accuracy:.2f}%")
-        print(f"Overall Accuracy: {overall_accuracy:.2f}%")
-        
-        # 保存到 CSV
-        csv_filename = f"files/{csv_store_name}"
-        with open(csv_filename, "w", newline="", encoding="utf-8") as csvfile:
-            csv_writer = csv.writer(csvfile)
-            csv_writer.writerow(["Source", "Total Questions", "Correct Answers", "Incorrect Answers", "Accuracy"])
-            csv_writer.writerows(csv_results)
+            if is_last:
+                add_counts(item_record["source"], 0, 0)
+                write_row(item_record["source"])
+                checkpoint.write(json.dumps(item_record) + "\n")
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+
+        def drain(limit):
+            while len(pending) > limit:
+                grade(*pending.popleft())
+
+        executor = ThreadPoolExecutor(max_workers=max(1, concurrency))
+        try:
+            for item_index, item in enumerate(iter_qa_items(json_file)):
+                source = item_source(item)
+                if item_index in done_items or (shard and shard_of(source, shard[1]) != shard[0]):
+                    continue
+                item_record = {"index": item_index, "source": source, "correct": 0, "incorrect": 0}
+
+                questions = item["questions"]
+                if not questions:
+                    pending.append((item_record, None, None, True))
+                for index, question_data in enumerate(questions):
+                    future = executor.submit(self.ask_llm, self.format_question(question_data))
+                    pending.append((item_record, question_data, future, index == len(questions) - 1))
+                    drain(window)
+            drain(0)
+
+            # 计算整体成功率
+            overall_accuracy = (total_correct / total_questions) * 100 if total_questions > 0 else 0
+            logging.info(f"Overall Accuracy: {overall_accuracy:.2f}%")
+            print(f"Overall Accuracy: {overall_accuracy:.2f}%")
             csv_writer.writerow(["Overall", total_questions, total_correct, total_questions - total_correct, f"{overall_accuracy:.2f}%"])
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            csvfile.close()
+            checkpoint.close()
 
         logging.info(f"Results saved to {csv_filename}")
         print(f"Results saved to {csv_filename}")
 
+def shard_of(source_name: str, num_shards: int) -> int:
+    """Assign a source to a shard by a stable hash, so all questions of a source are evaluated on the same machine."""
+    return zlib.crc32(source_name.encode("utf-8")) % num_shards
+
+def parse_shard(value: str) -> tuple:
+    """Parse 'i/N' into (i, N), with 0 <= i < N."""
+    index, num_shards = (int(part) for part in value.split("/"))
+    if not 0 <= index < num_shards:
+        raise argparse.ArgumentTypeError(f"Invalid shard {value}: expected i/N with 0 <= i < N.")
+    return index, num_shards
+
+def shard_csv_name(csv_store_name: str, shard: tuple) -> str:
+    """evaluation_results.csv -> evaluation_results_shard0of4.csv"""
+    stem, extension = os.path.splitext(csv_store_name)
+    return f"{stem}_shard{shard[0]}of{shard[1]}{extension}"
+
+def merge_result_csvs(csv_files: list, output_file: str):
+    """
+    合并多个分片的 CSV 结果。
+    Rows of a source within one file are cumulative, so the last one counts. Sources are summed across files,
+    written once each in order of first appearance, followed by the overall accuracy.
+    """
+    merged = {}
+    for csv_file in csv_files:
+        last_rows = {}
+        with open(csv_file, "r", newline="", encoding="utf-8") as f:
+            for row in list(csv.reader(f))[1:]:
+                if row[0] != "Overall":
+                    last_rows[row[0]] = (int(row[2]), int(row[3]))
+        for source_name, (correct, incorrect) in last_rows.items():
+            counts = merged.setdefault(source_name, [0, 0])
+            counts[0] += correct
+            counts[1] += incorrect
+
+    total_correct = sum(correct for correct, _ in merged.values())
+    total_questions = sum(correct + incorrect for correct, incorrect in merged.values())
+    with open(output_file, "w", newline="", encoding="utf-8") as csvfile:
+        csv_writer = csv.writer(csvfile)
+        csv_writer.writerow(["Source", "Total Questions", "Correct Answers", "Incorrect Answers", "Accuracy"])
+        for source_name, (correct, incorrect) in merged.items():
+            accuracy = (correct / (correct + incorrect)) * 100 if correct + incorrect > 0 else 0
+            csv_writer.writerow([source_name, correct + incorrect, correct, incorrect, f"{accuracy:.2f}%"])
+        overall_accuracy = (total_correct / total_questions) * 100 if total_questions > 0 else 0
+        csv_writer.writerow(["Overall", total_questions, total_correct, total_questions - total_correct, f"{overall_accuracy:.2f}%"])
+    print(f"Overall Accuracy: {overall_accuracy:.2f}%")
+    print(f"Merged {len(csv_files)} files into {output_file}")
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate an LLM on the QA benchmark configured in settings.py. Example input: --shard 0/4 --resume")
+    parser.add_argument("--shard", type=parse_shard, default=None, help="Evaluate only shard i of N (0-based), e.g. 0/4. Results go to <CSV_FILE_NAME>_shard<i>of<N>.csv.")
+    parser.add_argument("--resume", action="store_true", default=False, help="Continue an interrupted run from its checkpoint instead of starting over.")
+    parser.add_argument("--merge", nargs="+", default=None, metavar="CSV", help="Merge the given shard CSVs into one table instead of evaluating.")
+    parser.add_argument("--output", type=str, default=None, help="Output file of --merge. Default is files/<CSV_FILE_NAME>.")
+    args = parser.parse_args()
+    if args.merge:
+        merge_result_csvs(args.merge, args.output or f"files/{test_settings.csv_filename}")
+        sys.exit(0)
+
     model_name = test_settings.model_name
     model_type = test_settings.model_type
     test_file_path = test_settings.test_file_path
     logger_file = test_settings.logger_file
     csv_filename = test_settings.csv_filename
+    if args.shard:
+        csv_filename = shard_csv_name(csv_filename, args.shard)
+    llm_cache = test_settings.llm_cache
+    llm_cache_ttl = test_settings.llm_cache_ttl
+    concurrency = test_settings.concurrency
     
     # 设置日志
     log_filename = f"logs/{logger_file}"
@@ -158,5 +274,5 @@ if __name__ == "__main__":
         "temperature": 0.7,
     }
     
-    evaluator = LLMEvaluator(model_args, logger, model_type)
-    evaluator.evaluate_questions(json_file=f"../../generated_qa/{test_file_path}", csv_store_name=csv_filename)
+    evaluator = LLMEvaluator(model_args, logger, model_type, llm_cache, llm_cache_ttl)
+    evaluator.evaluate_questions(json_file=f"../../generated_qa/{test_file_path}", csv_store_name=csv_filename, concurrency=concurrency, shard=args.shard, resume=args.resume)
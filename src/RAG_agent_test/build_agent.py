@@ -5,10 +5,12 @@ from mtb_logger import MatToolBenLogger
 import argparse
 import os
 from src.call_llms import load_chat_llm, load_embedding_model
-from langchain_chroma import Chroma
+from src.generation_checkpoint import GenerationCheckpoint
+from src.retrievers import load_vector_store, vector_store_version
+from src.retrieval_store import RetrievalStore, StoredVectorStore
+from src.instrumentation import configure, span, record_usage
 import tiktoken
 from langgraph.graph import START, StateGraph, END
-import json
 import re
 
 # Prompts templates
@@ -138,7 +140,8 @@ class State(TypedDict):
     
 # Define application steps
 def retrieve(state: State):
-    retrieved_docs = vector_store.similarity_search(state["question"], k=5)
+    with span("retrieve", k=5):
+        retrieved_docs = vector_store.similarity_search(state["question"], k=5)
     source = ["This code belongs to the module: " + doc.metadata["source"] for doc in retrieved_docs]
     first_function_or_class = ["The top-level function or class of this code: " + doc.metadata.get("first_function_or_class", "None") for doc in retrieved_docs]
     contexts = []
@@ -150,7 +153,8 @@ def retrieve(state: State):
     return {"context": contexts, "retriever_type": "code"}
 
 def retrieve_doc(state: State):
-    retrieved_docs = vector_store.similarity_search(state["question"], k=5)
+    with span("retrieve", k=5):
+        retrieved_docs = vector_store.similarity_search(state["question"], k=5)
     source = ["Source of this document: " + doc.metadata["title"] for doc in retrieved_docs]
     contexts = []
     for i in range(len(retrieved_docs)):
@@ -161,7 +165,8 @@ def retrieve_doc(state: State):
     return {"context": contexts, "retriever_type": "doc"}
 
 def retrieve_llm_doc(state: State):
-    retrieved_docs = vector_store.similarity_search(state["question"], k=5)
+    with span("retrieve", k=5):
+        retrieved_docs = vector_store.similarity_search(state["question"], k=5)
     code_source_file = ["Source of this document: " + doc.metadata["code_source_file"] for doc in retrieved_docs]
     contexts = []
     for i in range(len(retrieved_docs)):
@@ -179,7 +184,9 @@ def generate(state: State):
         messages = [{'role': 'system', 'content': SYSTEM_PROMPT}, {'role': 'user', 'content': USER_PROMPT_DOC.format(question=state["question"], retrieved_code_documents=retrieved_content)}]
     else:
         messages = [{'role': 'system', 'content': SYSTEM_PROMPT}, {'role': 'user', 'content': USER_PROMPT_LLM_DOC.format(question=state["question"], retrieved_code_documents=retrieved_content)}]
-    response = llm.invoke(messages)
+    with span("generate", model=model_name):
+        response = llm.invoke(messages)
+        record_usage(response)
     mtb_logger.info("Received response from LLM: {}".format(response.content.replace('\n', ' ')))
     mtb_logger.info(f"Response metadata: {response.response_metadata} | Additional kwargs: {response.additional_kwargs} | ID: {response.id} | model_config: {response.model_config}")
     return {"answer": response.content}
@@ -192,7 +199,9 @@ def generate_o1(state: State):
         messages = [{'role': 'system', 'content': SYSTEM_PROMPT}, {'role': 'user', 'content': USER_PROMPT_DOC.format(question=state["question"], retrieved_code_documents=retrieved_content)}]
     else:
         messages = [{'role': 'system', 'content': SYSTEM_PROMPT}, {'role': 'user', 'content': USER_PROMPT_LLM_DOC.format(question=state["question"], retrieved_code_documents=retrieved_content)}]
-    response = llm.invoke(messages)
+    with span("generate", model=model_name):
+        response = llm.invoke(messages)
+        record_usage(response)
     mtb_logger.info("Received response from LLM: {}".format(response.content.replace('\n', ' ')))
     mtb_logger.info(f"Response metadata: {response.response_metadata} | Additional kwargs: {response.additional_kwargs} | ID: {response.id} | model_config: {response.model_config}")
     return {"answer": response.content}
@@ -229,6 +238,20 @@ if __name__ == "__main__":
     parser.add_argument('--temperature', type=lambda x: max(0, float(x)), default=0.7,
                       help='Temperature setting for the model. Default is 0.7. Minimum value is 0.')
     parser.add_argument('--retriever_type', type=str, default='code', help='Type of retriever to use. Default is code. Options: [code, doc, llm-doc, llm-doc-full].')
+    parser.add_argument('--resume', action='store_true', default=False,
+                      help='Keep the answers already in function_generation_results.jsonl and only ask the remaining questions.')
+    parser.add_argument('--vector_backend', type=str, default='chroma',
+                      help='Vector store backend. Default is chroma. Options: [chroma, faiss]. faiss needs an index exported with `python retrievers.py build`.')
+    parser.add_argument('--embedding_cache', type=str, default=None,
+                      help='SQLite file of a query embedding cache (e.g. embedding_cache/embeddings.sqlite3). Texts embedded before are not sent to the API again.')
+    parser.add_argument('--llm_cache', type=str, default=None,
+                      help='SQLite file of an LLM response cache (e.g. llm_cache/responses.sqlite3). Identical requests are replayed from it instead of calling the provider.')
+    parser.add_argument('--llm_cache_ttl', type=float, default=None,
+                      help='Seconds after which entries of --llm_cache are requested again. Default is no expiry.')
+    parser.add_argument('--retrieval_store', type=str, default=None,
+                      help='SQLite file of precomputed retrieval results (e.g. retrieval_store/retrievals.sqlite3, filled by `python retrieval_store.py prefetch`). Stored questions skip retrieval.')
+    parser.add_argument('--events_file', type=str, default=None,
+                      help='File name in the result directory the question, retrieve and generate spans are appended to, e.g. events.jsonl. Summarize it with `python instrumentation.py report`.')
     args = parser.parse_args()
     model_name = args.model_name
     temperature = args.temperature
@@ -258,51 +281,52 @@ if __name__ == "__main__":
     # initialize logger
     mtb_logger = MatToolBenLogger()
     mtb_logger.set_logger(file_path=store_path, filename='RAG_generation.log')
+    configure(args.events_file and os.path.join(store_path, args.events_file), model=model_name, method=f"rag-{retriever_type}")
     
     # load LLM model
-    llm = load_chat_llm(model_name, temperature)
+    llm = load_chat_llm(model_name, temperature, cache_path=args.llm_cache, cache_ttl=args.llm_cache_ttl)
     mtb_logger.info(f"Loaded LLM client: {model_name}")
     mtb_logger.info(f"Model args: model_name={model_name}, temperature={temperature}")
     # load embedding model
-    embedding_model = load_embedding_model("text-embedding-3-large")
+    embedding_model = load_embedding_model("text-embedding-3-large", cache_path=args.embedding_cache)
     mtb_logger.info(f"Loaded embedding model: text-embedding-3-large")
     # load vector store
-    if retriever_type == 'code':
-        vector_store = Chroma(collection_name='pymatgen', embedding_function=embedding_model, persist_directory="vector_store/vs_method1/")
-    elif retriever_type == 'doc':
-        vector_store = Chroma(collection_name='pymatgen-doc', embedding_function=embedding_model, persist_directory="vector_store/vs_method2/")
-    elif retriever_type == 'llm-doc':
-        vector_store = Chroma(collection_name='pymatgen_llm_doc', embedding_function=embedding_model, persist_directory="vector_store/vs_method3/")
-    elif retriever_type == 'llm-doc-full':
-        vector_store = Chroma(collection_name='pymatgen_llm_doc_full', embedding_function=embedding_model, persist_directory="vector_store/vs_method4/")
+    if args.retrieval_store:
+        # the vector store is only loaded if a question is missing from the retrieval store
+        store_version = vector_store_version(retriever_type, args.vector_backend)
+        vector_store = StoredVectorStore(RetrievalStore(args.retrieval_store), retriever_type, store_version,
+                                         lambda: load_vector_store(retriever_type, embedding_model, backend=args.vector_backend))
+        mtb_logger.info(f"Reading retrieval results of {args.vector_backend} vector store version {store_version} from {args.retrieval_store}")
     else:
-        raise ValueError(f"Invalid retriever_type: {retriever_type}. Expected one of ['code', 'doc', 'llm-doc', 'llm-doc-full'].")
+        vector_store = load_vector_store(retriever_type, embedding_model, backend=args.vector_backend)
+        mtb_logger.info(f"Loaded {args.vector_backend} vector store for retriever type: {retriever_type}")
     # Compile application and test
     graph = build_graph(o1=o1, retriever_type=retriever_type)
     # graph.get_graph().draw_mermaid_png(output_file_path=os.path.join(store_path, "visualization.png"))
     
     # Run the test
+    output_file = os.path.join(store_path, "function_generation_results.jsonl")
+    checkpoint = GenerationCheckpoint(output_file, resume=args.resume)
     try:
-        # Evaluate all questions
-        results = []
+        # Evaluate all questions, appending every answer as soon as it is extracted
         for index, question_file_path in enumerate(questions_files_path, start=1):
+            if checkpoint.is_done(question_file_path):
+                mtb_logger.info(f"Skipping question {index}/{len(questions_files_path)}: already answered in {output_file}")
+                continue
             mtb_logger.info(f"Processing question {index}/{len(questions_files_path)}")
             mtb_logger.info(f"Path to question file: {question_file_path}")
             with open(question_file_path, 'r') as file:
                 message = file.read().strip()
             mtb_logger.info("Question: {}".format(message.replace('\n', ' ')))
-            result = graph.invoke({"question": message})
-            results.append(result['answer'])
+            with span("question", question_file=question_file_path):
+                result = graph.invoke({"question": message})
+            checkpoint.record(question_file_path, *extract_response(result['answer']))
         
-        results = [extract_response(r) for r in results]
-        output_data = [
-                    {"question_file_path": os.path.basename(os.path.dirname(q)), "function": r[0], "function_name": r[1]}
-                    for q, r in zip(questions_files_path, results)
-                ]
-        output_file = os.path.join(store_path, "function_generation_results.jsonl")
-        with open(output_file, "w", encoding="utf-8") as f:
-            for entry in output_data:
-                f.write(json.dumps(entry) + "\n")
+        checkpoint.finalize(questions_files_path)
+        if args.retrieval_store:
+            mtb_logger.info(f"Retrieval store hits: {vector_store.hits}, misses: {vector_store.misses}")
         mtb_logger.info("All tasks completed successfully.")
     except Exception as e:
-        mtb_logger.error(f"An error occurred for model {model_name}: {e}")
\ No newline at end of file
+        mtb_logger.error(f"An error occurred for model {model_name}: {e}")
+    finally:
+        checkpoint.close()
\ No newline at end of file
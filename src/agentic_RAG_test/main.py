@@ -1,10 +1,14 @@
 import os
+import asyncio
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from typing_extensions import List
 from mtb_logger import MatToolBenLogger
 from rag import PymatgenRepoAssistant
-from langchain_chroma import Chroma
+from rerankers import RERANKER_TYPES, load_reranker
 from src.call_llms import load_llm, load_embedding_model
+from src.retrievers import load_vector_store
+from src.instrumentation import configure, span
 import json    
 
 def load_questions_path_from_directories(base_dir: str) -> List[str]:
@@ -20,6 +24,34 @@ def load_questions_path_from_directories(base_dir: str) -> List[str]:
     questions_files_path = [os.path.join(root, 'question.txt') for root, _, files in os.walk(base_dir) if 'question.txt' in files]
     return questions_files_path
 
+async def answer_all_questions(assistant: PymatgenRepoAssistant, questions_files_path: List[str], logger: MatToolBenLogger, concurrency: int = 1) -> List[List[str]]:
+    """
+    Answer the questions with at most `concurrency` of them in flight.
+
+    Args:
+        assistant (PymatgenRepoAssistant): The assistant answering each question with respond_async.
+        questions_files_path (List[str]): A list of file paths to question files.
+        concurrency (int): Maximum number of questions processed at the same time.
+
+    Returns:
+        List[List[str]]: The [function, function_name] results in question order.
+    """
+    # every question runs at most two branches of blocking calls at the same time
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=2 * concurrency + 2))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(index: int, question_file_path: str) -> List[str]:
+        async with semaphore:
+            logger.info(f"Processing question {index}/{len(questions_files_path)}")
+            logger.info(f"Path to question file: {question_file_path}")
+            with open(question_file_path, 'r') as file:
+                message = file.read().strip()
+            logger.info("Question: {}".format(message.replace('\n', ' ')))
+            with span("question", question_file=question_file_path):
+                return await assistant.respond_async(message)
+
+    return await asyncio.gather(*(answer(i, q) for i, q in enumerate(questions_files_path, start=1)))
+
 if __name__ == "__main__":
         # replace the model name with the model you want to test
     parser = argparse.ArgumentParser(description='Run LLM evaluation with specified model. Example input: --model_names gpt-4o-mini-2024-07-18')
@@ -28,6 +60,22 @@ if __name__ == "__main__":
     parser.add_argument('--temperature', type=lambda x: max(0, float(x)), default=0.7,
                       help='Temperature setting for the model. Default is 0.7. Minimum value is 0.')
     parser.add_argument('--retriever_type', type=str, default='llm-doc-full', help='Type of retriever to use. Default is code. Options: [llm-doc, llm-doc-full].')
+    parser.add_argument('--vector_backend', type=str, default='chroma',
+                      help='Vector store backend. Default is chroma. Options: [chroma, faiss]. faiss needs an index exported with `python retrievers.py build`.')
+    parser.add_argument('--embedding_cache', type=str, default=None,
+                      help='SQLite file of a query embedding cache (e.g. embedding_cache/embeddings.sqlite3). Texts embedded before are not sent to the API again.')
+    parser.add_argument('--llm_cache', type=str, default=None,
+                      help='SQLite file of an LLM response cache (e.g. llm_cache/responses.sqlite3). Identical requests are replayed from it instead of calling the provider.')
+    parser.add_argument('--llm_cache_ttl', type=float, default=None,
+                      help='Seconds after which entries of --llm_cache are requested again. Default is no expiry.')
+    parser.add_argument('--concurrency', type=int, default=1,
+                      help='Number of questions answered at the same time. Default is 1. Independent steps of each question always run concurrently.')
+    parser.add_argument('--reranker', type=str, default='llm',
+                      help=f'Reranker of the retrieved documents and code. Default is llm. Options: {RERANKER_TYPES}. embedding ranks locally by cosine similarity.')
+    parser.add_argument('--symbol_fallbacks', action='store_true', default=False,
+                      help='When an extracted name is not found as is, also look up code by its qualified name and by a fuzzy match. Default is exact lookup only.')
+    parser.add_argument('--events_file', type=str, default=None,
+                      help='File name in the result directory the question, retrieve, rerank and generate spans are appended to, e.g. events.jsonl. Summarize it with `python instrumentation.py report`.')
     args = parser.parse_args()
     model_name = args.model_name
     temperature = args.temperature
@@ -53,21 +101,20 @@ if __name__ == "__main__":
     # initialize logger
     mtb_logger = MatToolBenLogger()
     mtb_logger.set_logger(file_path=store_path, filename='agentic_RAG_generation.log')
+    configure(args.events_file and os.path.join(store_path, args.events_file), model=model_name, method=f"agentic-{retriever_type}")
     
 
     # load LLM model
-    llm = load_llm(llm_name=model_name)
+    llm = load_llm(llm_name=model_name, cache_path=args.llm_cache, cache_ttl=args.llm_cache_ttl)
     model_args = {"model": model_name, "temperature": temperature}
     mtb_logger.info(f"Loaded LLM client: {model_name}")
     mtb_logger.info(f"Model args: model_name={model_name}, temperature={temperature}")
     # load embedding model
-    embedding_model = load_embedding_model("text-embedding-3-large")
+    embedding_model = load_embedding_model("text-embedding-3-large", cache_path=args.embedding_cache)
     mtb_logger.info(f"Loaded embedding model: text-embedding-3-large")
     # load vector store
-    if retriever_type == 'llm-doc':
-        vector_store = Chroma(collection_name='pymatgen_llm_doc', embedding_function=embedding_model, persist_directory="vector_store/vs_method3/")
-    elif retriever_type == 'llm-doc-full':
-        vector_store = Chroma(collection_name='pymatgen_llm_doc_full', embedding_function=embedding_model, persist_directory="vector_store/vs_method4/")
+    if retriever_type in ('llm-doc', 'llm-doc-full'):
+        vector_store = load_vector_store(retriever_type, embedding_model, backend=args.vector_backend)
     else:
         raise ValueError(f"Invalid retriever_type: {retriever_type}. Expected one of ['code', 'doc', 'llm-doc'].")
     
@@ -76,19 +123,13 @@ if __name__ == "__main__":
     elif retriever_type == 'llm-doc-full':
         dp_path = "./documents_llm_doc_gemini_20_flash_full.json"
     # Initialize the PymatgenRepoAssistant
-    assistant = PymatgenRepoAssistant(llm=llm, db_path=dp_path, logger=mtb_logger, vectorstore=vector_store, model_args=model_args)
+    reranker = load_reranker(args.reranker, llm, model_args, mtb_logger, embedding_model=embedding_model)
+    mtb_logger.info(f"Reranker: {args.reranker}")
+    assistant = PymatgenRepoAssistant(llm=llm, db_path=dp_path, logger=mtb_logger, vectorstore=vector_store, model_args=model_args, reranker=reranker, symbol_fallbacks=args.symbol_fallbacks)
     mtb_logger.info(f"---------Initialized PymatgenRepoAssistant successfully.---------")
     
     # Evaluate all questions
-    results = []
-    for index, question_file_path in enumerate(questions_files_path, start=1):
-        mtb_logger.info(f"Processing question {index}/{len(questions_files_path)}")
-        mtb_logger.info(f"Path to question file: {question_file_path}")
-        with open(question_file_path, 'r') as file:
-            message = file.read().strip()
-        mtb_logger.info("Question: {}".format(message.replace('\n', ' ')))
-        result = assistant.respond(message)
-        results.append(result)
+    results = asyncio.run(answer_all_questions(assistant, questions_files_path, mtb_logger, args.concurrency))
         
     output_data = [
                 {"question_file_path": os.path.basename(os.path.dirname(q)), "function": r[0], "function_name": r[1]}
@@ -24,6 +24,22 @@ relevance_ranking_instruction = (
 
 relevance_ranking_guideline = "Query: {query}\n\nDocs: {docs}"
 
+batched_relevance_ranking_instruction = (
+    "You are an expert relevance ranker. Given a query and several numbered lists of documents, your job is to determine how relevant each document is for answering the query. "
+    "Every document is preceded by its id in square brackets, e.g. [0-3] is document 3 of list 0. "
+    "Your output must be a valid JSON object with the key 'scores', giving one score for every document id and strictly following this format:\n\n"
+    "{\n"
+    "  \"scores\": [\n"
+    "    {\"id\": \"0-0\", \"relevance_score\": 85.5},\n"
+    "    {\"id\": \"0-1\", \"relevance_score\": 72.0},\n"
+    "    {\"id\": \"1-0\", \"relevance_score\": 45.0}\n"
+    "  ]\n"
+    "}\n\n"
+    "Do not include any additional text before or after the JSON output. The JSON output must be directly parsable using `json.loads`."
+)
+
+batched_relevance_ranking_guideline = "Query: {query}\n\n{document_lists}"
+
 rag_prompt_str = (
     "You are a helpful assistant in the Pymatgen repository Q&A. Users will ask questions about something contained in the Pymatgen repository. "
     "You will be shown the user's question and the relevant information from the repository. Answer the user's question only with the given information.\n\n"
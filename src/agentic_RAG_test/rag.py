@@ -2,73 +2,41 @@ import sys
 sys.path.append("..")
 
 from text_analysis_tool import TextAnalysisTool
-from prompt import query_generation_prompt_str, relevance_ranking_instruction, relevance_ranking_guideline, rag_prompt_str, rag_ar_prompt_str
+from prompt import query_generation_prompt_str, rag_prompt_str, rag_ar_prompt_str
+from rerankers import Reranker, LLMReranker
 from langchain_chroma import Chroma
 from langchain_core.documents import Document
+from src.retrievers import multi_query_search
+from src.instrumentation import span, record_usage
 from typing_extensions import List
 import json
-import time
+import asyncio
 from openai import OpenAI
 from mtb_logger import MatToolBenLogger
 
 class PymatgenRepoAssistant:
-    def __init__(self, llm: OpenAI, db_path: str, logger: MatToolBenLogger, vectorstore: Chroma, model_args):
+    def __init__(self, llm: OpenAI, db_path: str, logger: MatToolBenLogger, vectorstore: Chroma, model_args, reranker: Reranker | None = None, symbol_fallbacks: bool = False):
         self.llm = llm
         self.logger = logger
         self.vectorstore = vectorstore
-        self.textanslys = TextAnalysisTool(self.llm, db_path, model_args)
+        # symbol_fallbacks: also resolve extracted names that are qualified or slightly misspelled, see json_handler.SymbolIndex
+        self.textanslys = TextAnalysisTool(self.llm, db_path, model_args, qualified_lookup=symbol_fallbacks, fuzzy_lookup=symbol_fallbacks)
         self.model_args = model_args
+        # default: the chat LLM scores the documents, see rerankers.py for the batched LLM and local embedding rerankers
+        self.reranker = reranker or LLMReranker(llm, model_args, logger)
 
 
     def rerank(self, query, docs):
-        max_retries = 10
-        retry_count = 0
-
-        while retry_count < max_retries:
-            try:
-                messages = [
-                    {"role": "system", "content": relevance_ranking_instruction},
-                    {"role": "user", "content": relevance_ranking_guideline.format(query=query, docs=docs)}
-                ]
-                if self.model_args['model'] == "gemini-2.0-flash-thinking-exp-01-21":
-                    response = self.llm.chat.completions.create(messages=messages, **self.model_args)
-                else:
-                    response = self.llm.chat.completions.create(messages=messages, response_format={"type": "json_object"}, **self.model_args)
-                # 尝试解析 JSON
-                scores = json.loads(response.choices[0].message.content)['documents']
-
-                if not isinstance(scores, list):
-                    raise ValueError("Response is not a valid list of documents")
-
-                # 确保 JSON 数据格式正确
-                for doc in scores:
-                    if not isinstance(doc, dict) or "content" not in doc or "relevance_score" not in doc:
-                        raise ValueError("Invalid document format in JSON response")
-
-                self.logger.info(f"Scores: {scores}")
-
-                # 按相关性得分排序
-                sorted_data = sorted(scores, key=lambda x: x["relevance_score"], reverse=True)
-
-                # 取前5个文档的内容
-                top_5_contents = [doc["content"] for doc in sorted_data[:5]] if len(sorted_data) >= 5 else [doc["content"] for doc in sorted_data]
-
-                return top_5_contents
-
-            except (json.JSONDecodeError, ValueError) as e:
-                self.logger.warning(f"JSON 解析失败，尝试第 {retry_count + 1} 次: {e}")
-                retry_count += 1
-                time.sleep(1)  # 等待 1 秒后重试
-
-        # 如果重试 5 次仍然失败，则返回整个文档列表
-        self.logger.error("无法解析 JSON 数据，返回原始文档列表")
-        return docs
+        with span("rerank", documents=len(docs)):
+            return self.reranker.rerank(query, docs)
 
     def rag(self, query, retrieved_documents):
         rag_prompt = rag_prompt_str.format(
             query=query, information="\n\n".join(retrieved_documents)
         )
-        response = self.llm.chat.completions.create(messages=[{"role": "user", "content": rag_prompt}], **self.model_args)
+        with span("generate", step="rag"):
+            response = self.llm.chat.completions.create(messages=[{"role": "user", "content": rag_prompt}], **self.model_args)
+            record_usage(response)
         return response.choices[0].message.content
     
     def list_to_markdown(self, list_items):
@@ -86,17 +54,21 @@ class PymatgenRepoAssistant:
             related_code=related_code,
             embedding_recall=embedding_recall,
         )
-        if self.model_args['model'] == "gemini-2.0-flash-thinking-exp-01-21":
-            response = self.llm.chat.completions.create(messages=[{"role": "user", "content": rag_ar_prompt}], **self.model_args)
-        else:
-            response = self.llm.chat.completions.create(messages=[{"role": "user", "content": rag_ar_prompt}], response_format={"type": "json_object"}, **self.model_args)
+        with span("generate", step="rag_ar"):
+            if self.model_args['model'] == "gemini-2.0-flash-thinking-exp-01-21":
+                response = self.llm.chat.completions.create(messages=[{"role": "user", "content": rag_ar_prompt}], **self.model_args)
+            else:
+                response = self.llm.chat.completions.create(messages=[{"role": "user", "content": rag_ar_prompt}], response_format={"type": "json_object"}, **self.model_args)
+            record_usage(response)
         return response.choices[0].message.content
     
     def generate_queries(self, query_str: str, num_queries: int = 4):
         fmt_prompt = query_generation_prompt_str.format(
             num_queries=num_queries, query=query_str
         )
-        response = self.llm.chat.completions.create(messages=[{"role": "user", "content": fmt_prompt}], **self.model_args)
+        with span("generate", step="generate_queries"):
+            response = self.llm.chat.completions.create(messages=[{"role": "user", "content": fmt_prompt}], **self.model_args)
+            record_usage(response)
         queries = response.choices[0].message.content.split("\n")
         return [query for query in queries if query != "```" and query != ""]
 
@@ -139,74 +111,82 @@ class PymatgenRepoAssistant:
         self.logger.info(f"Final bot_message after RAG_AR: {bot_message}")
         return final_results
     
+    def extract_keyword(self, text, source):
+        """Ask for the most relevant Pymatgen class or function of text; returns '' when the answer cannot be parsed."""
+        try:
+            return str(json.loads(self.textanslys.nerquery(text))['name'])
+        except (json.JSONDecodeError, KeyError) as e:
+            self.logger.error(f"Failed to parse JSON for {source}: {e}")
+            return ""
+
     def respond(self, message, instruction=None):
         """
         Respond to a user query by the following steps:
         Query generation → Keyword extraction → Document retrieval → Reranking → Code retrieval → Response generation
         """
+        return asyncio.run(self.respond_async(message, instruction))
+
+    async def respond_async(self, message, instruction=None):
+        """
+        The steps of respond, run as a dependency graph so that independent LLM calls overlap:
+        the keyword branch (keyword extraction → NER → code lookup) runs alongside the retrieval branch
+        (query generation → retrieval → rerank → RAG → NER → code lookup), and the two final reranks run together.
+        Blocking calls are run in worker threads, so the latency of a question approaches its critical path.
+        """
         self.logger.info("Starting response generation.")
         
         # Step 1: Format the chat prompt
         prompt = self.textanslys.format_chat_prompt(message, instruction)
         self.logger.info(f"Formatted prompt: {prompt}")
-        
-        questions = self.textanslys.keyword(prompt)
-        self.logger.info(f"Generated keywords from prompt: {questions}")
-        
-        # Step 2: Generate additional queries
-        prompt_queries = self.generate_queries(prompt, 4)
-        self.logger.info(f"Generated queries: {prompt_queries}")
-        
-        all_results: List[Document] = []
-        
-        # Step 3: Query the VectorStoreManager for each query
-        for query in prompt_queries:
-            self.logger.info(f"Querying vector store with: {query}")
-            query_results = self.vectorstore.similarity_search(query, k=5)
-            for result in query_results:
-                self.logger.info(f"Results for query '{query}': {result.page_content}")
-            all_results.extend(query_results)
-
-        # Step 4: Deduplicate results by content
-        unique_results = {result.page_content: result for result in all_results}.values()
-        unique_documents = [result.page_content for result in unique_results]
-        self.logger.info(f"Unique documents: {unique_documents}")
-        
-        unique_code = [
-            "--------------\n\n" + result.metadata['code_source_file'] + "\n\n" + result.metadata['code_content'] + "--------------\n\n" for result in unique_results
-        ]
-        self.logger.info(f"Unique code content: {unique_code}")
-        
-        # Step 5: Rerank documents based on relevance
-        retrieved_documents = self.rerank(message, unique_documents)
-        self.logger.info(f"Reranked documents: {retrieved_documents}")
-        
-        # Step 6: Generate a response using RAG (Retrieve and Generate)
-        response = self.rag(prompt, retrieved_documents)
-        chunkrecall = self.list_to_markdown(retrieved_documents)
-        self.logger.info(f"RAG-generated response: {response}")
-        self.logger.info(f"Markdown chunk recall: {chunkrecall}")
-        
-        bot_message = str(response)
-        self.logger.info(f"Initial bot_message: {bot_message}")
-        
-        # Step 7: Perform NER and queryblock processing
-        try:
-            keyword = str(json.loads(self.textanslys.nerquery(bot_message))['name'])
-        except (json.JSONDecodeError, KeyError) as e:
-            self.logger.error(f"Failed to parse JSON for bot_message: {e}")
-            keyword = ""
-
-        try:
-            keywords = str(json.loads(self.textanslys.nerquery(str(prompt) + str(questions)))['name'])
-        except (json.JSONDecodeError, KeyError) as e:
-            self.logger.error(f"Failed to parse JSON for prompt and questions: {e}")
-            keywords = ""
 
+        async def keyword_branch():
+            questions = await asyncio.to_thread(self.textanslys.keyword, prompt)
+            self.logger.info(f"Generated keywords from prompt: {questions}")
+            keywords = await asyncio.to_thread(self.extract_keyword, str(prompt) + str(questions), "prompt and questions")
+            codey, mdy = await asyncio.to_thread(self.textanslys.queryblock, keywords)
+            return keywords, codey, mdy
+
+        async def retrieval_branch():
+            # Step 2: Generate additional queries
+            prompt_queries = await asyncio.to_thread(self.generate_queries, prompt, 4)
+            self.logger.info(f"Generated queries: {prompt_queries}")
+
+            # Step 3 and 4: Query the vector store with all queries at once, fuse and deduplicate the rankings
+            self.logger.info(f"Querying vector store with: {prompt_queries}")
+            with span("retrieve", queries=len(prompt_queries), k=5):
+                unique_results: List[Document] = await asyncio.to_thread(multi_query_search, self.vectorstore, prompt_queries, 5)
+            for result in unique_results:
+                self.logger.info(f"Fused retrieval result: {result.page_content}")
+            unique_documents = [result.page_content for result in unique_results]
+            self.logger.info(f"Unique documents: {unique_documents}")
+
+            unique_code = [
+                "--------------\n\n" + result.metadata['code_source_file'] + "\n\n" + result.metadata['code_content'] + "--------------\n\n" for result in unique_results
+            ]
+            self.logger.info(f"Unique code content: {unique_code}")
+
+            # Step 5: Rerank documents based on relevance
+            retrieved_documents = await asyncio.to_thread(self.rerank, message, unique_documents)
+            self.logger.info(f"Reranked documents: {retrieved_documents}")
+
+            # Step 6: Generate a response using RAG (Retrieve and Generate)
+            response = await asyncio.to_thread(self.rag, prompt, retrieved_documents)
+            chunkrecall = self.list_to_markdown(retrieved_documents)
+            self.logger.info(f"RAG-generated response: {response}")
+            self.logger.info(f"Markdown chunk recall: {chunkrecall}")
+
+            bot_message = str(response)
+            self.logger.info(f"Initial bot_message: {bot_message}")
+
+            # Step 7: Perform NER and queryblock processing of the response
+            keyword = await asyncio.to_thread(self.extract_keyword, bot_message, "bot_message")
+            codez, mdz = await asyncio.to_thread(self.textanslys.queryblock, keyword)
+            return unique_code, retrieved_documents, keyword, codez, mdz
+
+        (unique_code, retrieved_documents, keyword, codez, mdz), (keywords, codey, mdy) = await asyncio.gather(
+            retrieval_branch(), keyword_branch()
+        )
         self.logger.info(f"Extracted keywords: {keyword}, {keywords}")
-        
-        codez, mdz = self.textanslys.queryblock(keyword)
-        codey, mdy = self.textanslys.queryblock(keywords)
         self.logger.info(f"Z: {codez}, {mdz}")
         self.logger.info(f"Y: {codey}, {mdy}")
         
@@ -236,19 +216,18 @@ class PymatgenRepoAssistant:
         self.logger.info(f"Unique code: {codex_md}")
         retrieved_documents = list(dict.fromkeys(retrieved_documents + uni_md))
         
-        # Final rerank and response generation
-        retrieved_documents = self.rerank(message, retrieved_documents)
+        # Final rerank of documents and code, independent of each other
+        with span("rerank", final=True):
+            retrieved_documents, uni_code = await asyncio.to_thread(
+                self.reranker.rerank_many, message, [retrieved_documents, list(dict.fromkeys(uni_codex + unique_code))]
+            )
         self.logger.info(f"Final retrieved documents after rerank: {retrieved_documents}")
-        
-        uni_code = self.rerank(
-            message, list(dict.fromkeys(uni_codex + unique_code))
-        )
         self.logger.info(f"Final unique code after rerank: {uni_code}")
         
         unique_code_md = self.textanslys.list_to_markdown(unique_code)
         self.logger.info(f"Unique code in Markdown: {unique_code_md}")
         
         # Generate final response using RAG_AR
-        final_results = self.attempt_rag_ar(prompt, uni_code, retrieved_documents)
+        final_results = await asyncio.to_thread(self.attempt_rag_ar, prompt, uni_code, retrieved_documents)
 
-        return final_results
\ No newline at end of file
+        return final_results
@@ -0,0 +1,168 @@
+'''
+Rerankers used by PymatgenRepoAssistant to keep the most relevant retrieved documents and code snippets.
+  llm:         the chat LLM scores every document of one list (the original behaviour).
+  llm-batched: the chat LLM scores several lists in one request and answers with document ids instead of echoing contents.
+  embedding:   cosine similarity between the query and document embeddings, computed locally. Deterministic,
+               and with an embedding cache no network call is needed for documents seen before.
+'''
+import json
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing_extensions import List
+import numpy as np
+from openai import OpenAI
+from mtb_logger import MatToolBenLogger
+from src.instrumentation import count_span, record_usage
+from prompt import relevance_ranking_instruction, relevance_ranking_guideline, batched_relevance_ranking_instruction, batched_relevance_ranking_guideline
+
+RERANKER_TYPES = ['llm', 'llm-batched', 'embedding']
+
+class Reranker(ABC):
+    """
+    Keeps the top_n documents of a list, most relevant first.
+    """
+    def __init__(self, top_n: int = 5):
+        self.top_n = top_n
+
+    @abstractmethod
+    def rerank(self, query: str, docs: List[str]) -> List[str]:
+        pass
+
+    def rerank_many(self, query: str, doc_lists: List[List[str]]) -> List[List[str]]:
+        """Rerank several independent lists for the same query. The lists are reranked concurrently by default."""
+        if len(doc_lists) <= 1:
+            return [self.rerank(query, docs) for docs in doc_lists]
+        with ThreadPoolExecutor(max_workers=len(doc_lists)) as executor:
+            return list(executor.map(lambda docs: self.rerank(query, docs), doc_lists))
+
+class LLMReranker(Reranker):
+    """
+    Asks the chat LLM for a JSON relevance score of every document, retrying when the answer cannot be parsed.
+    """
+    def __init__(self, llm: OpenAI, model_args: dict, logger: MatToolBenLogger, top_n: int = 5, max_retries: int = 10, retry_delay: float = 1):
+        super().__init__(top_n)
+        self.llm = llm
+        self.model_args = model_args
+        self.logger = logger
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+    def complete_json(self, messages: List[dict]) -> str:
+        if self.model_args['model'] == "gemini-2.0-flash-thinking-exp-01-21":
+            response = self.llm.chat.completions.create(messages=messages, **self.model_args)
+        else:
+            response = self.llm.chat.completions.create(messages=messages, response_format={"type": "json_object"}, **self.model_args)
+        # the tokens of the scoring request are accounted to the enclosing rerank span
+        record_usage(response)
+        return response.choices[0].message.content
+
+    def rerank(self, query, docs):
+        retry_count = 0
+
+        while retry_count < self.max_retries:
+            try:
+                messages = [
+                    {"role": "system", "content": relevance_ranking_instruction},
+                    {"role": "user", "content": relevance_ranking_guideline.format(query=query, docs=docs)}
+                ]
+                # 尝试解析 JSON
+                scores = json.loads(self.complete_json(messages))['documents']
+
+                if not isinstance(scores, list):
+                    raise ValueError("Response is not a valid list of documents")
+
+                # 确保 JSON 数据格式正确
+                for doc in scores:
+                    if not isinstance(doc, dict) or "content" not in doc or "relevance_score" not in doc:
+                        raise ValueError("Invalid document format in JSON response")
+
+                self.logger.info(f"Scores: {scores}")
+
+                # 按相关性得分排序，取前 top_n 个文档的内容
+                sorted_data = sorted(scores, key=lambda x: x["relevance_score"], reverse=True)
+                return [doc["content"] for doc in sorted_data[:self.top_n]]
+
+            except (json.JSONDecodeError, ValueError) as e:
+                self.logger.warning(f"JSON 解析失败，尝试第 {retry_count + 1} 次: {e}")
+                retry_count += 1
+                count_span("retries")
+                time.sleep(self.retry_delay)  # 等待后重试
+
+        # 如果重试仍然失败，则返回整个文档列表
+        self.logger.error("无法解析 JSON 数据，返回原始文档列表")
+        return docs
+
+class BatchedLLMReranker(LLMReranker):
+    """
+    Scores all documents of several lists with one LLM request. The answer refers to documents by id, so the
+    documents are not echoed back, and malformed answers are retried immediately.
+    """
+    def __init__(self, llm: OpenAI, model_args: dict, logger: MatToolBenLogger, top_n: int = 5, max_retries: int = 3):
+        super().__init__(llm, model_args, logger, top_n=top_n, max_retries=max_retries, retry_delay=0)
+
+    def rerank(self, query, docs):
+        return self.rerank_many(query, [docs])[0]
+
+    def rerank_many(self, query, doc_lists):
+        document_lists = "\n\n".join(
+            f"List {i}:\n" + "\n".join(f"[{i}-{j}] {doc}" for j, doc in enumerate(docs))
+            for i, docs in enumerate(doc_lists)
+        )
+        messages = [
+            {"role": "system", "content": batched_relevance_ranking_instruction},
+            {"role": "user", "content": batched_relevance_ranking_guideline.format(query=query, document_lists=document_lists)}
+        ]
+        for retry_count in range(self.max_retries):
+            try:
+                scores = {}
+                for item in json.loads(self.complete_json(messages))['scores']:
+                    scores[str(item["id"]).strip("[]")] = float(item["relevance_score"])
+                self.logger.info(f"Scores: {scores}")
+                # documents the LLM did not score keep their retrieval order behind the scored ones
+                return [
+                    [docs[j] for j in sorted(range(len(docs)), key=lambda j: -scores.get(f"{i}-{j}", float("-inf")))[:self.top_n]]
+                    for i, docs in enumerate(doc_lists)
+                ]
+            except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+                self.logger.warning(f"JSON 解析失败，尝试第 {retry_count + 1} 次: {e}")
+                count_span("retries")
+        self.logger.error("无法解析 JSON 数据，返回原始文档列表")
+        return [list(docs) for docs in doc_lists]
+
+class EmbeddingReranker(Reranker):
+    """
+    Ranks documents by the cosine similarity of their embeddings to the query embedding.
+    Use it with load_embedding_model(..., cache_path=...) so repeated documents are embedded only once.
+    """
+    def __init__(self, embedding_model, top_n: int = 5):
+        super().__init__(top_n)
+        self.embedding_model = embedding_model
+
+    def rerank(self, query, docs):
+        return self.rerank_many(query, [docs])[0]
+
+    def rerank_many(self, query, doc_lists):
+        texts = list(dict.fromkeys([query] + [doc for docs in doc_lists for doc in docs]))
+        embeddings = np.asarray(self.embedding_model.embed_documents(texts), dtype=np.float32)
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        similarities = dict(zip(texts, embeddings @ embeddings[0]))
+        # stable sort: equally similar documents keep their retrieval order
+        return [sorted(docs, key=lambda doc: -similarities[doc])[:self.top_n] for docs in doc_lists]
+
+def load_reranker(reranker_type: str, llm: OpenAI, model_args: dict, logger: MatToolBenLogger, embedding_model=None, top_n: int = 5) -> Reranker:
+    """
+    Args:
+        reranker_type (str): One of RERANKER_TYPES.
+        embedding_model: Required by the 'embedding' reranker.
+    """
+    if reranker_type == 'llm':
+        return LLMReranker(llm, model_args, logger, top_n=top_n)
+    elif reranker_type == 'llm-batched':
+        return BatchedLLMReranker(llm, model_args, logger, top_n=top_n)
+    elif reranker_type == 'embedding':
+        if embedding_model is None:
+            raise ValueError("The embedding reranker needs an embedding model.")
+        return EmbeddingReranker(embedding_model, top_n=top_n)
+    else:
+        raise ValueError(f"Invalid reranker_type: {reranker_type}. Expected one of {RERANKER_TYPES}.")
@@ -1,18 +1,28 @@
 import sys
 sys.path.append("..")
 from src.json_handler import JsonFileProcessor
+from src.instrumentation import span, record_usage
 from openai import OpenAI
 
 class TextAnalysisTool:
-    def __init__(self, llm: OpenAI, db_path, model_args):
+    def __init__(self, llm: OpenAI, db_path, model_args, qualified_lookup=False, fuzzy_lookup=False):
+        """
+        qualified_lookup and fuzzy_lookup are optional fallbacks of queryblock when the extracted name is not found as is:
+        dotted names such as pymatgen.core.structure.Structure, and names differing in case, underscores or parentheses.
+        Both are off by default, so only exact names are looked up as in the benchmark runs.
+        """
         self.jsonsearch = JsonFileProcessor(db_path)
         self.llm = llm
         self.db_path = db_path
         self.model_args = model_args
+        self.qualified_lookup = qualified_lookup
+        self.fuzzy_lookup = fuzzy_lookup
 
     def keyword(self, query):
         prompt = f"Please provide a list of Code keywords according to the following query, please output no more than 3 keywords, Input: {query}, Output:"
-        response = self.llm.chat.completions.create(messages=[{"role": "user", "content": prompt}], **self.model_args)
+        with span("generate", step="keyword"):
+            response = self.llm.chat.completions.create(messages=[{"role": "user", "content": prompt}], **self.model_args)
+            record_usage(response)
         return response.choices[0].message.content
 
     def format_chat_prompt(self, message, instruction):
@@ -24,7 +34,7 @@ class TextAnalysisTool:
 
     def queryblock(self, message):
         code_results, md_results = self.jsonsearch.search_code_contents_by_name(
-            self.db_path, message
+            self.db_path, message, qualified=self.qualified_lookup, fuzzy=self.fuzzy_lookup
         )
         return code_results, md_results
 
@@ -55,22 +65,24 @@ Please ensure the output follows this JSON format:
 }
     """
         query = f"The input is shown as below:\n{message}\n\nAnd now directly give your Output:"
-        if self.model_args['model'] == "gemini-2.0-flash-thinking-exp-01-21":
-            response = self.llm.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": instruction},
-                    {"role": "user", "content": query}
-                ],
-                **self.model_args
-            )
-        else:
-            response = self.llm.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": instruction},
-                    {"role": "user", "content": query}
-                ],
-                response_format={"type": "json_object"},
-                **self.model_args
-            )
+        with span("generate", step="nerquery"):
+            if self.model_args['model'] == "gemini-2.0-flash-thinking-exp-01-21":
+                response = self.llm.chat.completions.create(
+                    messages=[
+                        {"role": "system", "content": instruction},
+                        {"role": "user", "content": query}
+                    ],
+                    **self.model_args
+                )
+            else:
+                response = self.llm.chat.completions.create(
+                    messages=[
+                        {"role": "system", "content": instruction},
+                        {"role": "user", "content": query}
+                    ],
+                    response_format={"type": "json_object"},
+                    **self.model_args
+                )
+            record_usage(response)
         return response.choices[0].message.content
 
@@ -0,0 +1,194 @@
+'''
+Evaluate many generated_function_path directories in one process and write a consolidated leaderboard.
+Every (run, task) pair is scheduled on one shared sandbox pool, so the containers are started once for the whole batch.
+'''
+import os
+import re
+import logging
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict
+import pandas as pd
+from docker_sandbox import DockerSandboxPool
+from sandbox_cache import SandboxResultCache, CachedSandbox
+from result_analysis import (
+    read_function_generation_results,
+    check_file_name_consistency,
+    evaluate_generated_code,
+    evaluate_generated_code_combined,
+    tally_evaluation_results,
+    print_accuracy_summary,
+    TOTAL_TASKS_NUMBER,
+    TOTAL_SUB_TASKS,
+    UNIT_TEST_PATH_TEMPLATE,
+    REF_SUB_TASKS_LIST,
+)
+
+DEFAULT_ROOTS = ["pure_agent_test", "RAG_agent_test", "agentic_RAG_test", "mtr_rag_test"]
+
+logger = logging.getLogger()
+
+def setup_logger(output_dir: str):
+    """
+    Set up a logger that will log the batch evaluation to a file with the current date.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    current_date = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    log_file = os.path.join(output_dir, f"batch_evaluation_logs_{current_date}.log")
+    logging.basicConfig(
+        filename=log_file,
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+    )
+    return logging.getLogger()
+
+def discover_runs(roots: List[str]) -> List[str]:
+    """
+    Find every directory below the given roots that contains a function_generation_results.jsonl file.
+    Args:
+        roots (List[str]): Directories to search, e.g. 'RAG_agent_test' or 'agentic_RAG_test/round1'.
+    Returns:
+        List[str]: The run directories, sorted so the batch order is reproducible.
+    """
+    run_paths = []
+    for root in roots:
+        for dirpath, _, files in os.walk(root):
+            if "function_generation_results.jsonl" in files:
+                run_paths.append(os.path.normpath(dirpath))
+    return sorted(set(run_paths))
+
+def describe_run(run_path: str) -> Dict:
+    """
+    Split a run directory into the test family, round, model and method it belongs to.
+    Args:
+        run_path (str): e.g. 'RAG_agent_test/round1/gpt-4o-2024-08-06_method3' or 'mtr_rag_test/gpt-4o-2024-08-06_4'.
+    Returns:
+        Dict: The run description used as the leading columns of the leaderboard.
+    """
+    parts = os.path.normpath(run_path).split(os.sep)
+    round_name = next((part for part in parts if re.fullmatch(r"round\d+", part)), "")
+    leaf = parts[-1]
+    match = re.fullmatch(r"(?P<model>.+?)_(?:method)?(?P<method>\d+)", leaf)
+    if match:
+        model, method = match.group("model"), f"method{match.group('method')}"
+    else:
+        model, method = leaf, ""
+    return {"Run": run_path, "Test": parts[0], "Round": round_name, "Model": model, "Method": method}
+
+def load_runs(run_paths: List[str]) -> Dict[str, List[Dict]]:
+    """
+    Read the generated functions of every run, skipping runs that cannot be scored.
+    Args:
+        run_paths (List[str]): The run directories.
+    Returns:
+        Dict[str, List[Dict]]: The generated code information of each valid run.
+    """
+    runs = {}
+    for run_path in run_paths:
+        function_lists = read_function_generation_results(os.path.join(run_path, "function_generation_results.jsonl"))
+        if len(function_lists) != TOTAL_TASKS_NUMBER:
+            logger.warning(f"Skipping {run_path}: total tasks number is not equal to {TOTAL_TASKS_NUMBER}")
+            continue
+        if not check_file_name_consistency(function_lists):
+            logger.warning(f"Skipping {run_path}: file names are not consistent.")
+            continue
+        runs[run_path] = function_lists
+    return runs
+
+def evaluate_runs(runs: Dict[str, List[Dict]], sandbox: DockerSandboxPool | CachedSandbox, workers: int, combined: bool = False) -> Dict[str, list]:
+    """
+    Evaluate every (run, task) pair on one shared thread pool and sandbox pool.
+    Args:
+        runs (Dict[str, List[Dict]]): The generated code information of each run.
+        sandbox (DockerSandboxPool | CachedSandbox): The sandbox pool shared by all runs, optionally behind a result cache.
+        workers (int): Number of tasks evaluated concurrently.
+        combined (bool): Run each function and its unit test in one execution.
+    Returns:
+        Dict[str, list]: The evaluation results of each run, in task order.
+    """
+    evaluate = evaluate_generated_code_combined if combined else evaluate_generated_code
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            run_path: [
+                executor.submit(
+                    evaluate,
+                    i,
+                    UNIT_TEST_PATH_TEMPLATE.format(path=codeinfo['question_file_path']),
+                    codeinfo,
+                    sandbox,
+                )
+                for i, codeinfo in enumerate(function_lists)
+            ]
+            for run_path, function_lists in runs.items()
+        }
+        return {run_path: [future.result() for future in run_futures] for run_path, run_futures in futures.items()}
+
+def build_leaderboard(runs: Dict[str, List[Dict]], evaluation_results: Dict[str, list], write_run_summaries: bool = False) -> pd.DataFrame:
+    """
+    Tally each run and collect one leaderboard row per run.
+    Args:
+        runs (Dict[str, List[Dict]]): The generated code information of each run.
+        evaluation_results (Dict[str, list]): The evaluation results of each run, in task order.
+        write_run_summaries (bool): Also write accuracy_summary.xlsx into every run directory, like result_analysis.py.
+    Returns:
+        pd.DataFrame: The leaderboard, sorted by task accuracy.
+    """
+    rows = []
+    for run_path, function_lists in runs.items():
+        logger.info(f"------Summary for {run_path}------")
+        counters = tally_evaluation_results(function_lists, evaluation_results[run_path], REF_SUB_TASKS_LIST)
+        error_summary = print_accuracy_summary(
+            counters["correct_tasks"], counters["partially_correct_tasks"], counters["incorrect_tasks"], counters["function_errors"], counters["result_errors"], counters["success_count"],
+            TOTAL_TASKS_NUMBER, counters["correct_subtasks"], counters["incorrect_subtasks"], TOTAL_SUB_TASKS
+        )
+        if write_run_summaries:
+            error_summary.to_excel(os.path.join(run_path, "accuracy_summary.xlsx"), index=False)
+        row = describe_run(run_path)
+        row.update({
+            "Correct Tasks": counters["correct_tasks"],
+            "Partially Correct Tasks": counters["partially_correct_tasks"],
+            "Incorrect Tasks": counters["incorrect_tasks"],
+            "Function Errors": counters["function_errors"],
+            "Result Errors": counters["result_errors"],
+            "Correct Sub-tasks": counters["correct_subtasks"],
+            "Task Accuracy (%)": error_summary.loc[0, "Accuracy (%)"],
+            "Sub-task Accuracy (%)": error_summary.loc[1, "Accuracy (%)"],
+            "Function Runnable Rate": error_summary.loc[0, "Function Runnable Rate"],
+        })
+        rows.append(row)
+    leaderboard = pd.DataFrame(rows)
+    if not leaderboard.empty:
+        leaderboard = leaderboard.sort_values(["Task Accuracy (%)", "Sub-task Accuracy (%)"], ascending=False, kind="stable")
+    return leaderboard
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate every function_generation_results.jsonl below the given roots on one shared sandbox pool. Example input: --roots RAG_agent_test agentic_RAG_test/round1 --workers 8")
+    parser.add_argument("--roots", nargs="+", default=DEFAULT_ROOTS, help=f"Directories searched for generated function results. Default: {DEFAULT_ROOTS}")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Number of sandbox containers and concurrently evaluated tasks.")
+    parser.add_argument("--output_dir", type=str, default="batch_results", help="Directory for the leaderboard and the batch log.")
+    parser.add_argument("--sandbox_cache", type=str, default=None, help="Path of a sandbox result cache (e.g. 'sandbox_cache/results.sqlite3'). Programs already executed on the same image are not run again.")
+    parser.add_argument("--combined", action="store_true", default=False, help="Run each generated function and its unit test in a single sandbox execution.")
+    parser.add_argument("--write_run_summaries", action="store_true", default=False, help="Also write accuracy_summary.xlsx into every evaluated run directory.")
+    args = parser.parse_args()
+
+    logger = setup_logger(args.output_dir)
+    run_paths = discover_runs(args.roots)
+    logger.info(f"------Discovered {len(run_paths)} runs below {args.roots}------")
+    runs = load_runs(run_paths)
+    logger.info(f"Evaluating {len(runs)} runs ({len(runs) * TOTAL_TASKS_NUMBER} tasks) with {args.workers} workers.")
+
+    sandbox_cache = SandboxResultCache(args.sandbox_cache) if args.sandbox_cache else None
+    with DockerSandboxPool(size=args.workers) as sandbox:
+        if sandbox_cache:
+            sandbox = CachedSandbox(sandbox, sandbox_cache)
+        evaluation_results = evaluate_runs(runs, sandbox, args.workers, args.combined)
+    if sandbox_cache:
+        logger.info(f"Sandbox cache statistics: {sandbox_cache.stats()}")
+
+    leaderboard = build_leaderboard(runs, evaluation_results, args.write_run_summaries)
+    leaderboard_file = os.path.join(args.output_dir, "leaderboard.xlsx")
+    leaderboard.to_excel(leaderboard_file, index=False)
+    logger.info("\n" + leaderboard.to_string(index=False))
+    logger.info(f"Leaderboard saved as '{leaderboard_file}'.")
+    logger.info("------Batch evaluation process completed successfully------")
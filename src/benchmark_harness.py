@@ -0,0 +1,150 @@
+'''
+Reproducible end-to-end throughput benchmark of the generation and evaluation harness, run against mock_llm_server.py.
+Every suite runs an unmodified entry point as a subprocess with LLM_PROVIDERS_FILE pointing all providers at an
+in-process mock server, under a separate model name (mock-llm) so real results are never overwritten. The wall time,
+the mocked LLM time and the instrumentation spans of every run are written to benchmark_results/, so the overhead of
+retrieval, parsing, sandbox and scoring can be compared between commits with the same seed and latency distribution.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from datetime import datetime
+from statistics import median
+try:
+    from src.mock_llm_server import ResponseLibrary, LatencyModel, MockLLMServer, write_providers_file, DEFAULT_RECORDINGS, DEFAULT_QUESTION_DIR
+    from src.instrumentation import aggregate
+except ImportError:  # run as a script from src/ without the repository root on sys.path
+    from mock_llm_server import ResponseLibrary, LatencyModel, MockLLMServer, write_providers_file, DEFAULT_RECORDINGS, DEFAULT_QUESTION_DIR
+    from instrumentation import aggregate
+
+MOCK_MODEL = "mock-llm"
+SUITES = ["pure", "rag", "agentic", "mtr", "evaluation"]
+RETRIEVER_METHODS = {"code": 1, "doc": 2, "llm-doc": 3, "llm-doc-full": 4}
+
+def events_file_name(suite: str) -> str:
+    return f"benchmark_{suite}_events.jsonl"
+
+def suite_command(suite: str, concurrency: int, retriever_type: str, workers: int) -> tuple:
+    """
+    Returns:
+        tuple: (command run from src/, result directory of the run relative to src/).
+    """
+    python = sys.executable
+    events_file = events_file_name(suite)
+    if suite == "pure":
+        return [python, "pure_agent_test/build_agent.py", "--model_names", MOCK_MODEL, "--concurrency", str(concurrency), "--events_file", events_file], f"pure_agent_test/{MOCK_MODEL}/"
+    if suite == "rag":
+        return [python, "RAG_agent_test/build_agent.py", "--model_name", MOCK_MODEL, "--retriever_type", retriever_type, "--events_file", events_file], f"RAG_agent_test/{MOCK_MODEL}_method{RETRIEVER_METHODS[retriever_type]}/"
+    if suite == "agentic":
+        return [python, "agentic_RAG_test/main.py", "--model_name", MOCK_MODEL, "--retriever_type", retriever_type, "--concurrency", str(concurrency), "--events_file", events_file], f"agentic_RAG_test/{MOCK_MODEL}_method{RETRIEVER_METHODS[retriever_type]}/"
+    if suite == "mtr":
+        return [python, "mtr_rag_test/rag.py", "--model_name", MOCK_MODEL, "--retriever_type", retriever_type, "--concurrency", str(concurrency), "--events_file", events_file], f"mtr_rag_test/{MOCK_MODEL}_{RETRIEVER_METHODS[retriever_type]}/"
+    if suite == "evaluation":
+        # scores the answers of the pure suite, so run it after pure
+        return [python, "result_analysis.py", "--generated_function_path", f"pure_agent_test/{MOCK_MODEL}/", "--workers", str(workers), "--events_file", events_file], f"pure_agent_test/{MOCK_MODEL}/"
+    raise ValueError(f"Invalid suite: {suite}. Expected one of {SUITES}.")
+
+def count_lines(file_path: str) -> int:
+    if not os.path.exists(file_path):
+        return 0
+    with open(file_path, 'r', encoding="utf-8") as f:
+        return sum(1 for line in f if line.strip())
+
+def run_suite(server: MockLLMServer, suite: str, env: dict, concurrency: int, retriever_type: str, workers: int, timeout: float) -> dict:
+    command, result_dir = suite_command(suite, concurrency, retriever_type, workers)
+    events_file = os.path.join(result_dir, events_file_name(suite))
+    # the events file is the benchmark's own, start every run from an empty one
+    if os.path.exists(events_file):
+        os.remove(events_file)
+    server.reset_attempts()
+    before = server.snapshot()
+    start = time.perf_counter()
+    process = subprocess.run(command, env=env, capture_output=True, text=True, timeout=timeout)
+    wall_seconds = time.perf_counter() - start
+    after = server.snapshot()
+    questions = count_lines(os.path.join(result_dir, "function_generation_results.jsonl"))
+    result = {
+        "suite": suite,
+        "command": " ".join(command[1:]),
+        "returncode": process.returncode,
+        "wall_seconds": round(wall_seconds, 3),
+        "questions": questions,
+        "questions_per_second": round(questions / wall_seconds, 3) if wall_seconds else None,
+        "llm_requests": after["chat"] - before["chat"],
+        "embedding_requests": after["embeddings"] - before["embeddings"],
+        "mocked_llm_seconds": round(after["latency_seconds"] - before["latency_seconds"], 3),
+        "replayed": {source: after[source] - before[source] for source in ("exact", "question", "fallback")},
+        "spans": aggregate([events_file]) if os.path.exists(events_file) else [],
+    }
+    if process.returncode != 0:
+        result["stderr"] = process.stderr[-4000:]
+    return result
+
+def summarize(runs: list) -> list:
+    """Median wall time and throughput of the repeated runs of every suite."""
+    rows = []
+    for suite in dict.fromkeys(run["suite"] for run in runs):
+        suite_runs = [run for run in runs if run["suite"] == suite and run["returncode"] == 0]
+        if not suite_runs:
+            rows.append({"suite": suite, "runs": 0})
+            continue
+        rows.append({
+            "suite": suite,
+            "runs": len(suite_runs),
+            "median_wall_seconds": median(run["wall_seconds"] for run in suite_runs),
+            "median_questions_per_second": median(run["questions_per_second"] or 0 for run in suite_runs),
+            "median_mocked_llm_seconds": median(run["mocked_llm_seconds"] for run in suite_runs),
+            "llm_requests": suite_runs[-1]["llm_requests"],
+        })
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark harness throughput against the offline mock LLM server. Example input: --suites pure evaluation --repeat 3 --latency lognormal:0,0.5")
+    parser.add_argument("--suites", type=str, nargs="+", default=["pure"], choices=SUITES, help="Entry points to run, in order. Default is pure. rag, agentic and mtr need the vector stores, mtr and evaluation need Docker.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per suite; the summary reports medians. Default is 3.")
+    parser.add_argument("--concurrency", type=int, default=8, help="--concurrency passed to the generators. Default is 8.")
+    parser.add_argument("--workers", type=int, default=4, help="--workers passed to result_analysis.py. Default is 4.")
+    parser.add_argument("--retriever_type", type=str, default="llm-doc-full", choices=list(RETRIEVER_METHODS), help="Retriever of the rag, agentic and mtr suites. Default is llm-doc-full.")
+    parser.add_argument("--recordings", type=str, nargs="+", default=DEFAULT_RECORDINGS, help="Recorded runs replayed by the mock server.")
+    parser.add_argument("--latency", type=str, default="fixed:0", help="Latency distribution of the mock server, see mock_llm_server.LatencyModel. Default is fixed:0 (harness overhead only).")
+    parser.add_argument("--seconds_per_token", type=float, default=0.0, help="Extra mock latency per completion token. Default is 0.")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of mock attempts answered with 429. Default is 0.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the mock server. Default is 0.")
+    parser.add_argument("--timeout", type=float, default=3600, help="Seconds after which a run is aborted. Default is 3600.")
+    parser.add_argument("--output_dir", type=str, default="benchmark_results", help="Directory of the JSON report. Default is benchmark_results.")
+    args = parser.parse_args()
+
+    library = ResponseLibrary(args.recordings, DEFAULT_QUESTION_DIR)
+    latency = LatencyModel(args.latency, args.seconds_per_token, args.seed)
+    providers_file = os.path.join(args.output_dir, "mock_providers.json")
+    runs = []
+    with MockLLMServer(library, latency, error_rate=args.error_rate, seed=args.seed) as server:
+        write_providers_file(providers_file, server.base_url, [MOCK_MODEL])
+        env = dict(os.environ, LLM_PROVIDERS_FILE=os.path.abspath(providers_file))
+        print(f"Mock server on {server.base_url}: {len(library.exact)} exact replays, answers of {len(library.answers)} questions")
+        for suite in args.suites:
+            for repeat in range(args.repeat):
+                run = run_suite(server, suite, env, args.concurrency, args.retriever_type, args.workers, args.timeout)
+                run["repeat"] = repeat + 1
+                runs.append(run)
+                status = "ok" if run["returncode"] == 0 else f"failed ({run['returncode']})"
+                print(f"{suite:<11} run {repeat + 1}: {status}, {run['wall_seconds']:.2f} s, {run['questions']} questions, {run['llm_requests']} LLM requests, {run['mocked_llm_seconds']:.2f} s mocked LLM time")
+                if run["returncode"] != 0:
+                    print(run["stderr"])
+                    break
+
+    summary = summarize(runs)
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "settings": vars(args),
+        "summary": summary,
+        "runs": runs,
+    }
+    report_file = os.path.join(args.output_dir, f"harness_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(report_file, 'w', encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(summary, indent=2))
+    print(f"Saved report to {report_file}")
@@ -0,0 +1,240 @@
+'''
+Micro-benchmark of utils.ComplexDictParser against the previous eval-based implementation.
+Both parsers read the same synthetic sandbox outputs (dicts of large float128 arrays, 2-D arrays and Elements);
+the script checks that they agree and prints the mean parse time of each.
+Example input: python benchmark_parser.py --sizes 1000 10000 100000 --repeat 3
+'''
+import re
+import ast
+import io
+import time
+import argparse
+import contextlib
+import numpy as np
+from pymatgen.core import Element
+try:
+    from src.utils import ComplexDictParser
+except ImportError:  # run as a script from src/ without the repository root on sys.path
+    from utils import ComplexDictParser
+
+class LegacyComplexDictParser:
+    """The eval-based parser replaced by utils.ComplexDictParser, kept for comparison."""
+    def __init__(self):
+        self.element_dict = {}  # 存储 Element 对象
+        self.array_dict = {}    # 存储数组对象
+        self.placeholder_counter = 0
+    
+    def get_new_placeholder(self, prefix):
+        placeholder = f"__{prefix}_{self.placeholder_counter}__"
+        self.placeholder_counter += 1
+        return placeholder
+    
+    def preprocess_string(self, input_str):
+        """预处理字符串，替换复杂对象为占位符"""
+        # 首先完整处理所有数组表达式
+        result = self._process_arrays(input_str)
+        # 然后处理 Element 表达式
+        result = self._process_elements_all_formats(result)
+        return result
+    
+    def _find_matching_parenthesis(self, s, start_pos):
+        """找到与start_pos位置的左括号匹配的右括号位置"""
+        count = 1  # 已找到一个左括号
+        pos = start_pos + 1
+        
+        while pos < len(s) and count > 0:
+            if s[pos] == '(':
+                count += 1
+            elif s[pos] == ')':
+                count -= 1
+            pos += 1
+            
+        return pos - 1 if count == 0 else -1
+    
+    def _process_arrays(self, input_str):
+        """处理字符串中的所有数组表达式"""
+        result_str = input_str
+        # 查找 array( 和 np.array( 模式
+        array_patterns = [r'array\(', r'np\.array\(']
+        
+        for pattern in array_patterns:
+            # 不断查找直到找不到为止
+            i = 0
+            while i < len(result_str):
+                match = re.search(pattern, result_str[i:])
+                if not match:
+                    break
+                
+                # 计算绝对位置
+                start_idx = i + match.start()
+                # 查找匹配的右括号
+                open_paren_pos = i + match.end() - 1
+                close_paren_pos = self._find_matching_parenthesis(result_str, open_paren_pos)
+                
+                if close_paren_pos == -1:
+                    # 没找到匹配的右括号，跳过这个匹配
+                    i = start_idx + 1
+                    continue
+                
+                # 提取完整的数组表达式
+                array_expr = result_str[start_idx:close_paren_pos+1]
+                
+                # 创建占位符
+                placeholder = self.get_new_placeholder("ARRAY")
+                
+                try:
+                    # 解析数组表达式
+                    # 处理 dtype=float128 的情况
+                    if 'float128' in array_expr:
+                        array_code = array_expr.replace('float128', 'np.float64')
+                        if not array_code.startswith('np.'):
+                            array_code = 'np.' + array_code
+                    else:
+                        if array_expr.startswith('array('):
+                            array_code = 'np.' + array_expr
+                        else:
+                            array_code = array_expr
+                    
+                    # 执行代码创建数组
+                    self.array_dict[placeholder] = eval(array_code)
+                    
+                    # 替换原始表达式为占位符
+                    result_str = result_str[:start_idx] + f"'{placeholder}'" + result_str[close_paren_pos+1:]
+                    
+                    # 由于字符串长度已改变，从替换位置重新开始
+                    i = start_idx + len(f"'{placeholder}'")
+                    
+                except Exception as e:
+                    print(f"无法解析数组表达式 '{array_expr}': {e}")
+                    # 跳过这个表达式
+                    i = start_idx + 1
+        
+        return result_str
+    
+    def _process_elements_all_formats(self, input_str):
+        """处理所有格式的 Element 表达式"""
+        result_str = input_str
+        
+        # 1. 处理 Element('X') 格式
+        pattern1 = r"Element\(['\"](\w+)['\"]\)"
+        result_str = self._replace_elements(result_str, pattern1, lambda m: m.group(1))
+        
+        # 2. 处理 Element X 格式
+        pattern2 = r"Element\s+(\w+)"
+        result_str = self._replace_elements(result_str, pattern2, lambda m: m.group(1))
+        
+        return result_str
+    
+    def _replace_elements(self, input_str, pattern, symbol_extractor):
+        """使用给定的模式和符号提取器替换 Element 表达式"""
+        result_str = input_str
+        element_matches = list(re.finditer(pattern, input_str))
+        
+        offset = 0
+        for match in element_matches:
+            start, end = match.span()
+            start += offset
+            end += offset
+            
+            try:
+                element_symbol = symbol_extractor(match)
+                placeholder = self.get_new_placeholder("ELEMENT")
+                self.element_dict[placeholder] = Element(element_symbol)
+                
+                # 替换 Element 表达式为占位符
+                result_str = result_str[:start] + f"'{placeholder}'" + result_str[end:]
+                offset += len(f"'{placeholder}'") - (end - start)
+            except Exception as e:
+                print(f"无法创建 Element 对象: {e}")
+        
+        return result_str
+    
+    def restore_objects(self, obj):
+        """还原所有占位符为原始对象"""
+        if isinstance(obj, dict):
+            # 处理字典
+            new_dict = {}
+            for k, v in obj.items():
+                new_key = self._restore_single_object(k)
+                new_value = self.restore_objects(v)
+                new_dict[new_key] = new_value
+            return new_dict
+        elif isinstance(obj, list):
+            # 处理列表
+            return [self.restore_objects(item) for item in obj]
+        else:
+            # 处理单个值
+            return self._restore_single_object(obj)
+    
+    def _restore_single_object(self, obj):
+        """还原单个对象"""
+        if isinstance(obj, str):
+            if obj in self.element_dict:
+                return self.element_dict[obj]
+            elif obj in self.array_dict:
+                return self.array_dict[obj]
+        return obj
+    
+    def parse(self, input_str):
+        """解析复杂字符串为 Python 对象"""
+        try:
+            # 预处理字符串
+            preprocessed_str = self.preprocess_string(input_str)
+            
+            # 使用 ast.literal_eval 解析预处理后的字符串
+            parsed_obj = ast.literal_eval(preprocessed_str)
+            
+            # 还原所有占位符
+            result = self.restore_objects(parsed_obj)
+            print(f"输入字符串: {input_str}")
+            print(f"预处理后的字符串: {preprocessed_str}")
+            print(f"解析成功: {result}")
+            print("-------------------------------")
+            return result
+        except Exception as e:
+            print(f"输入字符串: {input_str}")
+            print(f"预处理后的字符串: {preprocessed_str}")
+            print(f"解析错误: {e}")
+            print("-------------------------------")
+            return None
+
+
+def make_output(size: int, seed: int = 0) -> str:
+    """A printed result dict as produced by tasks such as test_get_vibronic_matrix_elements."""
+    rng = np.random.default_rng(seed)
+    vector = np.array2string(rng.normal(scale=1e6, size=size), separator=', ', threshold=size + 1, max_line_width=75)
+    rows = max(1, size // 100)
+    matrix = np.array2string(rng.random((rows, 100)), separator=', ', threshold=rows * 100 + 1, max_line_width=75)
+    return (
+        f"{{'vibronic_matrix_elements': array({vector}, dtype=float128), "
+        f"'overlap': array({matrix}), 'element': Element Mg, 'host': Element('O'), 'count': {size}}}"
+    )
+
+def results_equal(a, b) -> bool:
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(results_equal(a[k], b[k]) for k in a)
+    if isinstance(a, np.ndarray) and isinstance(b, np.ndarray):
+        return a.dtype == b.dtype and a.shape == b.shape and np.array_equal(a, b, equal_nan=True)
+    return a == b
+
+def time_parse(parser_class, text: str, repeat: int):
+    durations = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = parser_class().parse(text)
+            durations.append(time.perf_counter() - start)
+    return result, sum(durations) / len(durations)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ComplexDictParser. Example input: --sizes 1000 10000 100000 --repeat 3")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Number of elements of the large array.")
+    parser.add_argument("--repeat", type=int, default=3, help="Parses per implementation and size.")
+    args = parser.parse_args()
+
+    print(f"{'size':>10} {'characters':>12} {'legacy (s)':>12} {'new (s)':>10} {'speedup':>9}  same result")
+    for size in args.sizes:
+        text = make_output(size)
+        legacy_result, legacy_time = time_parse(LegacyComplexDictParser, text, args.repeat)
+        new_result, new_time = time_parse(ComplexDictParser, text, args.repeat)
+        print(f"{size:>10} {len(text):>12} {legacy_time:>12.4f} {new_time:>10.4f} {legacy_time / new_time:>8.1f}x  {results_equal(legacy_result, new_result)}")
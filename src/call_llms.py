@@ -1,98 +1,148 @@
-import os
+import time
+import random
+import asyncio
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_google_genai import ChatGoogleGenerativeAI
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
+from src.llm_cache import get_response_cache, CachedOpenAI, LangChainLLMCache
+from src.embedding_cache import get_embedding_cache, CachedEmbeddings
+from src.instrumentation import count_span
+from src.llm_providers import client_kwargs
 
 load_dotenv()
 
-def load_llm(llm_name: str = None) -> OpenAI:
+def load_llm(llm_name: str = None, cache_path: str | None = None, provider: str | None = None, cache_ttl: float | None = None) -> OpenAI:
     """
-    Load a large language model (LLM) based on the specified name and path.
+    Load an OpenAI-compatible client for the specified model, see llm_providers.MODEL_PROVIDERS.
+    Clients of the same provider share one connection pool and its request budget.
 
     Args:
-        llm_name (str, optional): The name of the LLM to load. Currently supports "OpenAI".
-        llm_path (str, optional): The path to the LLM if it is not OpenAI.
+        llm_name (str, optional): The name of the LLM to load.
+        cache_path (str, optional): SQLite file of an LLM response cache. Identical chat completion requests are replayed from it.
+        provider (str, optional): Provider in llm_providers.PROVIDERS to use instead of the model's default, e.g. 'local'.
+        cache_ttl (float, optional): Seconds after which cached responses are requested again. Default is no expiry.
 
     Returns:
-        OpenAI: An instance of the OpenAI client if llm_name is "OpenAI".
+        OpenAI: An OpenAI client configured with the endpoint and key of the model's provider.
 
     Raises:
-        ValueError: If the provided llm_name is unsupported or if both llm_name and llm_path are not provided.
+        ValueError: If the provided llm_name is unsupported.
+        EnvironmentError: If the API key of the provider is not set.
     """
     load_dotenv()
-    if llm_name == "deepseek-reasoner" or llm_name == "deepseek-chat":
-        deepseek_key = os.getenv("DEEPSEEK_OFFICIAL")
-        if not deepseek_key:
-            raise EnvironmentError("DeepSeek API key not set in environment.")
-        return OpenAI(
-            api_key=deepseek_key,
-            base_url="https://api.deepseek.com/v1",
-            timeout=600,
-            max_retries=3,
-        )
-    elif llm_name == "gemini-2.0-flash-thinking-exp-01-21" or llm_name == "gemini-2.0-flash" or llm_name == "gemini-2.0-pro-exp-02-05":
-        gemini_key = os.getenv("GEMINI_API_KEY")
-        if not gemini_key:
-            raise EnvironmentError("Gemini API key not set in environment.")
-        return OpenAI(
-            api_key=gemini_key,
-            base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-            timeout=600,
-            max_retries=3,
-        )
-    elif llm_name == "gpt-3.5-turbo-0125" or llm_name == "gpt-4o-2024-08-06" or llm_name == "gpt-4o-mini-2024-07-18" or llm_name == "gpt-4.5-preview-2025-02-27":
-        return OpenAI(
-            api_key=os.getenv('OPENAI_API_KEY'),
-            timeout=600,
-            max_retries=3,
-        )
-    else:
-        raise ValueError(f"Unsupported LLM: {llm_name}")
-
-def load_chat_llm(model_name:str, temperature:float|int = 0.7) -> ChatOpenAI:
+    client = OpenAI(**client_kwargs(llm_name, provider), timeout=600, max_retries=3)
+    if cache_path:
+        return CachedOpenAI(client, get_response_cache(cache_path, cache_ttl))
+    return client
+
+def load_async_llm(llm_name: str = None, cache_path: str | None = None, provider: str | None = None, cache_ttl: float | None = None) -> AsyncOpenAI:
     """
-    Load a large language model (LLM) from OpenAI.
+    Load an asyncio client for the given LLM, configured with the same endpoint and key as load_llm.
+    Retries are left to call_with_retry so that they go through the rate limiter.
+
+    Args:
+        llm_name (str, optional): The name of the LLM to load.
+        cache_path (str, optional): SQLite file of an LLM response cache, as in load_llm.
+        provider (str, optional): Provider to use instead of the model's default, as in load_llm.
+        cache_ttl (float, optional): Expiry of the cached responses in seconds, as in load_llm.
+
+    Returns:
+        AsyncOpenAI: An asyncio OpenAI-compatible client.
+    """
+    load_dotenv()
+    async_client = AsyncOpenAI(**client_kwargs(llm_name, provider, asynchronous=True), timeout=600, max_retries=0)
+    if cache_path:
+        return CachedOpenAI(async_client, get_response_cache(cache_path, cache_ttl))
+    return async_client
+
+def get_llm_provider(client: OpenAI | AsyncOpenAI) -> str:
+    """Name the provider behind a client by the host of its endpoint, e.g. 'api.deepseek.com'."""
+    return client.base_url.host
+
+class AsyncRateLimiter:
+    """
+    Spaces out requests to at most requests_per_minute across all tasks awaiting it.
+    Slots are reserved without awaiting, so no lock is needed and the limiter can outlive an event loop.
+    """
+    def __init__(self, requests_per_minute: float):
+        self.interval = 60.0 / requests_per_minute
+        self.next_slot = 0.0
+
+    async def acquire(self):
+        now = time.monotonic()
+        wait = self.next_slot - now
+        self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+_rate_limiters = {}
+
+def get_rate_limiter(provider: str, requests_per_minute: float | None) -> AsyncRateLimiter | None:
+    """Return the rate limiter of the given provider, so every model served by it shares one budget."""
+    if not requests_per_minute:
+        return None
+    if provider not in _rate_limiters:
+        _rate_limiters[provider] = AsyncRateLimiter(requests_per_minute)
+    return _rate_limiters[provider]
+
+RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError)
+
+async def call_with_retry(request, rate_limiter: AsyncRateLimiter | None = None, max_retries: int = 3, base_delay: float = 1.0, max_delay: float = 60.0):
+    """
+    Await request() and retry transient API errors with exponential backoff and full jitter.
+
+    Args:
+        request (Callable[[], Awaitable]): Creates a fresh request coroutine for every attempt.
+        rate_limiter (AsyncRateLimiter, optional): Acquired before every attempt, retries included.
+        max_retries (int): Number of retries after the first attempt.
+        base_delay (float): Backoff of the first retry in seconds, doubled on every further retry.
+        max_delay (float): Upper bound of the backoff in seconds.
+
+    Returns:
+        The result of request().
+    """
+    for attempt in range(max_retries + 1):
+        if rate_limiter:
+            await rate_limiter.acquire()
+        try:
+            return await request()
+        except RETRYABLE_ERRORS:
+            if attempt == max_retries:
+                raise
+            count_span("retries")
+            await asyncio.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+def load_chat_llm(model_name:str, temperature:float|int = 0.7, cache_path: str | None = None, provider: str | None = None, cache_ttl: float | None = None) -> ChatOpenAI:
+    """
+    Load a LangChain chat model served by an OpenAI-compatible provider, see llm_providers.MODEL_PROVIDERS.
     
     Args:
         model_name (str): The name of the model to load. Example: 'gpt-4o-mini-2024-07-18'.
+        cache_path (str, optional): SQLite file of an LLM response cache. Identical prompts are replayed from it.
+        provider (str, optional): Provider to use instead of the model's default, as in load_llm.
+        cache_ttl (float, optional): Expiry of the cached responses in seconds, as in load_llm.
         
     Returns:
         ChatOpenAI: The loaded LLM.
     """
-    if model_name == "deepseek-reasoner" or model_name == "deepseek-chat":
-        deepseek_key = os.getenv("DEEPSEEK_OFFICIAL")
-        if not deepseek_key:
-            raise EnvironmentError("DeepSeek API key not set in environment.")
-        llm = ChatOpenAI(model=model_name, api_key=deepseek_key, base_url="https://api.deepseek.com/v1", timeout=600, max_retries=3, temperature=temperature)
-    elif model_name == "gemini-2.0-flash-thinking-exp-01-21" or model_name == "gemini-2.0-flash" or model_name == "gemini-2.0-pro-exp-02-05":
-        gemini_key = os.getenv("GEMINI_API_KEY")
-        if not gemini_key:
-            raise EnvironmentError("Gemini API key not set in environment.")
-        llm = ChatOpenAI(model=model_name, api_key=gemini_key, base_url="https://generativelanguage.googleapis.com/v1beta/openai/", timeout=600, max_retries=3, temperature=temperature)
-    elif model_name == "gpt-3.5-turbo-0125" or model_name == "gpt-4o-2024-08-06" or model_name == "gpt-4o-mini-2024-07-18" or model_name == "gpt-4.5-preview-2025-02-27" :
-        openai_key = os.getenv("OPENAI_API_KEY")
-        if not openai_key:
-            raise EnvironmentError("OPENAI_KEY API key not set in environment.")
-        llm = ChatOpenAI(model=model_name, api_key=openai_key, base_url="https://test-cloudflare-7nq.pages.dev/v1/", timeout=600, max_retries=3, temperature=temperature)
-    else:
-        raise ValueError("Unsupported model.")
-    return llm
-
-def load_embedding_model(model_name:str) -> OpenAIEmbeddings:
+    cache = LangChainLLMCache(get_response_cache(cache_path, cache_ttl), model_name) if cache_path else None
+    return ChatOpenAI(model=model_name, **client_kwargs(model_name, provider, langchain=True), timeout=600, max_retries=3, temperature=temperature, cache=cache)
+
+def load_embedding_model(model_name:str, cache_path: str | None = None) -> OpenAIEmbeddings:
     """
     Load an embedding model from OpenAI.
 
     Args:
         model_name (str): The name of the embedding model to load. Example: "text-embedding-3-large".
+        cache_path (str, optional): SQLite file of an embedding cache. Texts embedded before are not sent to the API again.
 
     Returns:
         OpenAIEmbeddings: The loaded embedding model.
     """
-    openai_key = os.getenv("OPENAI_API_KEY")
-    if not openai_key:
-        raise EnvironmentError("OPENAI_KEY API key not set in environment.")
-    embedding_model = OpenAIEmbeddings(model=model_name, api_key=openai_key, base_url="https://test-cloudflare-7nq.pages.dev/v1/", timeout=600, max_retries=3)
+    embedding_model = OpenAIEmbeddings(model=model_name, **client_kwargs(model_name, langchain=True), timeout=600, max_retries=3)
+    if cache_path:
+        return CachedEmbeddings(embedding_model, get_embedding_cache(cache_path), model_name)
     return embedding_model
 
 if __name__ == "__main__":
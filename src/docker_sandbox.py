@@ -1,10 +1,131 @@
 import docker
+import docker.utils.socket
 import tempfile
 import tarfile
 import os
 import uuid
 import pickle
 import io
+import json
+import base64
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+def build_wrapper_script(source_code: str, function_name: str) -> str:
+    """
+    构建在容器内调用 py_filename 中指定函数的包装器脚本，参数从包装器所在目录的 params.pkl 读取。
+    """
+    return f"""
+import os
+import json
+import sys
+import pickle
+
+# 用户原始代码
+{source_code}
+
+if __name__ == "__main__":
+    try:
+        # 加载参数
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'params.pkl'), 'rb') as f:
+            params = pickle.load(f)
+            
+        # 验证函数存在性
+        if '{function_name}' not in locals():
+            print(f"错误：模块中未找到函数 '{{function_name}}'")
+            sys.exit(1)
+            
+        # 执行目标函数
+        target_function = locals()['{function_name}']
+        result = target_function(params)
+        
+        # 处理结果输出
+        try:
+            # 尝试JSON序列化，失败时转为字符串
+            print(json.dumps(result, default=lambda o: repr(o)))
+        except:
+            print(str(result))
+            
+    except Exception as e:
+        print(f"执行过程中发生错误: {{str(e)}}")
+        sys.exit(1)
+"""
+
+COMBINED_REPORT_MARKER = "__MTB_COMBINED_REPORT__"
+# ComplexDictParser, which the default evaluation path applies to the printed output on the host
+OUTPUT_PARSER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils.py")
+
+def load_output_parser_source() -> str:
+    with open(OUTPUT_PARSER_PATH, 'r', encoding='utf-8') as f:
+        return f.read()
+
+def build_combined_script(code: str, function_name: str, test_source: str, test_function_name: str, parser_source: str | None = None) -> str:
+    """
+    Build a script that runs the generated function and its unit test in the same interpreter.
+    The candidate and the test module get separate namespaces, and the outcome is printed as one
+    JSON line prefixed with COMBINED_REPORT_MARKER, so anything else the candidate prints is ignored.
+    Before the test, the output goes through the same str / ComplexDictParser round trip as in the default
+    path, which turns numpy scalars into Python numbers, so both paths score a candidate the same way.
+    """
+    if parser_source is None:
+        parser_source = load_output_parser_source()
+    return f"""
+import json
+import traceback
+
+CANDIDATE_SOURCE = {code!r}
+TEST_SOURCE = {test_source!r}
+PARSER_SOURCE = {parser_source!r}
+
+def report_and_exit(report):
+    print({COMBINED_REPORT_MARKER!r} + json.dumps(report, default=repr))
+    raise SystemExit(0)
+
+report = {{"stage": "function", "output": None, "test_result": None, "error": None}}
+try:
+    candidate = {{"__name__": "__main__"}}
+    exec(compile(CANDIDATE_SOURCE, "main.py", "exec"), candidate)
+    output = candidate[{function_name!r}]()
+except Exception:
+    report["error"] = traceback.format_exc()
+    report_and_exit(report)
+
+report["stage"] = "output"
+report["output"] = str(output)
+try:
+    parser_module = {{"__name__": "mtb_output_parser"}}
+    exec(compile(PARSER_SOURCE, "utils.py", "exec"), parser_module)
+    output = parser_module["ComplexDictParser"]().parse(report["output"].strip())
+except Exception:
+    report["error"] = traceback.format_exc()
+    report_and_exit(report)
+if not isinstance(output, dict) or output == {{}}:
+    report["error"] = "The output has something that cannot be parsed as a dict"
+    report_and_exit(report)
+
+report["stage"] = "test"
+try:
+    test_module = {{"__name__": "new_unit_test"}}
+    exec(compile(TEST_SOURCE, "new_unit_test.py", "exec"), test_module)
+    report["test_result"] = test_module[{test_function_name!r}](output)
+except Exception:
+    report["error"] = traceback.format_exc()
+report_and_exit(report)
+"""
+
+def parse_combined_report(stdout: str) -> dict | None:
+    """Return the report printed by a build_combined_script program, or None if it never got that far."""
+    for line in reversed(stdout.splitlines()):
+        if line.startswith(COMBINED_REPORT_MARKER):
+            try:
+                return json.loads(line[len(COMBINED_REPORT_MARKER):])
+            except json.JSONDecodeError:
+                return None
+    return None
+
 class DockerSandbox:
     def __init__(self, image: str = "mat-tool-ben", container_name: str = "mat_tool_sandbox"):
         self.client = docker.from_env()
@@ -87,40 +208,7 @@ class DockerSandbox:
                 container_name = f"{self.container_name}_{unique_id}"
                 
                 # 创建包装器脚本
-                wrapper_script = f"""
-import json
-import sys
-import pickle
-
-# 用户原始代码
-{source_code}
-
-if __name__ == "__main__":
-    try:
-        # 加载参数
-        with open('/app/params.pkl', 'rb') as f:
-            params = pickle.load(f)
-            
-        # 验证函数存在性
-        if '{function_name}' not in locals():
-            print(f"错误：模块中未找到函数 '{{function_name}}'")
-            sys.exit(1)
-            
-        # 执行目标函数
-        target_function = locals()['{function_name}']
-        result = target_function(params)
-        
-        # 处理结果输出
-        try:
-            # 尝试JSON序列化，失败时转为字符串
-            print(json.dumps(result, default=lambda o: repr(o)))
-        except:
-            print(str(result))
-            
-    except Exception as e:
-        print(f"执行过程中发生错误: {{str(e)}}")
-        sys.exit(1)
-"""
+                wrapper_script = build_wrapper_script(source_code, function_name)
                 # 创建临时包装器文件
                 with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as temp_wrapper_file:
                     temp_wrapper_file.write(wrapper_script)
@@ -165,4 +253,368 @@ if __name__ == "__main__":
             except docker.errors.DockerException as e:
                 return f"Docker 错误: {str(e)}"
             except Exception as e:
-                return f"执行过程中发生异常: {str(e)}"
\ No newline at end of file
+                return f"执行过程中发生异常: {str(e)}"
+
+    def execute_with_test(self, code: str, function_name: str, py_filename: str, test_function_name: str) -> str|dict:
+        """
+        Run the generated function and the unit test function from py_filename in one container.
+
+        Args:
+            code (str): The generated code defining function_name.
+            function_name (str): The generated function, called without arguments.
+            py_filename (str): The unit test file (path on the local file system).
+            test_function_name (str): The test function, called with the generated function's output.
+
+        Returns:
+            str|dict: An error message if the container could not run, otherwise the stdout/stderr of the run
+            plus "report", the parsed outcome of both steps (None if the script did not reach the report).
+        """
+        if not os.path.isfile(py_filename):
+            return f"Error: File {py_filename} does not exist"
+        with open(py_filename, 'r') as f:
+            test_source = f.read()
+        result = self.execute_code(build_combined_script(code, function_name, test_source, test_function_name))
+        if isinstance(result, str):
+            return result
+        result["report"] = parse_combined_report(result["stdout"])
+        return result
+
+# Long-lived worker that runs inside each pooled container. It pre-imports the heavy
+# modules once, then forks a fresh child interpreter for every job it reads from stdin,
+# so jobs stay isolated while the import cost is paid only once per container.
+# Every job gets its own working directory, removed afterwards, that links to the entries of /app
+# (e.g. tool_source_code), so relative paths resolve as in a fresh container.
+POOL_WORKER_SCRIPT = r'''
+import base64
+import importlib
+import json
+import os
+import runpy
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import traceback
+
+# fd 1 is the protocol channel back to the host; everything else printed by the worker
+# itself (including noise from pre-imports) goes to stderr.
+channel = os.fdopen(os.dup(1), "w", buffering=1)
+os.dup2(2, 1)
+
+for module_name in sys.argv[1:]:
+    try:
+        importlib.import_module(module_name)
+    except Exception as e:
+        print(f"Failed to preload {module_name}: {e}", file=sys.stderr)
+
+
+def make_job_dir():
+    job_dir = tempfile.mkdtemp(prefix="job_")
+    for name in os.listdir("/app"):
+        os.symlink(os.path.join("/app", name), os.path.join(job_dir, name))
+    return job_dir
+
+
+def run_child(job, job_dir, stdout_path, stderr_path):
+    os.chdir(job_dir)
+    for name, content in job["files"].items():
+        path = os.path.join(job_dir, name)
+        if os.path.islink(path):
+            os.unlink(path)
+        with open(path, "wb") as f:
+            f.write(base64.b64decode(content))
+    # the worker's stdin carries the job stream, a job must not read from it
+    null_fd = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(null_fd, 0)
+    os.close(null_fd)
+    sys.stdin = open(0, "r", closefd=False)
+    out_fd = os.open(stdout_path, os.O_WRONLY | os.O_TRUNC)
+    err_fd = out_fd if job.get("merge_stderr") else os.open(stderr_path, os.O_WRONLY | os.O_TRUNC)
+    os.dup2(out_fd, 1)
+    os.dup2(err_fd, 2)
+    entry = os.path.join(job_dir, job["entry"])
+    sys.argv = [entry]
+    sys.path[0] = job_dir
+    exit_code = 0
+    try:
+        runpy.run_path(entry, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code, int):
+            exit_code = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            exit_code = 1
+    except BaseException as e:
+        # Drop the worker's own frames so the traceback reads like `python main.py`.
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != entry:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb or e.__traceback__)
+        exit_code = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(exit_code)
+
+
+def wait_child(pid, timeout):
+    if timeout is None:
+        return os.waitpid(pid, 0)[1], False
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        finished, status = os.waitpid(pid, os.WNOHANG)
+        if finished:
+            return status, False
+        time.sleep(0.02)
+    os.kill(pid, signal.SIGKILL)
+    return os.waitpid(pid, 0)[1], True
+
+
+def read_text(path):
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8", errors="replace")
+
+
+for line in sys.stdin:
+    if not line.strip():
+        continue
+    job = json.loads(line)
+    stdout_path = tempfile.mkstemp(prefix="job_stdout_")[1]
+    stderr_path = tempfile.mkstemp(prefix="job_stderr_")[1]
+    job_dir = make_job_dir()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_child(job, job_dir, stdout_path, stderr_path)
+            finally:
+                # never fall back into the job loop of the worker
+                os._exit(1)
+        status, timed_out = wait_child(pid, job.get("timeout"))
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+    stdout = read_text(stdout_path)
+    stderr = "" if job.get("merge_stderr") else read_text(stderr_path)
+    if timed_out:
+        stderr += f"\nJob exceeded the time limit of {job['timeout']} seconds and was killed."
+    os.unlink(stdout_path)
+    os.unlink(stderr_path)
+    response = {
+        "id": job["id"],
+        "stdout": stdout,
+        "stderr": stderr,
+        "exit_code": os.waitstatus_to_exitcode(status),
+    }
+    channel.write(json.dumps(response) + "\n")
+'''
+
+class _PoolWorker:
+    """A single long-lived container running POOL_WORKER_SCRIPT, talked to over its attached stdin/stdout."""
+    def __init__(self, client, image: str, name: str, preload_modules: list):
+        self.container = client.containers.create(
+            image,
+            command=["python", "/opt/pool_worker.py", *preload_modules],
+            working_dir="/app",
+            detach=True,
+            stdin_open=True,
+            name=name
+        )
+        script = POOL_WORKER_SCRIPT.encode("utf-8")
+        tar_stream = io.BytesIO()
+        with tarfile.open(fileobj=tar_stream, mode='w') as tar:
+            info = tarfile.TarInfo(name='pool_worker.py')
+            info.size = len(script)
+            tar.addfile(info, io.BytesIO(script))
+        self.container.put_archive('/opt', tar_stream.getvalue())
+        self.socket = self.container.attach_socket(params={"stdin": 1, "stdout": 1, "stderr": 1, "stream": 1})
+        self.container.start()
+        self.buffer = b""
+
+    def run(self, job: dict) -> dict:
+        self.socket._sock.sendall((json.dumps(job) + "\n").encode("utf-8"))
+        while b"\n" not in self.buffer:
+            stream, size = docker.utils.socket.next_frame_header(self.socket)
+            if stream == -1:
+                raise docker.errors.DockerException(f"Pool worker {self.container.name} closed its channel")
+            data = docker.utils.socket.read_exactly(self.socket, size)
+            # stream 1 is the protocol channel, stream 2 is the worker's own stderr
+            if stream == 1:
+                self.buffer += data
+        line, self.buffer = self.buffer.split(b"\n", 1)
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.socket.close()
+        finally:
+            self.container.remove(force=True)
+
+class DockerSandboxPool:
+    """
+    A pool of long-lived sandbox containers that execute code without paying container
+    startup and pymatgen imports on every call. Each job runs in a freshly forked
+    interpreter inside one of the workers, so jobs cannot see each other's state.
+
+    execute_code and execute_file return the same results as their DockerSandbox
+    counterparts, so the pool can be passed anywhere a DockerSandbox is expected.
+    """
+    DEFAULT_PRELOAD_MODULES = ["numpy", "pymatgen.core", "pymatgen.io.vasp", "pymatgen.analysis.defects.core"]
+
+    def __init__(self, size: int = 4, image: str = "mat-tool-ben", container_name: str = "mat_tool_sandbox_pool",
+                 preload_modules: list | None = None, timeout: float | None = None):
+        """
+        Args:
+            size (int): Number of worker containers, i.e. the number of jobs that can run at once.
+            image (str): The Docker image used for the workers.
+            container_name (str): Prefix of the worker container names.
+            preload_modules (list, optional): Modules imported once per worker before any job is forked.
+            timeout (float, optional): Per-job time limit in seconds. None means no limit.
+        """
+        self.client = docker.from_env()
+        self.image = image
+        self.container_name = container_name
+        self.preload_modules = self.DEFAULT_PRELOAD_MODULES if preload_modules is None else preload_modules
+        self.timeout = timeout
+        self.size = size
+        self.size_lock = threading.Lock()
+        self.closed = False
+        # every live worker, idle or busy, so close() can also stop the ones still running a job
+        self.workers = set()
+        self.idle_workers = queue.Queue()
+        for _ in range(size):
+            self.idle_workers.put(self._start_worker())
+
+    def _start_worker(self) -> _PoolWorker:
+        unique_id = str(uuid.uuid4())[:8]
+        worker = _PoolWorker(self.client, self.image, f"{self.container_name}_{unique_id}", self.preload_modules)
+        with self.size_lock:
+            if not self.closed:
+                self.workers.add(worker)
+                return worker
+        worker.close()
+        raise docker.errors.DockerException("The sandbox pool is closed")
+
+    def _close_worker(self, worker: _PoolWorker):
+        with self.size_lock:
+            if worker not in self.workers:
+                return
+            self.workers.discard(worker)
+        try:
+            worker.close()
+        except Exception:
+            pass
+
+    def _replace_worker(self, worker: _PoolWorker, attempts: int = 2):
+        """Close a broken worker and start a new one in its place; the pool shrinks if no new worker starts."""
+        self._close_worker(worker)
+        if self.closed:
+            return
+        for attempt in range(attempts):
+            try:
+                self.idle_workers.put(self._start_worker())
+                return
+            except Exception as e:
+                logger.warning(f"Could not start a replacement pool worker (attempt {attempt + 1}/{attempts}): {e}")
+        with self.size_lock:
+            self.size -= 1
+        logger.error(f"Sandbox pool shrank to {self.size} workers.")
+
+    def _acquire_worker(self) -> _PoolWorker:
+        while True:
+            if self.closed:
+                raise docker.errors.DockerException("The sandbox pool is closed")
+            if self.size <= 0:
+                raise docker.errors.DockerException("No live sandbox pool workers left")
+            try:
+                return self.idle_workers.get(timeout=1)
+            except queue.Empty:
+                continue
+
+    def _run_job(self, files: dict, entry: str, merge_stderr: bool = False) -> dict:
+        job = {
+            "id": str(uuid.uuid4()),
+            "files": {name: base64.b64encode(content).decode("ascii") for name, content in files.items()},
+            "entry": entry,
+            "merge_stderr": merge_stderr,
+            "timeout": self.timeout,
+        }
+        worker = self._acquire_worker()
+        try:
+            result = worker.run(job)
+        except Exception:
+            # A broken worker is replaced so the pool keeps its size; only live workers go back to the queue.
+            self._replace_worker(worker)
+            raise
+        if self.closed:
+            self._close_worker(worker)
+        else:
+            self.idle_workers.put(worker)
+        return result
+
+    def execute_code(self, code: str) -> str|dict:
+        """Execute the given Python code in a pooled worker and return the output."""
+        try:
+            result = self._run_job({"main.py": code.encode("utf-8")}, "main.py")
+            return {
+                "stdout": result["stdout"].strip(),
+                "stderr": result["stderr"].strip(),
+            }
+        except docker.errors.DockerException as e:
+            return f"Docker error during execution: {str(e)}"
+        except Exception as e:
+            return f"Error during execution: {str(e)}"
+
+    def execute_file(self, params_dict: dict, py_filename: str, function_name: str) -> str:
+        """
+        Run function_name from py_filename on params_dict in a pooled worker, like DockerSandbox.execute_file.
+        """
+        try:
+            if not os.path.isfile(py_filename):
+                return f"Error: File {py_filename} does not exist"
+
+            with open(py_filename, 'r') as f:
+                source_code = f.read()
+
+            try:
+                params_bytes = pickle.dumps(params_dict)
+            except Exception as e:
+                return f"参数序列化失败: {str(e)}"
+
+            wrapper_script = build_wrapper_script(source_code, function_name)
+            result = self._run_job(
+                {"wrapper.py": wrapper_script.encode("utf-8"), "params.pkl": params_bytes},
+                "wrapper.py",
+                merge_stderr=True
+            )
+            # stderr is merged into stdout; it only holds the time limit notice of a killed job
+            logs = (result["stdout"] + result["stderr"]).strip()
+            if result["exit_code"] != 0:
+                return f"执行失败（状态码 {result['exit_code']}）:\n{logs}"
+            return logs
+
+        except docker.errors.DockerException as e:
+            return f"Docker 错误: {str(e)}"
+        except Exception as e:
+            return f"执行过程中发生异常: {str(e)}"
+
+    execute_with_test = DockerSandbox.execute_with_test
+
+    def close(self):
+        """Stop and remove all worker containers, including those still running a job."""
+        with self.size_lock:
+            self.closed = True
+            workers = list(self.workers)
+        for worker in workers:
+            self._close_worker(worker)
+        while not self.idle_workers.empty():
+            self.idle_workers.get()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
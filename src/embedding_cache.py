@@ -0,0 +1,135 @@
+'''
+Persistent cache of text embeddings, wrapped around the embedding model returned by load_embedding_model.
+Vectors are stored as float32 blobs keyed by (model, sha256 of the text), so the questions and generated queries
+embedded in one sweep are never sent to the embedding API again in later runs, models or methods.
+'''
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from typing import List
+import numpy as np
+from langchain_core.embeddings import Embeddings
+try:
+    from src.instrumentation import count_span
+except ImportError:  # run as a script from src/ without the repository root on sys.path
+    from instrumentation import count_span
+
+DEFAULT_CACHE_PATH = "embedding_cache/embeddings.sqlite3"
+
+class EmbeddingCache:
+    """
+    SQLite-backed store of float32 embedding vectors.
+    """
+    def __init__(self, db_path: str = DEFAULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT, text_hash TEXT, vector BLOB, created_at REAL, "
+                "PRIMARY KEY (model, text_hash))"
+            )
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, text_hashes: List[str]) -> dict:
+        """Return {text_hash: vector} for the hashes that are stored."""
+        found = {}
+        with self.lock:
+            for start in range(0, len(text_hashes), 500):
+                chunk = text_hashes[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(chunk))})",
+                    (model, *chunk)
+                ).fetchall()
+                found.update((text_hash, np.frombuffer(vector, dtype=np.float32)) for text_hash, vector in rows)
+        return found
+
+    def put_many(self, model: str, items: dict):
+        """Store {text_hash: vector}."""
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, created_at) VALUES (?, ?, ?, ?)",
+                [(model, text_hash, np.asarray(vector, dtype=np.float32).tobytes(), now) for text_hash, vector in items.items()]
+            )
+
+    def clear(self, model: str | None = None) -> int:
+        with self.lock, self.connection:
+            if model is None:
+                cursor = self.connection.execute("DELETE FROM embeddings")
+            else:
+                cursor = self.connection.execute("DELETE FROM embeddings WHERE model = ?", (model,))
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self.lock:
+            rows = self.connection.execute("SELECT model, COUNT(*) FROM embeddings GROUP BY model").fetchall()
+        return {model: {"entries": entries} for model, entries in rows}
+
+    def close(self):
+        self.connection.close()
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper serving embed_documents / embed_query from an EmbeddingCache.
+    All texts missing from the cache are embedded with a single batched call to the wrapped model.
+    """
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model: str | None = None):
+        """
+        Args:
+            embeddings (Embeddings): The wrapped model, e.g. OpenAIEmbeddings.
+            cache (EmbeddingCache): The vector store.
+            model (str, optional): Model name used in the cache key. Defaults to embeddings.model.
+        """
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model or getattr(embeddings, "model", type(embeddings).__name__)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        text_hashes = [EmbeddingCache.text_hash(text) for text in texts]
+        vectors = self.cache.get_many(self.model, list(set(text_hashes)))
+        missing = {}
+        for text, text_hash in zip(texts, text_hashes):
+            if text_hash not in vectors:
+                missing.setdefault(text_hash, text)
+        count_span("embedding_cache_hits", len(set(text_hashes)) - len(missing))
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = {text_hash: np.asarray(vector, dtype=np.float32) for text_hash, vector in zip(missing, new_vectors)}
+            self.cache.put_many(self.model, new_items)
+            vectors.update(new_items)
+        return [vectors[text_hash].tolist() for text_hash in text_hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+_caches = {}
+
+def get_embedding_cache(db_path: str = DEFAULT_CACHE_PATH) -> EmbeddingCache:
+    """Return the EmbeddingCache of db_path, opening it once per process."""
+    if db_path not in _caches:
+        _caches[db_path] = EmbeddingCache(db_path)
+    return _caches[db_path]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or clear the embedding cache. Example input: clear --model text-embedding-3-large")
+    parser.add_argument("command", choices=["stats", "clear"], help="stats: show entry counts per model; clear: remove entries.")
+    parser.add_argument("--db_path", type=str, default=DEFAULT_CACHE_PATH, help=f"Cache database. Default is {DEFAULT_CACHE_PATH}.")
+    parser.add_argument("--model", type=str, default=None, help="clear: only remove entries of this model.")
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(args.db_path)
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), indent=2))
+    else:
+        print(f"Removed {cache.clear(args.model)} entries from {args.db_path}")
+    cache.close()
@@ -0,0 +1,89 @@
+'''
+Incremental writer of function_generation_results.jsonl used by the code generators.
+Every answer is appended and fsynced as soon as it is extracted, so an interrupted run can be resumed
+without asking the LLM again for the questions that are already in the file.
+'''
+import os
+import json
+import threading
+from typing import List, Dict
+
+class GenerationCheckpoint:
+    """
+    Append-only JSONL file of generated functions, keyed by question folder name.
+    """
+    def __init__(self, output_file: str, resume: bool = False):
+        """
+        Args:
+            output_file (str): Path of function_generation_results.jsonl. Its directory is created if needed.
+            resume (bool): Keep the answers already in output_file. Otherwise the file is started afresh.
+        """
+        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+        self.output_file = output_file
+        self.lock = threading.Lock()
+        self.entries = {}
+        if resume and os.path.exists(output_file):
+            self._load()
+        else:
+            open(output_file, "w", encoding="utf-8").close()
+        self.file = open(output_file, "a", encoding="utf-8")
+
+    def _load(self):
+        """Read the recorded answers and cut off a trailing line left incomplete by a crash."""
+        valid_size = 0
+        with open(self.output_file, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                self.entries[entry["question_file_path"]] = entry
+                valid_size += len(line)
+        with open(self.output_file, "r+b") as f:
+            f.truncate(valid_size)
+
+    @staticmethod
+    def question_key(question_file_path: str) -> str:
+        """The question folder name, as stored in the 'question_file_path' field."""
+        return os.path.basename(os.path.dirname(question_file_path))
+
+    def is_done(self, question_file_path: str) -> bool:
+        return self.question_key(question_file_path) in self.entries
+
+    def pending(self, questions_files_path: List[str]) -> List[str]:
+        """Return the questions that have no recorded answer yet, in their original order."""
+        return [q for q in questions_files_path if not self.is_done(q)]
+
+    def record(self, question_file_path: str, function: str, function_name: str) -> Dict:
+        """Append one answer and make sure it is on disk before returning."""
+        entry = {"question_file_path": self.question_key(question_file_path), "function": function, "function_name": function_name}
+        with self.lock:
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.entries[entry["question_file_path"]] = entry
+        return entry
+
+    def finalize(self, questions_files_path: List[str]) -> List[Dict]:
+        """
+        Rewrite the file in question order, so it matches the output of an uninterrupted sequential run.
+        Returns:
+            List[Dict]: The entries in question order.
+        """
+        with self.lock:
+            self.file.close()
+            ordered = [self.entries[self.question_key(q)] for q in questions_files_path if self.is_done(q)]
+            temp_file = self.output_file + ".tmp"
+            with open(temp_file, "w", encoding="utf-8") as f:
+                for entry in ordered:
+                    f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.output_file)
+            self.file = open(self.output_file, "a", encoding="utf-8")
+        return ordered
+
+    def close(self):
+        self.file.close()
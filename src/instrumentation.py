@@ -0,0 +1,254 @@
+'''
+Structured timing and token accounting for the generation and evaluation pipelines.
+Stages run inside spans (retrieve, rerank, generate, sandbox_execute, parse, unit_test, ...). Every finished span
+is appended to a JSONL events file as one OTLP-style record: trace and span ids, parent span, start/end time,
+duration, status and attributes such as tokens_in, tokens_out, retries and cache_hits.
+Usage of responses served from the LLM cache is kept apart in cached_tokens_in / cached_tokens_out and is not priced.
+`python instrumentation.py report <events files>` aggregates p50/p95 latency and cost per model, method and stage.
+Spans are only written after configure() was called, otherwise they cost a few dictionary updates.
+'''
+import os
+import json
+import time
+import uuid
+import argparse
+import threading
+import contextvars
+from contextlib import contextmanager
+
+SPAN_NAMES = ["question", "retrieve", "rerank", "generate", "sandbox_execute", "parse", "unit_test"]
+
+# USD per 1M (input, output) tokens, used by the report
+MODEL_PRICES = {
+    "gpt-4o-mini-2024-07-18": (0.15, 0.60),
+    "gpt-4o-2024-08-06": (2.50, 10.00),
+    "gpt-3.5-turbo-0125": (0.50, 1.50),
+    "gpt-4.5-preview-2025-02-27": (75.00, 150.00),
+    "o1-preview-2024-09-12": (15.00, 60.00),
+    "deepseek-chat": (0.27, 1.10),
+    "deepseek-reasoner": (0.55, 2.19),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "text-embedding-3-large": (0.13, 0.0),
+}
+
+_current_span = contextvars.ContextVar("mtb_current_span", default=None)
+
+class Span:
+    """
+    One timed stage. Attributes can be set while the span is open; numeric counters are summed with add.
+    """
+    def __init__(self, name: str, trace_id: str, parent_span_id: str | None, attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_span_id = parent_span_id
+        self.attributes = attributes
+        self.start_time = time.time()
+        self.start = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, name: str, value: int = 1):
+        self.attributes[name] = self.attributes.get(name, 0) + value
+
+    def record_usage(self, response):
+        """
+        Add the token usage of an OpenAI ChatCompletion or a LangChain AIMessage to tokens_in / tokens_out.
+        Responses replayed from the LLM cache were not billed: their usage goes to cached_tokens_in / cached_tokens_out instead.
+        """
+        tokens_in, tokens_out = token_usage(response)
+        prefix = ""
+        if is_cache_hit(response):
+            self.set(cached=True)
+            prefix = "cached_"
+        if tokens_in is not None:
+            self.add(prefix + "tokens_in", tokens_in)
+        if tokens_out is not None:
+            self.add(prefix + "tokens_out", tokens_out)
+
+def is_cache_hit(response) -> bool:
+    """Whether response was replayed by llm_cache (CachedOpenAI or LangChainLLMCache) instead of returned by the API."""
+    if getattr(response, "_cache_hit", False):
+        return True
+    return bool((getattr(response, "response_metadata", None) or {}).get("cache_hit"))
+
+def token_usage(response) -> tuple:
+    """Return (input tokens, output tokens) of a response, or (None, None) if it reports no usage."""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None)
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        return usage.get("input_tokens"), usage.get("output_tokens")
+    token_usage_metadata = (getattr(response, "response_metadata", None) or {}).get("token_usage")
+    if token_usage_metadata:
+        return token_usage_metadata.get("prompt_tokens"), token_usage_metadata.get("completion_tokens")
+    return None, None
+
+class Instrumentation:
+    """
+    Appends finished spans to a JSONL events file. resource attributes (model, method, ...) are stored with every event.
+    """
+    def __init__(self, events_file: str, **resource):
+        os.makedirs(os.path.dirname(events_file) or ".", exist_ok=True)
+        self.events_file = events_file
+        self.resource = resource
+        self.lock = threading.Lock()
+        self.file = open(events_file, "a", encoding="utf-8")
+
+    def emit(self, span: Span, status: str, error: str | None = None):
+        end_time = time.time()
+        event = {
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_span_id": span.parent_span_id,
+            "name": span.name,
+            "start_time_unix_nano": int(span.start_time * 1e9),
+            "end_time_unix_nano": int(end_time * 1e9),
+            "duration_ms": round((time.perf_counter() - span.start) * 1000, 3),
+            "status": status,
+            "attributes": span.attributes,
+            "resource": self.resource,
+        }
+        if error is not None:
+            event["error"] = error
+        line = json.dumps(event, ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+_instrumentation = None
+
+def configure(events_file: str | None, **resource) -> Instrumentation | None:
+    """
+    Start writing spans to events_file, e.g. configure("pure_agent_test/gpt-4o-mini/events.jsonl", model=..., method="pure").
+    Passing None leaves instrumentation off.
+    """
+    global _instrumentation
+    if _instrumentation is not None:
+        _instrumentation.close()
+        _instrumentation = None
+    if events_file:
+        _instrumentation = Instrumentation(events_file, **resource)
+    return _instrumentation
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time the enclosed block as a child of the current span. Exceptions mark the span as failed and are re-raised.
+    """
+    parent = _current_span.get()
+    current = Span(name, parent.trace_id if parent else uuid.uuid4().hex, parent.span_id if parent else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        if _instrumentation is not None:
+            _instrumentation.emit(current, "error", f"{type(e).__name__}: {e}")
+        raise
+    else:
+        if _instrumentation is not None:
+            _instrumentation.emit(current, "ok")
+    finally:
+        _current_span.reset(token)
+
+def current_span() -> Span | None:
+    return _current_span.get()
+
+def annotate_span(**attributes):
+    """Set attributes on the current span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+def count_span(name: str, value: int = 1):
+    """Increase a counter (retries, cache_hits, ...) of the current span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.add(name, value)
+
+def record_usage(response):
+    """Add the token usage of response to the current span, if any."""
+    current = _current_span.get()
+    if current is not None:
+        current.record_usage(response)
+
+def percentile(values: list, q: float) -> float:
+    """Linearly interpolated percentile, q in [0, 100]."""
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def span_cost(event: dict) -> float | None:
+    attributes = event["attributes"]
+    if "tokens_in" not in attributes and "tokens_out" not in attributes:
+        return None
+    prices = MODEL_PRICES.get(attributes.get("model") or event["resource"].get("model"))
+    if prices is None:
+        return None
+    return (attributes.get("tokens_in", 0) * prices[0] + attributes.get("tokens_out", 0) * prices[1]) / 1_000_000
+
+def aggregate(events_files: list) -> list:
+    """
+    Group the spans of the events files by (model, method, span name).
+    Returns:
+        list: One dict per group with count, errors, p50/p95/mean/total latency, tokens, retries, cache hits and cost.
+    """
+    groups = {}
+    for events_file in events_files:
+        with open(events_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                model = event["attributes"].get("model") or event["resource"].get("model", "")
+                key = (model, event["resource"].get("method", ""), event["name"])
+                groups.setdefault(key, []).append(event)
+    rows = []
+    for (model, method, name), events in sorted(groups.items()):
+        durations = [event["duration_ms"] / 1000 for event in events]
+        costs = [cost for cost in map(span_cost, events) if cost is not None]
+        rows.append({
+            "model": model,
+            "method": method,
+            "span": name,
+            "count": len(events),
+            "errors": sum(event["status"] != "ok" for event in events),
+            "p50_s": percentile(durations, 50),
+            "p95_s": percentile(durations, 95),
+            "mean_s": sum(durations) / len(durations),
+            "total_s": sum(durations),
+            "tokens_in": sum(event["attributes"].get("tokens_in", 0) for event in events),
+            "tokens_out": sum(event["attributes"].get("tokens_out", 0) for event in events),
+            "retries": sum(event["attributes"].get("retries", 0) for event in events),
+            "cache_hits": sum(event["attributes"].get("cache_hits", 0) for event in events),
+            "cached_tokens_in": sum(event["attributes"].get("cached_tokens_in", 0) for event in events),
+            "cached_tokens_out": sum(event["attributes"].get("cached_tokens_out", 0) for event in events),
+            "cost_usd": sum(costs) if costs else None,
+        })
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize span events. Example input: report pure_agent_test/gpt-4o-mini-2024-07-18/events.jsonl")
+    parser.add_argument("command", choices=["report"], help="report: p50/p95 latency, tokens and cost per model, method and stage.")
+    parser.add_argument("events_files", type=str, nargs="+", help="JSONL events files written with --events_file.")
+    parser.add_argument("--json", action="store_true", default=False, help="Print the rows as JSON instead of a table.")
+    args = parser.parse_args()
+
+    rows = aggregate(args.events_files)
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        header = f"{'model':<28} {'method':<14} {'span':<16} {'count':>6} {'errors':>6} {'p50 (s)':>9} {'p95 (s)':>9} {'total (s)':>10} {'tokens in':>10} {'tokens out':>10} {'retries':>7} {'cache hits':>10} {'cost ($)':>9}"
+        print(header)
+        print("-" * len(header))
+        for row in rows:
+            cost = f"{row['cost_usd']:.4f}" if row["cost_usd"] is not None else "-"
+            print(f"{row['model']:<28} {row['method']:<14} {row['span']:<16} {row['count']:>6} {row['errors']:>6} {row['p50_s']:>9.3f} {row['p95_s']:>9.3f} {row['total_s']:>10.2f} {row['tokens_in']:>10} {row['tokens_out']:>10} {row['retries']:>7} {row['cache_hits']:>10} {cost:>9}")
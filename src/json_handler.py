@@ -1,6 +1,70 @@
 # modified based on https://github.com/OpenBMB/RepoAgent/blob/main/repo_agent/chat_with_repo/json_handler.py and vector_store_manager.py
+import os
+import re
 import json
 import sys
+import threading
+
+class SymbolIndex:
+    """
+    In-memory index of an LLM-doc database from symbol name to its code and md records.
+    Besides the plain name, every record is reachable by its qualified name (e.g. pymatgen.core.structure.Structure)
+    and by a normalized fuzzy key that ignores case, underscores and call parentheses. Different names can share
+    a fuzzy key (get_structure and getstructure, _foo and foo); such keys are ambiguous and never resolved.
+    """
+    def __init__(self, data):
+        self.by_name = {}
+        self.by_qualified_name = {}
+        self.by_fuzzy_name = {}
+        for data_item in data:
+            metadata = data_item['metadata']
+            record = (
+                "--------------\n\n" + metadata['code_source_file'] + "\n\n" + metadata['code_content'] + "--------------\n\n",
+                data_item['page_content']
+            )
+            self.by_name.setdefault(metadata['name'], []).append(record)
+            self.by_qualified_name.setdefault(self.qualified_name(metadata['code_source_file'], metadata['name']), []).append(record)
+            self.by_fuzzy_name.setdefault(self.fuzzy_key(metadata['name']), {}).setdefault(metadata['name'], []).append(record)
+
+    @staticmethod
+    def qualified_name(code_source_file, name):
+        module = re.sub(r"\.py$", "", code_source_file).replace("/", ".")
+        return module + "." + name
+
+    @staticmethod
+    def fuzzy_key(name):
+        return re.sub(r"[\s_]|\(.*\)$", "", name).lower()
+
+    def lookup(self, search_text, qualified=False, fuzzy=False):
+        """
+        Return the (code, md) records of search_text. The plain name is tried first; with qualified=True a dotted name
+        is resolved by its qualified name and then by its last component; with fuzzy=True the fuzzy key is tried last,
+        and only matches if all names with that key are the same.
+        """
+        records = self.by_name.get(search_text, [])
+        if not records and qualified and "." in search_text:
+            records = self.by_qualified_name.get(search_text) or self.by_name.get(search_text.rsplit(".", 1)[-1], [])
+        if not records and fuzzy:
+            matches = self.by_fuzzy_name.get(self.fuzzy_key(search_text.rsplit(".", 1)[-1]), {})
+            if len(matches) == 1:
+                records = next(iter(matches.values()))
+        return records
+
+# file_path -> ((mtime_ns, size), SymbolIndex); the database is parsed once per process, not once per lookup
+_symbol_indexes = {}
+_symbol_indexes_lock = threading.Lock()
+
+def load_symbol_index(file_path):
+    """Return the SymbolIndex of file_path, rebuilding it only when the file has changed."""
+    stat = os.stat(file_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _symbol_indexes_lock:
+        cached = _symbol_indexes.get(file_path)
+        if cached is None or cached[0] != version:
+            with open(file_path, "r", encoding="utf-8") as file:
+                cached = (version, SymbolIndex(json.load(file)))
+            _symbol_indexes[file_path] = cached
+    return cached[1]
 
 class JsonFileProcessor:
     def __init__(self, file_path):
@@ -69,24 +133,25 @@ class JsonFileProcessor:
                 code_results.append("--------------\n\n" + data['metadata']['code_source_file'] + "\n\n" + data['metadata']['code_content'] + "--------------\n\n")
                 md_results.append(data['page_content'])
 
-    def search_code_contents_by_name(self, file_path, search_text):
-        # Attempt to retrieve code from the JSON file
+    def search_code_contents_by_name(self, file_path, search_text, qualified=False, fuzzy=False):
+        """
+        Look up the code and md contents of a class or function by name in the indexed database.
+        qualified=True also resolves dotted names such as pymatgen.core.structure.Structure,
+        fuzzy=True also matches names differing only in case, underscores or trailing parentheses.
+        """
         try:
-            with open(file_path, "r", encoding="utf-8") as file:
-                data = json.load(file)
-                code_results = []
-                md_results = []  # List to store matching items' code_content and md_content
-                # Remove any leading/trailing quotes from search_text
-                search_text = search_text.strip('"').strip("'").strip()
-                self.plain_search(data, search_text, code_results, md_results)
-                # 确保无论结果如何都返回两个值
-                if code_results or md_results:
-                    return code_results, md_results
-                else:
-                    return ["No matching item found."], ["No matching item found."]
+            symbol_index = load_symbol_index(file_path)
+            # Remove any leading/trailing quotes from search_text
+            search_text = search_text.strip('"').strip("'").strip()
+            records = symbol_index.lookup(search_text, qualified=qualified, fuzzy=fuzzy)
+            # 确保无论结果如何都返回两个值
+            if records:
+                return [code for code, _ in records], [md for _, md in records]
+            else:
+                return ["No matching item found."], ["No matching item found."]
         except FileNotFoundError:
             return ["File not found."], ["File not found."]
         except json.JSONDecodeError:
             return ["Invalid JSON data."], ["Invalid JSON data."]
         except Exception as e:
-            return [str(e)], [str(e)]
\ No newline at end of file
+            return [str(e)], [str(e)]
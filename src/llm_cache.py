@@ -0,0 +1,267 @@
+'''
+On-disk cache of LLM chat completions shared by the generators and the QA evaluator.
+Requests are keyed by model, messages, temperature, response_format and the remaining request parameters,
+so rerunning an analysis, or resuming after a crash, replays identical calls locally instead of paying for them again.
+'''
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from openai import OpenAI, AsyncOpenAI
+from openai.types.chat import ChatCompletion
+
+try:
+    from langchain_core.caches import BaseCache
+    from langchain_core.outputs import ChatGeneration, Generation
+    from langchain_core.messages import message_to_dict, messages_from_dict
+except ImportError:  # the QA benchmark only needs the OpenAI client wrapper
+    BaseCache = object
+try:
+    from src.instrumentation import count_span
+except ImportError:  # run as a script from src/ without the repository root on sys.path
+    from instrumentation import count_span
+
+DEFAULT_CACHE_PATH = "llm_cache/responses.sqlite3"
+
+class LLMResponseCache:
+    """
+    SQLite-backed store of LLM responses with optional time-to-live and least-recently-used eviction.
+    """
+    def __init__(self, db_path: str = DEFAULT_CACHE_PATH, ttl_seconds: float | None = None, max_entries: int = 100000):
+        """
+        Args:
+            db_path (str): The SQLite database file. Its directory is created if needed.
+            ttl_seconds (float, optional): Entries older than this are treated as missing. Default is no expiry.
+            max_entries (int): Least recently used entries are evicted beyond this number.
+        """
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, "
+                "created_at REAL, last_access REAL, hits INTEGER DEFAULT 0)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    @staticmethod
+    def make_key(request: dict) -> str:
+        """
+        Hash a chat completion request. model, messages, temperature and response_format are always part of the key,
+        any other parameter (top_p, max_tokens, ...) is included as well so different requests never share an entry.
+        """
+        request = dict(request)
+        for name in ("model", "messages", "temperature", "response_format"):
+            request.setdefault(name, None)
+        payload = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.connection.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl_seconds is not None and row[1] < time.time() - self.ttl_seconds:
+                with self.connection:
+                    self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            with self.connection:
+                self.connection.execute("UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, model: str, response: str):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, created_at, last_access, hits) VALUES (?, ?, ?, ?, ?, 0)",
+                (key, model, response, now, now)
+            )
+            self._evict(self.max_entries)
+
+    def _evict(self, max_entries: int) -> int:
+        count = self.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        if count <= max_entries:
+            return 0
+        self.connection.execute(
+            "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access ASC LIMIT ?)",
+            (count - max_entries,)
+        )
+        return count - max_entries
+
+    def prune(self, max_entries: int | None = None, max_age_days: float | None = None) -> int:
+        """
+        Evict least recently used entries beyond max_entries and entries created more than max_age_days ago.
+        Returns:
+            int: The number of removed entries.
+        """
+        removed = 0
+        with self.lock, self.connection:
+            if max_age_days is not None:
+                cursor = self.connection.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - max_age_days * 86400,))
+                removed += cursor.rowcount
+            removed += self._evict(self.max_entries if max_entries is None else max_entries)
+        return removed
+
+    def clear(self, model: str | None = None) -> int:
+        """
+        Remove all entries, or only those of the given model.
+        Returns:
+            int: The number of removed entries.
+        """
+        with self.lock, self.connection:
+            if model is None:
+                cursor = self.connection.execute("DELETE FROM responses")
+            else:
+                cursor = self.connection.execute("DELETE FROM responses WHERE model = ?", (model,))
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self.lock:
+            rows = self.connection.execute("SELECT model, COUNT(*), COALESCE(SUM(hits), 0) FROM responses GROUP BY model").fetchall()
+        return {model: {"entries": entries, "hits": hits} for model, entries, hits in rows}
+
+    def close(self):
+        self.connection.close()
+
+_caches = {}
+
+def get_response_cache(db_path: str = DEFAULT_CACHE_PATH, ttl_seconds: float | None = None) -> LLMResponseCache:
+    """
+    Return the LLMResponseCache of db_path, opening it once per process so all clients share one connection.
+    Raises:
+        ValueError: If db_path is already open with a different ttl_seconds.
+    """
+    if db_path not in _caches:
+        _caches[db_path] = LLMResponseCache(db_path, ttl_seconds=ttl_seconds)
+    elif _caches[db_path].ttl_seconds != ttl_seconds:
+        raise ValueError(f"LLM response cache {db_path} is already open with ttl_seconds={_caches[db_path].ttl_seconds}, not {ttl_seconds}")
+    return _caches[db_path]
+
+class _CachedCompletions:
+    def __init__(self, completions, cache: LLMResponseCache, is_async: bool):
+        self.completions = completions
+        self.cache = cache
+        self.is_async = is_async
+
+    def create(self, **kwargs):
+        if kwargs.get("stream"):
+            return self.completions.create(**kwargs)
+        key = LLMResponseCache.make_key(kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            count_span("cache_hits")
+        if self.is_async:
+            return self._acreate(key, cached, kwargs)
+        if cached is not None:
+            return self._replay(cached)
+        response = self.completions.create(**kwargs)
+        self.cache.put(key, kwargs.get("model"), response.model_dump_json())
+        return response
+
+    async def _acreate(self, key: str, cached: str | None, kwargs: dict):
+        if cached is not None:
+            return self._replay(cached)
+        response = await self.completions.create(**kwargs)
+        self.cache.put(key, kwargs.get("model"), response.model_dump_json())
+        return response
+
+    @staticmethod
+    def _replay(cached: str) -> ChatCompletion:
+        response = ChatCompletion.model_validate_json(cached)
+        # keeps the recorded usage for reference, but record_usage must not bill it again
+        response._cache_hit = True
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.completions, name)
+
+class _CachedChat:
+    def __init__(self, chat, cache: LLMResponseCache, is_async: bool):
+        self.chat = chat
+        self.completions = _CachedCompletions(chat.completions, cache, is_async)
+
+    def __getattr__(self, name):
+        return getattr(self.chat, name)
+
+class CachedOpenAI:
+    """
+    Wraps an OpenAI or AsyncOpenAI client so chat.completions.create is served from an LLMResponseCache.
+    Every other attribute (files, batches, base_url, ...) is passed through to the wrapped client.
+    """
+    def __init__(self, client: OpenAI | AsyncOpenAI, cache: LLMResponseCache):
+        self.client = client
+        self.cache = cache
+        self.chat = _CachedChat(client.chat, cache, isinstance(client, AsyncOpenAI))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+class LangChainLLMCache(BaseCache):
+    """
+    LangChain cache backed by an LLMResponseCache, for ChatOpenAI(cache=...).
+    LangChain passes the serialized messages as the prompt and the model parameters as llm_string.
+    """
+    def __init__(self, cache: LLMResponseCache, model: str | None = None):
+        """
+        Args:
+            cache (LLMResponseCache): The underlying store.
+            model (str, optional): Model name recorded with the entries, so they can be cleared per model.
+        """
+        self.cache = cache
+        self.model = model
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return LLMResponseCache.make_key({"prompt": prompt, "llm_string": llm_string})
+
+    def lookup(self, prompt: str, llm_string: str):
+        cached = self.cache.get(self._key(prompt, llm_string))
+        if cached is None:
+            return None
+        count_span("cache_hits")
+        generations = []
+        for item in json.loads(cached):
+            if "message" in item:
+                message = messages_from_dict([item["message"]])[0]
+                message.response_metadata["cache_hit"] = True
+                generations.append(ChatGeneration(message=message, generation_info=item["generation_info"]))
+            else:
+                generations.append(Generation(text=item["text"], generation_info=item["generation_info"]))
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val) -> None:
+        items = []
+        for generation in return_val:
+            item = {"text": generation.text, "generation_info": generation.generation_info}
+            if isinstance(generation, ChatGeneration):
+                item["message"] = message_to_dict(generation.message)
+            items.append(item)
+        self.cache.put(self._key(prompt, llm_string), self.model, json.dumps(items, ensure_ascii=False))
+
+    def clear(self, **kwargs) -> None:
+        self.cache.clear(self.model)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the LLM response cache. Example input: clear --model gpt-4o-mini-2024-07-18")
+    parser.add_argument("command", choices=["stats", "clear", "prune"], help="stats: show entry counts per model; clear: remove entries; prune: apply the eviction policy.")
+    parser.add_argument("--db_path", type=str, default=DEFAULT_CACHE_PATH, help=f"Cache database. Default is {DEFAULT_CACHE_PATH}.")
+    parser.add_argument("--model", type=str, default=None, help="clear: only remove entries of this model.")
+    parser.add_argument("--max_entries", type=int, default=100000, help="prune: keep at most this many most recently used entries.")
+    parser.add_argument("--max_age_days", type=float, default=None, help="prune: also drop entries created more than this many days ago.")
+    args = parser.parse_args()
+
+    cache = LLMResponseCache(args.db_path, max_entries=args.max_entries)
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), indent=2))
+    elif args.command == "clear":
+        print(f"Removed {cache.clear(args.model)} entries from {args.db_path}")
+    else:
+        print(f"Removed {cache.prune(args.max_entries, args.max_age_days)} entries from {args.db_path}")
+    cache.close()
@@ -0,0 +1,370 @@
+'''
+Registry of the OpenAI-compatible providers used by the generators and the QA benchmark.
+MODEL_PROVIDERS maps every model to a provider in PROVIDERS, which holds its endpoint, API key variable and quotas.
+All clients of a provider share one keep-alive connection pool (HTTP/2 if the h2 package is installed), and every
+request through that pool waits for a free concurrency slot and for the provider's requests/tokens per minute
+budget, so concurrent runs against OpenAI, Gemini, DeepSeek and a local vLLM server stay within their quotas.
+Endpoints, models and quotas can be changed without editing code by pointing LLM_PROVIDERS_FILE to a JSON file
+{"providers": {"openai": {"requests_per_minute": 500, "tokens_per_minute": 200000}}, "models": {"my-model": "local"}}.
+'''
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+import threading
+import importlib.util
+import weakref
+import httpx
+
+# max_concurrency: requests in flight; requests_per_minute / tokens_per_minute: None means unlimited
+PROVIDERS = {
+    "openai": {
+        "label": "OpenAI",
+        "base_url": "https://api.openai.com/v1",
+        "base_url_env": "OPENAI_BASE_URL",
+        "api_key_env": "OPENAI_API_KEY",
+        # the LangChain chat and embedding loaders have always gone through this proxy
+        "langchain_provider": "openai-proxy",
+    },
+    "openai-proxy": {
+        "label": "OpenAI",
+        "base_url": "https://test-cloudflare-7nq.pages.dev/v1/",
+        "api_key_env": "OPENAI_API_KEY",
+    },
+    "deepseek": {
+        "label": "DeepSeek",
+        "base_url": "https://api.deepseek.com/v1",
+        "api_key_env": "DEEPSEEK_OFFICIAL",
+    },
+    "dashscope": {
+        "label": "DeepSeek",
+        "base_url": "https://dashscope.aliyuncs.com/compatible-mode/v1",
+        "api_key_env": "DEEPSEEK_API_KEY",
+    },
+    "gemini": {
+        "label": "Gemini",
+        "base_url": "https://generativelanguage.googleapis.com/v1beta/openai/",
+        "api_key_env": "GEMINI_API_KEY",
+    },
+    "local": {
+        "label": "local vLLM",
+        "base_url": "http://localhost:8000/v1",
+        "base_url_env": "LOCAL_LLM_BASE_URL",
+        "api_key": "token-abc123",
+    },
+}
+
+DEFAULT_LIMITS = {
+    "max_connections": 64,
+    "max_keepalive_connections": 32,
+    "keepalive_expiry": 60.0,
+    "max_concurrency": None,
+    "requests_per_minute": None,
+    "tokens_per_minute": None,
+}
+
+MODEL_PROVIDERS = {
+    "gpt-3.5-turbo-0125": "openai",
+    "gpt-4o-2024-08-06": "openai",
+    "gpt-4o-mini-2024-07-18": "openai",
+    "gpt-4.5-preview-2025-02-27": "openai",
+    "text-embedding-3-large": "openai",
+    "deepseek-chat": "deepseek",
+    "deepseek-reasoner": "deepseek",
+    "gemini-2.0-flash": "gemini",
+    "gemini-2.0-flash-thinking-exp-01-21": "gemini",
+    "gemini-2.0-pro-exp-02-05": "gemini",
+}
+
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_http2_warned = False
+_table_loaded = False
+_limiters = {}
+_http_clients = {}
+_async_http_clients = weakref.WeakKeyDictionary()
+
+def load_provider_table(path: str):
+    """Merge the providers and models of a JSON file into PROVIDERS and MODEL_PROVIDERS."""
+    with open(path, "r", encoding="utf-8") as f:
+        table = json.load(f)
+    for name, settings in table.get("providers", {}).items():
+        PROVIDERS.setdefault(name, {"label": name}).update(settings)
+        if name in _limiters:
+            _limiters[name].configure(**provider_limits(name))
+    MODEL_PROVIDERS.update(table.get("models", {}))
+
+def _ensure_table():
+    global _table_loaded
+    with _lock:
+        if _table_loaded:
+            return
+        _table_loaded = True
+    if os.getenv("LLM_PROVIDERS_FILE"):
+        load_provider_table(os.getenv("LLM_PROVIDERS_FILE"))
+
+def resolve_provider(model_name: str, provider: str | None = None, langchain: bool = False) -> str:
+    """
+    Name the provider serving model_name.
+
+    Args:
+        provider (str, optional): Use this provider instead of the one in MODEL_PROVIDERS, e.g. 'local' or 'dashscope'.
+        langchain (bool): Resolve for the LangChain loaders, which may go through a different endpoint of the same provider.
+    """
+    _ensure_table()
+    if provider is None:
+        provider = MODEL_PROVIDERS.get(model_name)
+        if provider is None:
+            raise ValueError(f"Unsupported LLM: {model_name}")
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown provider: {provider}. Expected one of {list(PROVIDERS)}.")
+    if langchain:
+        provider = PROVIDERS[provider].get("langchain_provider", provider)
+    return provider
+
+def provider_limits(provider: str) -> dict:
+    return {key: PROVIDERS[provider].get(key, default) for key, default in DEFAULT_LIMITS.items()}
+
+def set_provider_limits(provider: str, **limits):
+    """Change the quotas of a provider, e.g. set_provider_limits('gemini', requests_per_minute=15)."""
+    _ensure_table()
+    PROVIDERS[provider].update(limits)
+    with _lock:
+        limiter = _limiters.get(provider)
+    if limiter is not None:
+        limiter.configure(**provider_limits(provider))
+
+class ProviderLimiter:
+    """
+    Request budget of one provider, shared by the threads and event loops using it.
+    Start times are reserved under a lock and the wait happens outside it, as in call_llms.AsyncRateLimiter.
+    """
+    def __init__(self, max_concurrency: int | None = None, requests_per_minute: float | None = None, tokens_per_minute: float | None = None, **_):
+        self.lock = threading.Lock()
+        self.next_request = 0.0
+        self.next_tokens = 0.0
+        self.configure(max_concurrency, requests_per_minute, tokens_per_minute)
+
+    def configure(self, max_concurrency: int | None = None, requests_per_minute: float | None = None, tokens_per_minute: float | None = None, **_):
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+
+    def reserve(self, tokens: int) -> float:
+        """Reserve the next start time of a request of about `tokens` tokens and return the seconds to wait for it."""
+        with self.lock:
+            now = time.monotonic()
+            # a 429 back-off holds requests even when the provider has no per-minute quota
+            start = max(now, self.next_request, self.next_tokens)
+            if self.requests_per_minute:
+                self.next_request = start + 60.0 / self.requests_per_minute
+            if self.tokens_per_minute:
+                token_start = max(now, self.next_tokens)
+                self.next_tokens = token_start + tokens * 60.0 / self.tokens_per_minute
+                start = max(start, token_start)
+            return start - now
+
+    def back_off(self, seconds: float):
+        """Hold back every request of the provider after it answered 429."""
+        with self.lock:
+            until = time.monotonic() + seconds
+            self.next_request = max(self.next_request, until)
+            self.next_tokens = max(self.next_tokens, until)
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    with _lock:
+        if provider not in _limiters:
+            _limiters[provider] = ProviderLimiter(**provider_limits(provider))
+        return _limiters[provider]
+
+def estimate_tokens(request: httpx.Request) -> int:
+    """Rough token count of a request: about 4 characters per prompt token plus the requested completion tokens."""
+    try:
+        body = json.loads(request.content or b"{}")
+    except (ValueError, httpx.RequestNotRead):
+        return 0
+    if not isinstance(body, dict):
+        return 0
+    completion_tokens = body.get("max_completion_tokens") or body.get("max_tokens") or 0
+    return len(request.content) // 4 + int(completion_tokens)
+
+def _retry_after(response: httpx.Response) -> float:
+    try:
+        return float(response.headers.get("retry-after", 1))
+    except ValueError:
+        return 1.0
+
+class _ReleasingStream(httpx.SyncByteStream):
+    """Response body that frees the concurrency slot of its request once it is closed."""
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self.release()
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self.stream.aclose()
+        finally:
+            self.release()
+
+def _release_once(release):
+    done = threading.Event()
+    def release_once():
+        if not done.is_set():
+            done.set()
+            release()
+    return release_once
+
+class LimitedTransport(httpx.BaseTransport):
+    """Transport of a provider's shared client: waits for the provider's budget before sending every request."""
+    def __init__(self, transport: httpx.BaseTransport, limiter: ProviderLimiter):
+        self.transport = transport
+        self.limiter = limiter
+
+    def handle_request(self, request):
+        semaphore = self.limiter.semaphore
+        if semaphore is not None:
+            semaphore.acquire()
+        release = _release_once(semaphore.release if semaphore is not None else lambda: None)
+        try:
+            wait = self.limiter.reserve(estimate_tokens(request))
+            if wait > 0:
+                time.sleep(wait)
+            response = self.transport.handle_request(request)
+        except BaseException:
+            release()
+            raise
+        if response.status_code == 429:
+            self.limiter.back_off(_retry_after(response))
+        response.stream = _ReleasingStream(response.stream, release)
+        return response
+
+    def close(self):
+        self.transport.close()
+
+class AsyncLimitedTransport(httpx.AsyncBaseTransport):
+    """asyncio counterpart of LimitedTransport. The concurrency slots are an asyncio.Semaphore of the client's event loop."""
+    def __init__(self, transport: httpx.AsyncBaseTransport, limiter: ProviderLimiter):
+        self.transport = transport
+        self.limiter = limiter
+        self.semaphore = asyncio.Semaphore(limiter.max_concurrency) if limiter.max_concurrency else None
+
+    async def handle_async_request(self, request):
+        if self.semaphore is not None:
+            await self.semaphore.acquire()
+        release = _release_once(self.semaphore.release if self.semaphore is not None else lambda: None)
+        try:
+            wait = self.limiter.reserve(estimate_tokens(request))
+            if wait > 0:
+                await asyncio.sleep(wait)
+            response = await self.transport.handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        if response.status_code == 429:
+            self.limiter.back_off(_retry_after(response))
+        response.stream = _AsyncReleasingStream(response.stream, release)
+        return response
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+def _warn_http1():
+    global _http2_warned
+    if HTTP2 or _http2_warned:
+        return
+    _http2_warned = True
+    logger.warning("The h2 package is not installed, so the provider connection pools fall back to HTTP/1.1. Install httpx[http2] to multiplex requests over HTTP/2.")
+
+def _pool_limits(provider: str) -> httpx.Limits:
+    _warn_http1()
+    limits = provider_limits(provider)
+    return httpx.Limits(max_connections=limits["max_connections"], max_keepalive_connections=limits["max_keepalive_connections"], keepalive_expiry=limits["keepalive_expiry"])
+
+def get_http_client(provider: str) -> httpx.Client:
+    """Return the connection pool shared by all synchronous clients of a provider, opening it again if it was closed."""
+    limiter = get_limiter(provider)
+    with _lock:
+        client = _http_clients.get(provider)
+        if client is None or client.is_closed:
+            transport = httpx.HTTPTransport(http2=HTTP2, limits=_pool_limits(provider))
+            client = httpx.Client(transport=LimitedTransport(transport, limiter), timeout=600, follow_redirects=True)
+            _http_clients[provider] = client
+        return client
+
+def get_async_http_client(provider: str) -> httpx.AsyncClient:
+    """
+    Return the connection pool shared by the asyncio clients of a provider in the running event loop.
+    asyncio connections cannot move between event loops, so every loop gets its own pool.
+    """
+    limiter = get_limiter(provider)
+    transport = httpx.AsyncHTTPTransport(http2=HTTP2, limits=_pool_limits(provider))
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return httpx.AsyncClient(transport=AsyncLimitedTransport(transport, limiter), timeout=600, follow_redirects=True)
+    with _lock:
+        clients = _async_http_clients.setdefault(loop, {})
+        client = clients.get(provider)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(transport=AsyncLimitedTransport(transport, limiter), timeout=600, follow_redirects=True)
+            clients[provider] = client
+        return client
+
+def provider_api_key(provider: str) -> str:
+    settings = PROVIDERS[provider]
+    if settings.get("api_key") or not settings.get("api_key_env"):
+        return settings.get("api_key", "")
+    api_key = os.getenv(settings["api_key_env"])
+    if not api_key:
+        raise EnvironmentError(f"{settings['label']} API key not set in environment.")
+    return api_key
+
+def provider_base_url(provider: str) -> str:
+    settings = PROVIDERS[provider]
+    return (settings.get("base_url_env") and os.getenv(settings["base_url_env"])) or settings["base_url"]
+
+def client_kwargs(model_name: str, provider: str | None = None, langchain: bool = False, asynchronous: bool = False) -> dict:
+    """
+    Keyword arguments of an OpenAI / AsyncOpenAI client, ChatOpenAI or OpenAIEmbeddings for model_name:
+    api_key, base_url and the shared http_client of its provider.
+    """
+    provider = resolve_provider(model_name, provider, langchain)
+    return {
+        "api_key": provider_api_key(provider),
+        "base_url": provider_base_url(provider),
+        "http_client": get_async_http_client(provider) if asynchronous else get_http_client(provider),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the provider table. Example input: list")
+    parser.add_argument("command", choices=["list"], help="list: show the providers, their quotas and models.")
+    args = parser.parse_args()
+
+    _ensure_table()
+    for name in PROVIDERS:
+        models = [model for model, provider in MODEL_PROVIDERS.items() if provider == name]
+        print(json.dumps({"provider": name, "base_url": provider_base_url(name), **provider_limits(name), "http2": HTTP2, "models": models}))
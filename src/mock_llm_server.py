@@ -0,0 +1,378 @@
+'''
+Offline stand-in for an OpenAI-compatible provider, used to benchmark the harness without network access.
+Chat completions are replayed from recorded runs:
+  exact:    the same messages were sent before (request_bodies.jsonl next to raw_responses.jsonl, or an LLM response cache),
+  question: the prompt contains the text of a benchmark question, answered with a recorded solution of that question
+            (raw_responses.jsonl, function_generation_results.jsonl),
+  fallback: a fixed answer in the format the generators expect.
+Embeddings are deterministic pseudo-random unit vectors of the text. Every answer is delayed by a latency drawn from a
+configurable distribution, seeded by the request, so repeated benchmark runs see the same delays.
+`python mock_llm_server.py serve --providers_file mock_providers.json` serves it and writes a provider table that points
+every provider of llm_providers.py at it; run any generator with LLM_PROVIDERS_FILE=mock_providers.json.
+'''
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+try:
+    from src.llm_cache import LLMResponseCache
+    from src.llm_providers import PROVIDERS
+except ImportError:  # run as a script from src/ without the repository root on sys.path
+    from llm_cache import LLMResponseCache
+    from llm_providers import PROVIDERS
+
+DEFAULT_RECORDINGS = ["pure_agent_test", "RAG_agent_test", "agentic_RAG_test", "mtr_rag_test"]
+DEFAULT_QUESTION_DIR = "question_segments/pymatgen_analysis_defects/"
+ANSWER_TEMPLATE = "<answer>\n<code>\n```python\n{function}\n```\n</code>\n<name>{function_name}</name>\n</answer>"
+FALLBACK_FUNCTION = "def mock_function():\n    return {}"
+
+def messages_key(messages: list) -> str:
+    """Hash of the roles and contents of a message list, independent of the other request parameters."""
+    payload = json.dumps([[message.get("role"), message.get("content")] for message in messages], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+class ResponseLibrary:
+    """
+    Recorded responses indexed by exact prompt and by benchmark question.
+    """
+    def __init__(self, recordings: list | None = None, question_dir: str = DEFAULT_QUESTION_DIR, llm_cache: str | None = None, llm_cache_ttl: float | None = None):
+        """
+        Args:
+            recordings (list, optional): Files or directories searched for raw_responses.jsonl and function_generation_results.jsonl.
+            question_dir (str): Directory of the benchmark questions, used to recognize the question of a prompt.
+            llm_cache (str, optional): SQLite file of an LLM response cache, replayed for requests identical to the recorded ones.
+            llm_cache_ttl (float, optional): Seconds after which entries of llm_cache are ignored. Default is no expiry.
+        """
+        self.exact = {}
+        self.answers = {}
+        self.questions = {}
+        self.cache = LLMResponseCache(llm_cache, ttl_seconds=llm_cache_ttl) if llm_cache else None
+        if os.path.isdir(question_dir):
+            for root, _, files in sorted(os.walk(question_dir)):
+                if 'question.txt' in files:
+                    with open(os.path.join(root, 'question.txt'), 'r', encoding="utf-8") as f:
+                        self.questions[os.path.basename(root)] = f.read().strip()
+        # os.walk order, as used by load_questions_path_from_directories when the batch requests were numbered
+        self.question_order = [os.path.basename(root) for root, _, files in os.walk(question_dir) if 'question.txt' in files]
+        for path in recordings or []:
+            files = [path] if os.path.isfile(path) else [os.path.join(root, name) for root, _, names in sorted(os.walk(path)) for name in sorted(names)]
+            for file_path in files:
+                if os.path.basename(file_path) == "raw_responses.jsonl":
+                    self.load_raw_responses(file_path)
+                elif os.path.basename(file_path) == "function_generation_results.jsonl":
+                    self.load_generation_results(file_path)
+
+    def add_answer(self, question: str, content: str):
+        self.answers.setdefault(question, []).append(content)
+
+    def load_raw_responses(self, file_path: str):
+        """Batch API output. Paired with request_bodies.jsonl of the same run, the responses also serve exact replays."""
+        requests = {}
+        request_file = os.path.join(os.path.dirname(file_path), "request_bodies.jsonl")
+        if os.path.exists(request_file):
+            with open(request_file, 'r', encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        request = json.loads(line)
+                        requests[request["custom_id"]] = request["body"]
+        with open(file_path, 'r', encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                body = record["response"]["body"]
+                if record["response"]["status_code"] != 200 or not body.get("choices"):
+                    continue
+                if record["custom_id"] in requests:
+                    self.exact[messages_key(requests[record["custom_id"]]["messages"])] = body
+                index = int(record["custom_id"].split("_")[1]) - 1
+                if 0 <= index < len(self.question_order):
+                    self.add_answer(self.question_order[index], body["choices"][0]["message"]["content"])
+
+    def load_generation_results(self, file_path: str):
+        with open(file_path, 'r', encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry.get("function") and entry.get("function_name"):
+                    self.add_answer(entry["question_file_path"], ANSWER_TEMPLATE.format(function=entry["function"], function_name=entry["function_name"]))
+
+    def match_question(self, prompt: str) -> str | None:
+        for question, text in self.questions.items():
+            if text and text in prompt:
+                return question
+        return None
+
+    def respond(self, request: dict, rng: random.Random) -> tuple:
+        """
+        Returns:
+            tuple: (source, content, recorded ChatCompletion body or None), source being exact, question or fallback.
+        """
+        messages = request.get("messages", [])
+        recorded = self.exact.get(messages_key(messages))
+        if recorded is None and self.cache is not None:
+            cached = self.cache.get(LLMResponseCache.make_key({key: value for key, value in request.items() if key != "stream"}))
+            recorded = json.loads(cached) if cached else None
+        if recorded is not None:
+            return "exact", recorded["choices"][0]["message"]["content"], recorded
+        json_mode = (request.get("response_format") or {}).get("type") == "json_object"
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        question = self.match_question(prompt)
+        if question is not None and self.answers.get(question):
+            content = rng.choice(self.answers[question])
+            if json_mode:
+                code = re.search(r"<code>\s*```python\s*(.*?)```\s*</code>", content, re.DOTALL)
+                name = re.search(r"<name>(.*?)</name>", content, re.DOTALL)
+                function, function_name = (code.group(1).strip(), name.group(1).strip()) if code and name else (FALLBACK_FUNCTION, "mock_function")
+                content = json.dumps({"function": function, "function_name": function_name, "type": "function", "name": function_name, "documents": [], "scores": []})
+            return "question", content, None
+        if json_mode:
+            content = json.dumps({"function": FALLBACK_FUNCTION, "function_name": "mock_function", "type": "function", "name": "", "documents": [], "scores": []})
+        else:
+            content = ANSWER_TEMPLATE.format(function=FALLBACK_FUNCTION, function_name="mock_function")
+        return "fallback", content, None
+
+class LatencyModel:
+    """
+    Seconds an answer is delayed. spec is one of fixed:S, uniform:LOW,HIGH, normal:MEAN,STD, lognormal:MU,SIGMA
+    (of ln seconds) or empirical:FILE, which samples the generate spans of an instrumentation events file or one
+    number per line. seconds_per_token is added per completion token.
+    """
+    def __init__(self, spec: str = "fixed:0", seconds_per_token: float = 0.0, seed: int = 0):
+        self.kind, _, arguments = spec.partition(":")
+        self.seconds_per_token = seconds_per_token
+        self.seed = seed
+        if self.kind == "empirical":
+            self.samples = self.load_samples(arguments)
+        elif self.kind in ("fixed", "uniform", "normal", "lognormal"):
+            self.arguments = [float(value) for value in arguments.split(",")] if arguments else [0.0]
+        else:
+            raise ValueError(f"Invalid latency distribution: {spec}. Expected fixed, uniform, normal, lognormal or empirical.")
+
+    @staticmethod
+    def load_samples(file_path: str) -> list:
+        samples = []
+        with open(file_path, 'r', encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith("{"):
+                    event = json.loads(line)
+                    if event.get("name") == "generate":
+                        samples.append(event["duration_ms"] / 1000)
+                else:
+                    samples.append(float(line))
+        if not samples:
+            raise ValueError(f"No latency samples in {file_path}")
+        return samples
+
+    def sample(self, rng: random.Random, completion_tokens: int = 0) -> float:
+        if self.kind == "fixed":
+            seconds = self.arguments[0]
+        elif self.kind == "uniform":
+            seconds = rng.uniform(*self.arguments[:2])
+        elif self.kind == "normal":
+            seconds = rng.gauss(*self.arguments[:2])
+        elif self.kind == "lognormal":
+            seconds = rng.lognormvariate(*self.arguments[:2])
+        else:
+            seconds = rng.choice(self.samples)
+        return max(0.0, seconds) + self.seconds_per_token * completion_tokens
+
+class MockLLMServer:
+    """
+    Threaded HTTP server answering /v1/chat/completions, /v1/embeddings and /v1/models, plus /stats with request counters.
+    """
+    def __init__(self, library: ResponseLibrary, latency: LatencyModel | None = None, host: str = "127.0.0.1", port: int = 0,
+                 error_rate: float = 0.0, embedding_dimensions: int = 3072, seed: int = 0):
+        """
+        Args:
+            error_rate (float): Fraction of attempts answered with 429, to exercise the retry and rate limit paths.
+            embedding_dimensions (int): Length of the embedding vectors unless the request asks for 'dimensions'.
+            seed (int): Seed of the latencies, errors and answer choices.
+        """
+        self.library = library
+        self.latency = latency or LatencyModel()
+        self.error_rate = error_rate
+        self.embedding_dimensions = embedding_dimensions
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.attempts = {}
+        self.stats = {"requests": 0, "chat": 0, "embeddings": 0, "exact": 0, "question": 0, "fallback": 0, "errors": 0, "latency_seconds": 0.0, "completion_tokens": 0}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def reply(self, status: int, payload: dict, headers: dict | None = None):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self.reply(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+                elif self.path.rstrip("/").endswith("/stats"):
+                    self.reply(200, server.snapshot())
+                else:
+                    self.reply(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                path = self.path.rstrip("/")
+                if path.endswith("/chat/completions"):
+                    status, payload, headers = server.chat_completion(request)
+                elif path.endswith("/embeddings"):
+                    status, payload, headers = server.embeddings(request)
+                else:
+                    status, payload, headers = 404, {"error": {"message": f"Unknown path {self.path}"}}, None
+                self.reply(status, payload, headers)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.stats)
+
+    def count(self, **values):
+        with self.lock:
+            for name, value in values.items():
+                self.stats[name] += value
+
+    def reset_attempts(self):
+        """Forget how often every request was seen, so the next benchmark run gets the same latencies and errors."""
+        with self.lock:
+            self.attempts.clear()
+
+    def request_rng(self, request: dict) -> random.Random:
+        """Random generator of one attempt of a request: the same request gets the same draws in every run."""
+        key = hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+        with self.lock:
+            attempt = self.attempts.get(key, 0)
+            self.attempts[key] = attempt + 1
+        return random.Random(f"{self.seed}:{key}:{attempt}")
+
+    def chat_completion(self, request: dict) -> tuple:
+        if request.get("stream"):
+            return 400, {"error": {"message": "The mock server does not stream."}}, None
+        rng = self.request_rng(request)
+        self.count(requests=1, chat=1)
+        if rng.random() < self.error_rate:
+            self.count(errors=1)
+            return 429, {"error": {"message": "Rate limit reached (mock).", "type": "rate_limit_error"}}, {"retry-after": "1"}
+        source, content, recorded = self.library.respond(request, random.Random(rng.random()))
+        prompt_tokens = estimate_tokens("".join(str(message.get("content", "")) for message in request.get("messages", [])))
+        completion_tokens = estimate_tokens(content)
+        if recorded is not None and recorded.get("usage"):
+            prompt_tokens = recorded["usage"].get("prompt_tokens", prompt_tokens)
+            completion_tokens = recorded["usage"].get("completion_tokens", completion_tokens)
+        delay = self.latency.sample(rng, completion_tokens)
+        time.sleep(delay)
+        self.count(**{source: 1, "latency_seconds": delay, "completion_tokens": completion_tokens})
+        return 200, {
+            "id": f"chatcmpl-mock-{rng.getrandbits(64):016x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "system_fingerprint": f"mock-{source}",
+            "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None, "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }, None
+
+    def embeddings(self, request: dict) -> tuple:
+        texts = request.get("input", [])
+        texts = [texts] if isinstance(texts, (str, int)) or (texts and isinstance(texts[0], int)) else texts
+        dimensions = request.get("dimensions") or self.embedding_dimensions
+        self.count(requests=1, embeddings=1)
+        data = []
+        for index, text in enumerate(texts):
+            seed = int(hashlib.sha256(json.dumps(text).encode("utf-8")).hexdigest()[:16], 16)
+            vector = np.random.default_rng(seed).standard_normal(dimensions)
+            data.append({"object": "embedding", "index": index, "embedding": (vector / np.linalg.norm(vector)).tolist()})
+        tokens = sum(estimate_tokens(json.dumps(text)) for text in texts)
+        return 200, {"object": "list", "data": data, "model": request.get("model", "mock"), "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}, None
+
+    def start(self) -> "MockLLMServer":
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def write_providers_file(file_path: str, base_url: str, models: list | None = None):
+    """
+    Write an LLM_PROVIDERS_FILE table pointing every provider of llm_providers.PROVIDERS at base_url.
+    models are registered as OpenAI models, e.g. a 'mock-llm' name that keeps benchmark outputs apart from real runs.
+    """
+    table = {
+        "providers": {name: {"base_url": base_url, "base_url_env": None, "api_key": "mock"} for name in PROVIDERS},
+        "models": {model: "openai" for model in models or []},
+    }
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    with open(file_path, 'w', encoding="utf-8") as f:
+        json.dump(table, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve recorded LLM responses on an OpenAI-compatible endpoint. Example input: serve --latency lognormal:0,0.5 --providers_file mock_providers.json")
+    parser.add_argument("command", choices=["serve"], help="serve: answer requests until interrupted.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to listen on. Default is 127.0.0.1.")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on. Default is 8765.")
+    parser.add_argument("--recordings", type=str, nargs="+", default=DEFAULT_RECORDINGS, help="Files or directories with raw_responses.jsonl / function_generation_results.jsonl to replay.")
+    parser.add_argument("--question_dir", type=str, default=DEFAULT_QUESTION_DIR, help="Directory of the benchmark questions.")
+    parser.add_argument("--llm_cache", type=str, default=None, help="SQLite file of an LLM response cache to replay identical requests from.")
+    parser.add_argument("--llm_cache_ttl", type=float, default=None, help="Seconds after which entries of --llm_cache are ignored. Default is no expiry.")
+    parser.add_argument("--latency", type=str, default="fixed:0", help="Latency distribution: fixed:S, uniform:LOW,HIGH, normal:MEAN,STD, lognormal:MU,SIGMA or empirical:FILE. Default is fixed:0.")
+    parser.add_argument("--seconds_per_token", type=float, default=0.0, help="Extra latency per completion token. Default is 0.")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of attempts answered with 429. Default is 0.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of latencies, errors and answer choices. Default is 0.")
+    parser.add_argument("--providers_file", type=str, default=None, help="Write a provider table pointing all providers at this server, for LLM_PROVIDERS_FILE.")
+    parser.add_argument("--models", type=str, nargs="*", default=["mock-llm"], help="Extra model names registered in the provider table. Default is mock-llm.")
+    args = parser.parse_args()
+
+    library = ResponseLibrary(args.recordings, args.question_dir, args.llm_cache, args.llm_cache_ttl)
+    server = MockLLMServer(library, LatencyModel(args.latency, args.seconds_per_token, args.seed), args.host, args.port, args.error_rate, seed=args.seed)
+    if args.providers_file:
+        write_providers_file(args.providers_file, server.base_url, args.models)
+        print(f"Wrote provider table to {args.providers_file}; run the generators with LLM_PROVIDERS_FILE={args.providers_file}")
+    print(f"Serving {len(library.exact)} exact replays and answers of {len(library.answers)} questions on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(json.dumps(server.snapshot(), indent=2))
@@ -3,13 +3,20 @@ sys.path.append('../')
 import os
 import json
 import re
+import time
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
 from typing_extensions import List, TypedDict
 from mtb_logger import MatToolBenLogger
 from src.call_llms import load_chat_llm, load_embedding_model
-from langchain_chroma import Chroma
-from src.docker_sandbox import DockerSandbox
+from src.docker_sandbox import DockerSandbox, DockerSandboxPool
+from src.sandbox_cache import SandboxResultCache, CachedSandbox
+from src.generation_checkpoint import GenerationCheckpoint
+from src.retrievers import load_vector_store, vector_store_version
+from src.retrieval_store import RetrievalStore, StoredVectorStore
 from src.utils import ComplexDictParser
+from src.instrumentation import configure, span, record_usage
 from typing import List, Dict, Union, Optional
 from typing_extensions import TypedDict
 from prompts import SYSTEM_PROMPT, USER_PROMPT, USER_PROMPT_DOC, USER_PROMPT_LLM_DOC, FORMAT_CHECKER_PROMPT, CRITICAL_FEEDBACK_PROMPT, CRITICAL_FEEDBACK_FORMART_CHECKER_PROMPT
@@ -33,9 +40,19 @@ class RAGPipeline:
         code_check_result: Optional[Dict]
         suggestions: Optional[Union[str, Dict]]       
             
-    def __init__(self, model_name: str, temperature: float, retriever_type: str):
+    def __init__(self, model_name: str, temperature: float, retriever_type: str, sandbox_cache: str | None = None, llm_cache: str | None = None, llm_cache_ttl: float | None = None, vector_backend: str = "chroma", embedding_cache: str | None = None,
+                 concurrency: int = 1, llm_concurrency: int | None = None, sandbox_workers: int | None = None, retrieval_store: str | None = None,
+                 events_file: str | None = None):
         """
         Initialize RAGPipeline with logging, LLM model, embedding model, and vector store.
+        If sandbox_cache is given, code_check reuses stored results for programs it has already executed.
+        If llm_cache is given, identical LLM requests are replayed from that response cache, for llm_cache_ttl seconds if set.
+        vector_backend selects the vector store backend ('chroma' or 'faiss', see src/retrievers.py).
+        If embedding_cache is given, query embeddings are served from that on-disk cache.
+        concurrency is the number of questions whose refinement loops run at the same time; they share
+        llm_concurrency in-flight LLM requests (default: no extra limit) and a pool of sandbox_workers containers (default: concurrency).
+        If retrieval_store is given, retrieval results are read from (and missing ones added to) that store, see src/retrieval_store.py.
+        If events_file is given, question, retrieve, generate, sandbox_execute and parse spans are appended to that file in store_path, see src/instrumentation.py.
         """
         # Validate retriever_type
         VALID_RETRIEVER_TYPES = ['code', 'doc', 'llm-doc', 'llm-doc-full']
@@ -50,40 +67,63 @@ class RAGPipeline:
         self.retriever_type = retriever_type
         self.base_directory = 'question_segments/pymatgen_analysis_defects/'
         self.store_path = store_path
+        self.sandbox_cache = SandboxResultCache(sandbox_cache) if sandbox_cache else None
+        self.sandbox = None
+        self.concurrency = concurrency
+        self.sandbox_workers = sandbox_workers or concurrency
+        self.llm_semaphore = threading.BoundedSemaphore(llm_concurrency) if llm_concurrency else None
+        self.timings_lock = threading.Lock()
+        self.timings_file = os.path.join(self.store_path, "iteration_timings.jsonl")
 
         # Initialize logger
         self.mtb_logger = MatToolBenLogger()
         self.mtb_logger.set_logger(file_path=self.store_path, filename='mtr_RAG_generation.log')
+        configure(events_file and os.path.join(self.store_path, events_file), model=model_name, method=f"mtr-{retriever_type}")
         
         try:
             # Load LLM model
-            self.llm = load_chat_llm(model_name, temperature)
+            self.llm = load_chat_llm(model_name, temperature, cache_path=llm_cache, cache_ttl=llm_cache_ttl)
             self.mtb_logger.info(f"Loaded LLM client: {model_name}")
             self.mtb_logger.info(f"Model args: model_name={model_name}, temperature={temperature}")
             
             # Load embedding model
-            self.embedding_model = load_embedding_model("text-embedding-3-large")
+            self.embedding_model = load_embedding_model("text-embedding-3-large", cache_path=embedding_cache)
             self.mtb_logger.info("Loaded embedding model: text-embedding-3-large")
             
             # Initialize vector store
-            vector_store_paths = {
-                'code': ("pymatgen", "vector_store/vs_method1/"),
-                'doc': ("pymatgen-doc", "vector_store/vs_method2/"),
-                'llm-doc': ("pymatgen_llm_doc", "vector_store/vs_method3/"),
-                'llm-doc-full': ("pymatgen_llm_doc_full", "vector_store/vs_method4/")
-            }
-            
-            collection_name, persist_directory = vector_store_paths[retriever_type]
-            self.vector_store = Chroma(
-                collection_name=collection_name, 
-                embedding_function=self.embedding_model, 
-                persist_directory=persist_directory
-            )
+            if retrieval_store:
+                store_version = vector_store_version(retriever_type, vector_backend)
+                self.vector_store = StoredVectorStore(RetrievalStore(retrieval_store), retriever_type, store_version,
+                                                      lambda: load_vector_store(retriever_type, self.embedding_model, backend=vector_backend))
+                self.mtb_logger.info(f"Reading retrieval results of {vector_backend} vector store version {store_version} from {retrieval_store}")
+            else:
+                self.vector_store = load_vector_store(retriever_type, self.embedding_model, backend=vector_backend)
+                self.mtb_logger.info(f"Loaded {vector_backend} vector store for retriever type: {retriever_type}")
             
         except Exception as e:
             self.mtb_logger.error(f"Initialization error: {e}")
             raise
     
+    def invoke_llm(self, messages):
+        """Call the LLM, waiting for a free slot when the number of in-flight requests is limited."""
+        if self.llm_semaphore is None:
+            return self._invoke_llm(messages)
+        with self.llm_semaphore:
+            return self._invoke_llm(messages)
+
+    def _invoke_llm(self, messages):
+        with span("generate", model=self.model_name):
+            response = self.llm.invoke(messages)
+            record_usage(response)
+        return response
+
+    def record_timing(self, timing: dict) -> None:
+        """Append the timing of one refinement iteration to iteration_timings.jsonl."""
+        self.mtb_logger.info(f"Iteration timing: {timing}")
+        with self.timings_lock:
+            with open(self.timings_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps(timing) + "\n")
+
     def extract_response(self, response: str) -> List[str]:
         """
         Extract code segments and function names from LLM output.
@@ -130,7 +170,8 @@ class RAGPipeline:
         Retrieve relevant code snippets and build context.
         """
         try:
-            retrieved_docs = self.vector_store.similarity_search(state["question"], k=5)
+            with span("retrieve", k=5):
+                retrieved_docs = self.vector_store.similarity_search(state["question"], k=5)
             
             if not retrieved_docs:
                 self.mtb_logger.warning(f"No documents retrieved for question: {state['question']}")
@@ -160,7 +201,8 @@ class RAGPipeline:
         检索文档，构建上下文。
         """
         try:
-            retrieved_docs = self.vector_store.similarity_search(state["question"], k=5)
+            with span("retrieve", k=5):
+                retrieved_docs = self.vector_store.similarity_search(state["question"], k=5)
             source = ["Source of this document: " + doc.metadata["title"] for doc in retrieved_docs]
             contexts = []
             for i in range(len(retrieved_docs)):
@@ -178,7 +220,8 @@ class RAGPipeline:
         检索 llm-doc 类型的文档，构建上下文。
         """
         try:
-            retrieved_docs = self.vector_store.similarity_search(state["question"], k=5)
+            with span("retrieve", k=5):
+                retrieved_docs = self.vector_store.similarity_search(state["question"], k=5)
             code_source_file = [
                 "Source of this document: " + doc.metadata["code_source_file"]
                 for doc in retrieved_docs
@@ -228,7 +271,7 @@ class RAGPipeline:
                 messages = state.memory.extend([
                     {'role': 'user', 'content': extra_info}
                 ])
-        response = self.llm.invoke(messages)
+        response = self.invoke_llm(messages)
         self.mtb_logger.info("Received response from LLM: {}".format(response.content.replace('\n', ' ')))
         self.mtb_logger.info(
             f"Response metadata: {response.response_metadata} | Additional kwargs: {response.additional_kwargs} | ID: {response.id} | model_config: {response.model_config}"
@@ -240,7 +283,7 @@ class RAGPipeline:
         检查生成的代码是否符合格式要求。
         """
         messages = [{'role': 'user', 'content': self.FORMAT_CHECKER_PROMPT.format(generated_code=state["answer"])}]
-        response = self.llm.invoke(messages)
+        response = self.invoke_llm(messages)
         return {"answer": response.content}
     
     def critics_format_checker(self, message: str) -> str:
@@ -248,7 +291,7 @@ class RAGPipeline:
         检查批评性建议的格式。
         """
         messages = [{'role': 'user', 'content': self.CRITICAL_FEEDBACK_FORMART_CHECKER_PROMPT.format(content=message)}]
-        response = self.llm.invoke(messages)
+        response = self.invoke_llm(messages)
         return response.content
         
     def rag_pipeline(self, state: dict) -> dict:
@@ -301,11 +344,16 @@ class RAGPipeline:
         return state
     
     def parse_complex_string(self, input_str: str):
-        parser = ComplexDictParser()
-        return parser.parse(input_str)
+        with span("parse"):
+            parser = ComplexDictParser()
+            return parser.parse(input_str)
     
     def code_check(self, state: State) -> dict:
-        sandbox = DockerSandbox()
+        sandbox = self.sandbox
+        if sandbox is None:
+            sandbox = DockerSandbox()
+            if self.sandbox_cache:
+                sandbox = CachedSandbox(sandbox, self.sandbox_cache)
         tmp = self.extract_response(state['answer'])
         func = tmp[0]
         func_name = tmp[1]
@@ -316,7 +364,8 @@ class RAGPipeline:
         else:
             func_name = f"print({func_name}())"
             execution_code = "\n".join([func, func_name])
-            result = sandbox.execute_code(execution_code)
+            with span("sandbox_execute"):
+                result = sandbox.execute_code(execution_code)
             if type(result) == str:
                 return {"fail_result": result}
             return result
@@ -341,7 +390,7 @@ class RAGPipeline:
                 runtime_output=json.dumps(code_check_result, ensure_ascii=False, indent=2)
             )
             messages = [{'role': 'user', 'content': prompt}]
-            response = self.llm.invoke(messages)
+            response = self.invoke_llm(messages)
             self.mtb_logger.info("Received response from LLM: {}".format(response.content.replace('\n', ' ')))
             response = self.critics_format_checker(response.content)
             extracted_response = self.extract_reponse_from_critics(response)
@@ -349,15 +398,24 @@ class RAGPipeline:
         return suggestions
             
     
-    def pipeline(self, state: dict) -> dict:
+    def pipeline(self, state: dict, question_id: str = "") -> dict:
+        """
+        Refinement loop of one question: rag_pipeline -> code_check -> critic_agent, at most iteration_limit times.
+        The duration of every stage is recorded per iteration, see record_timing.
+        """
         iteration_limit = 5
         iteration = 0
         while iteration < iteration_limit:
             iteration += 1
             self.mtb_logger.info(f"----------------Iteration: {iteration}----------------")
+            timing = {"question": question_id, "iteration": iteration}
+            start = time.perf_counter()
             state = self.rag_pipeline(state)
+            timing["rag_pipeline_seconds"] = round(time.perf_counter() - start, 3)
             self.mtb_logger.info(f"State after rag_pipeline of iteration {iteration}: {state}")
+            start = time.perf_counter()
             code_check_result = self.code_check(state)
+            timing["code_check_seconds"] = round(time.perf_counter() - start, 3)
             self.mtb_logger.info(f"Code check result: {code_check_result}")
             state.update(code_check_result)
             if type(code_check_result) == dict and "stdout" in code_check_result and code_check_result["stdout"] != "":
@@ -365,50 +423,78 @@ class RAGPipeline:
                 parsed_dict = self.parse_complex_string(code_check_result["stdout"])
                 self.mtb_logger.info(f"Parsed result: {parsed_dict}")
                 if isinstance(parsed_dict, dict) and all(value is not None for value in parsed_dict.values()):
+                    self.record_timing(timing)
                     self.mtb_logger.info(f"Final state of iteration {iteration}: {state}")
                     self.mtb_logger.info("Finished all iterations with demanded answer. Go to the next question.")
                     return state
             if iteration < iteration_limit:
+                start = time.perf_counter()
                 suggestions = self.critic_agent(state, code_check_result)
+                timing["critic_seconds"] = round(time.perf_counter() - start, 3)
                 self.mtb_logger.info(f"Suggestions: {suggestions}")
                 state.update(suggestions)
+            self.record_timing(timing)
         self.mtb_logger.info(f"Final state of iteration {iteration}: {state}")
         self.mtb_logger.info("Failed to complete all subtasks. Go to the next question.")
         return state
 
-    def run(self) -> None:
+    def run(self, resume: bool = False) -> None:
         """
         加载所有问题文件，依次执行工作流，并将结果保存到 JSONL 文件中。
+        Every answer is appended to the file as soon as it is extracted; with resume=True questions already in the file are skipped.
         """
         questions_files_path = self.load_questions_path_from_directories()
-        results = []
-        for index, question_file_path in enumerate(questions_files_path, start=1):
-            self.mtb_logger.info(f"Processing question {index}/{len(questions_files_path)}")
-            self.mtb_logger.info(f"Path to question file: {question_file_path}")
-            with open(question_file_path, 'r', encoding="utf-8") as file:
-                message = file.read().strip()
-            self.mtb_logger.info("Question: {}".format(message.replace('\n', ' ')))
-            state = {"question": message}
-            final_state = self.pipeline(state)
-            results.append(final_state['answer'])
-        
-        # 提取 LLM 返回中的代码和函数名称，并保存结果
-        extracted_results = [self.extract_response(r) for r in results]
-        output_data = [
-            {
-                "question_file_path": os.path.basename(os.path.dirname(q)),
-                "function": r[0],
-                "function_name": r[1]
-            }
-            for q, r in zip(questions_files_path, extracted_results)
-        ]
-        os.makedirs(self.store_path, exist_ok=True)
         output_file = os.path.join(self.store_path, "function_generation_results.jsonl")
-        with open(output_file, "w", encoding="utf-8") as f:
-            for entry in output_data:
-                f.write(json.dumps(entry) + "\n")
+        checkpoint = GenerationCheckpoint(output_file, resume=resume)
+        if not resume and os.path.exists(self.timings_file):
+            os.remove(self.timings_file)
+        # one sandbox for the whole run: a container pool when several questions run at once
+        sandbox = DockerSandboxPool(size=self.sandbox_workers) if self.concurrency > 1 else DockerSandbox()
+        self.sandbox = CachedSandbox(sandbox, self.sandbox_cache) if self.sandbox_cache else sandbox
+        try:
+            self._run_questions(questions_files_path, checkpoint)
+            checkpoint.finalize(questions_files_path)
+        finally:
+            checkpoint.close()
+            if isinstance(sandbox, DockerSandboxPool):
+                sandbox.close()
+            self.sandbox = None
         self.mtb_logger.info("All tasks completed successfully.")
 
+    def _run_question(self, index: int, total: int, question_file_path: str, checkpoint: GenerationCheckpoint) -> None:
+        self.mtb_logger.info(f"Processing question {index}/{total}")
+        self.mtb_logger.info(f"Path to question file: {question_file_path}")
+        with open(question_file_path, 'r', encoding="utf-8") as file:
+            message = file.read().strip()
+        self.mtb_logger.info("Question: {}".format(message.replace('\n', ' ')))
+        state = {"question": message}
+        with span("question", question_file=question_file_path):
+            final_state = self.pipeline(state, question_id=checkpoint.question_key(question_file_path))
+        # 提取 LLM 返回中的代码和函数名称，并立即保存结果
+        checkpoint.record(question_file_path, *self.extract_response(final_state['answer']))
+
+    def _run_questions(self, questions_files_path: List[str], checkpoint: GenerationCheckpoint) -> None:
+        pending = []
+        for index, question_file_path in enumerate(questions_files_path, start=1):
+            if checkpoint.is_done(question_file_path):
+                self.mtb_logger.info(f"Skipping question {index}/{len(questions_files_path)}: already answered in {checkpoint.output_file}")
+            else:
+                pending.append((index, question_file_path))
+        if self.concurrency <= 1:
+            for index, question_file_path in pending:
+                self._run_question(index, len(questions_files_path), question_file_path, checkpoint)
+            return
+        # the refinement loops of up to `concurrency` questions run at once; the first failure stops the run
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            futures = [executor.submit(self._run_question, index, len(questions_files_path), question_file_path, checkpoint) for index, question_file_path in pending]
+            wait(futures, return_when=FIRST_EXCEPTION)
+            for future in futures:
+                if future.done() and future.exception() is not None:
+                    raise future.exception()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
     @classmethod
     def main(cls):
         """
@@ -431,6 +517,51 @@ class RAGPipeline:
                              default='code',
                              choices=['code', 'doc', 'llm-doc', 'llm-doc-full'],
                              help='Type of retriever to use.')
+        parser.add_argument('--sandbox_cache',
+                             type=str,
+                             default=None,
+                             help="Path of a sandbox result cache (e.g. 'sandbox_cache/results.sqlite3').")
+        parser.add_argument('--vector_backend',
+                             type=str,
+                             default='chroma',
+                             choices=['chroma', 'faiss'],
+                             help='Vector store backend. faiss needs an index exported with `python retrievers.py build`.')
+        parser.add_argument('--embedding_cache',
+                             type=str,
+                             default=None,
+                             help="Path of a query embedding cache (e.g. 'embedding_cache/embeddings.sqlite3').")
+        parser.add_argument('--llm_cache',
+                             type=str,
+                             default=None,
+                             help="Path of an LLM response cache (e.g. 'llm_cache/responses.sqlite3').")
+        parser.add_argument('--llm_cache_ttl',
+                             type=float,
+                             default=None,
+                             help="Seconds after which entries of --llm_cache are requested again. Default is no expiry.")
+        parser.add_argument('--concurrency',
+                             type=int,
+                             default=1,
+                             help='Number of questions whose refinement loops run at the same time. Above 1 the code checks share a sandbox container pool.')
+        parser.add_argument('--llm_concurrency',
+                             type=int,
+                             default=None,
+                             help='Maximum number of LLM requests in flight across all questions. Default is no extra limit.')
+        parser.add_argument('--sandbox_workers',
+                             type=int,
+                             default=None,
+                             help='Number of sandbox pool containers. Default is --concurrency.')
+        parser.add_argument('--retrieval_store',
+                             type=str,
+                             default=None,
+                             help="Path of a store of precomputed retrieval results (e.g. 'retrieval_store/retrievals.sqlite3'), filled by `python retrieval_store.py prefetch`.")
+        parser.add_argument('--events_file',
+                             type=str,
+                             default=None,
+                             help="File name in the result directory the question, retrieve, generate, sandbox_execute and parse spans are appended to (e.g. 'events.jsonl'). Summarize it with `python instrumentation.py report`.")
+        parser.add_argument('--resume',
+                             action='store_true',
+                             default=False,
+                             help='Keep the answers already in function_generation_results.jsonl and only ask the remaining questions.')
         
         try:
             args = parser.parse_args()
@@ -443,8 +574,18 @@ class RAGPipeline:
                 model_name=args.model_name,
                 temperature=args.temperature,
                 retriever_type=args.retriever_type,
+                sandbox_cache=args.sandbox_cache,
+                llm_cache=args.llm_cache,
+                llm_cache_ttl=args.llm_cache_ttl,
+                vector_backend=args.vector_backend,
+                embedding_cache=args.embedding_cache,
+                concurrency=args.concurrency,
+                llm_concurrency=args.llm_concurrency,
+                sandbox_workers=args.sandbox_workers,
+                retrieval_store=args.retrieval_store,
+                events_file=args.events_file,
             )
-            pipeline_instance.run()
+            pipeline_instance.run(resume=args.resume)
         
         except Exception as e:
             print(f"Error in main execution: {e}")
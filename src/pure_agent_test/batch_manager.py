@@ -0,0 +1,288 @@
+'''
+Batch generation of the pure LLM answers without manual downloads.
+`wait` polls any number of OpenAI Batch API jobs concurrently with backoff and, as soon as one of them ends, streams its
+output file to raw_responses.jsonl and writes function_generation_results.jsonl of the model.
+`run` is a local batch executor: it sends the requests of a request_bodies.jsonl to any provider of llm_providers.py
+(e.g. a local vLLM server) with many requests in flight, and writes the same Batch API output format and results.
+'''
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from typing import List
+from loguru import logger
+from openai import APIStatusError
+from tqdm import tqdm
+sys.path.append("..")
+from src.call_llms import load_async_llm, get_llm_provider, get_rate_limiter, call_with_retry
+from src.generation_checkpoint import GenerationCheckpoint
+from src.instrumentation import configure, span, record_usage
+from build_agent import load_questions_path_from_directories
+from download_batch_results import extract_response
+
+DEFAULT_QUESTION_DIR = 'question_segments/pymatgen_analysis_defects/'
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def task_index(custom_id: str) -> int:
+    """Index of the question of a request, whose custom_id is task_{index + 1} (see build_agent.generate_request_bodies)."""
+    return int(custom_id.split('_')[1]) - 1
+
+def response_content(output_line: dict) -> str | None:
+    """The answer in one line of a Batch API output file, or None if the request failed."""
+    response = output_line.get("response")
+    if output_line.get("error") or not response or response.get("status_code") != 200:
+        return None
+    return response["body"]["choices"][0]["message"]["content"]
+
+class BatchResultWriter:
+    """
+    Writes the Batch API output lines of one model to raw_responses.jsonl and records the extracted answer of every
+    successful request in function_generation_results.jsonl as soon as the line arrives.
+    """
+    def __init__(self, store_path: str, questions_files_path: List[str], resume: bool = False):
+        """
+        Args:
+            store_path (str): Result directory of the model, e.g. pure_agent_test/gpt-4o-mini-2024-07-18/.
+            questions_files_path (List[str]): The questions in the order of the request file.
+            resume (bool): Keep the successful responses already in raw_responses.jsonl. Otherwise both files are started afresh.
+        """
+        os.makedirs(store_path, exist_ok=True)
+        self.raw_file_path = os.path.join(store_path, 'raw_responses.jsonl')
+        self.questions_files_path = questions_files_path
+        self.output_lines = {}
+        if resume and os.path.exists(self.raw_file_path):
+            with open(self.raw_file_path, 'r', encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        output_line = json.loads(line)
+                    except ValueError:
+                        break
+                    if response_content(output_line) is not None:
+                        self.output_lines[output_line["custom_id"]] = output_line
+        self.checkpoint = GenerationCheckpoint(os.path.join(store_path, "function_generation_results.jsonl"), resume=resume)
+        # answers of responses kept from an earlier run that never made it into the results file
+        for custom_id, output_line in self.output_lines.items():
+            question_file_path = self.questions_files_path[task_index(custom_id)]
+            if not self.checkpoint.is_done(question_file_path):
+                self.checkpoint.record(question_file_path, *extract_response(response_content(output_line)))
+        self.raw_file = open(self.raw_file_path, 'w', encoding="utf-8")
+        for output_line in self.output_lines.values():
+            self.raw_file.write(json.dumps(output_line) + "\n")
+        self.raw_file.flush()
+        self.failed = {}
+
+    def is_done(self, custom_id: str) -> bool:
+        return custom_id in self.output_lines
+
+    def write(self, output_line: dict) -> bool:
+        """Append one output line and record its answer. Returns False if the request failed."""
+        custom_id = output_line["custom_id"]
+        self.raw_file.write(json.dumps(output_line) + "\n")
+        self.raw_file.flush()
+        content = response_content(output_line)
+        if content is None:
+            self.failed[custom_id] = output_line.get("error") or output_line["response"]
+            return False
+        self.failed.pop(custom_id, None)
+        self.output_lines[custom_id] = output_line
+        self.checkpoint.record(self.questions_files_path[task_index(custom_id)], *extract_response(content))
+        return True
+
+    def finalize(self) -> dict:
+        """
+        Put both files in question order, with the failed requests left out so that they can be sent again.
+        Returns:
+            dict: Numbers of answers and failed requests.
+        """
+        self.raw_file.close()
+        temp_file = self.raw_file_path + ".tmp"
+        with open(temp_file, 'w', encoding="utf-8") as f:
+            for custom_id in sorted(self.output_lines, key=task_index):
+                f.write(json.dumps(self.output_lines[custom_id]) + "\n")
+        os.replace(temp_file, self.raw_file_path)
+        self.checkpoint.finalize(self.questions_files_path)
+        self.checkpoint.close()
+        return {"answers": len(self.output_lines), "failed": len(self.failed)}
+
+async def stream_file(client, file_id: str, writer: BatchResultWriter):
+    """Write the lines of a Batch API output or error file while it is being downloaded."""
+    async with client.files.with_streaming_response.content(file_id) as response:
+        async for line in response.iter_lines():
+            if line.strip():
+                writer.write(json.loads(line))
+
+async def wait_for_batch(client, job_info: dict, questions_files_path: List[str], poll_interval: float = 30, max_poll_interval: float = 600, timeout: float | None = None) -> dict:
+    """
+    Poll one Batch API job until it ends and write its results to pure_agent_test/{model_name}/.
+    The polling interval doubles up to max_poll_interval while the job makes no progress and is jittered,
+    so that many jobs polled at once do not hit the API together.
+
+    Args:
+        client (AsyncOpenAI): Client of the provider the job was created on.
+        job_info (dict): {"model_name": ..., "batch_job_id": ...}, a line of a batch_job_ids_*.jsonl file.
+        questions_files_path (List[str]): The questions in the order of the request file.
+        timeout (float, optional): Seconds after which the job is left unfinished. Default is no limit.
+
+    Returns:
+        dict: job_info with the final status and the numbers of answers and failed requests.
+    """
+    batch_job_id = job_info['batch_job_id']
+    start = time.monotonic()
+    interval = poll_interval
+    last_progress = None
+    while True:
+        batch_job = await call_with_retry(lambda: client.batches.retrieve(batch_job_id))
+        counts = batch_job.request_counts
+        progress = (batch_job.status, counts.completed if counts else 0, counts.failed if counts else 0)
+        if progress != last_progress:
+            logger.info(f"Batch job {batch_job_id} of {job_info['model_name']}: {batch_job.status}" + (f", {counts.completed}/{counts.total} completed, {counts.failed} failed" if counts else ""))
+            last_progress = progress
+            interval = poll_interval
+        else:
+            interval = min(max_poll_interval, interval * 2)
+        if batch_job.status in TERMINAL_STATUSES:
+            break
+        if timeout is not None and time.monotonic() - start > timeout:
+            logger.warning(f"Stopped waiting for batch job {batch_job_id} after {timeout} s, status {batch_job.status}.")
+            return {**job_info, "status": batch_job.status, "answers": 0, "failed": 0}
+        await asyncio.sleep(random.uniform(interval / 2, interval))
+
+    result = {**job_info, "status": batch_job.status, "answers": 0, "failed": 0}
+    # expired and cancelled jobs still have the output of the requests that were finished
+    if batch_job.output_file_id or batch_job.error_file_id:
+        writer = BatchResultWriter(f"pure_agent_test/{job_info['model_name']}/", questions_files_path)
+        for file_id in (batch_job.output_file_id, batch_job.error_file_id):
+            if file_id:
+                await stream_file(client, file_id, writer)
+        result.update(writer.finalize())
+    if batch_job.status == "failed":
+        logger.error(f"Batch job {batch_job_id} failed: {batch_job.errors}")
+    logger.info(f"Batch job {batch_job_id} of {job_info['model_name']} ended with status {batch_job.status}: {result['answers']} answers, {result['failed']} failed requests.")
+    return result
+
+async def wait_for_batches(job_infos: List[dict], question_dir: str = DEFAULT_QUESTION_DIR, poll_interval: float = 30, max_poll_interval: float = 600, timeout: float | None = None) -> List[dict]:
+    """
+    Wait for all batch jobs at once; the results of every job are written as soon as it ends.
+
+    Returns:
+        List[dict]: The result of every job, see wait_for_batch. A job that raised has its error under "error".
+    """
+    questions_files_path = load_questions_path_from_directories(question_dir)
+    clients = {}
+    for job_info in job_infos:
+        if job_info['model_name'] not in clients:
+            clients[job_info['model_name']] = load_async_llm(llm_name=job_info['model_name'])
+    try:
+        results = await asyncio.gather(
+            *(wait_for_batch(clients[job_info['model_name']], job_info, questions_files_path, poll_interval, max_poll_interval, timeout) for job_info in job_infos),
+            return_exceptions=True
+        )
+    finally:
+        # clients of one provider share a connection pool, so close them only when every job is done
+        for client in clients.values():
+            await client.close()
+    for job_info, result in zip(job_infos, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error waiting for batch job {job_info['batch_job_id']}: {result}")
+    return [{**job_info, "status": "error", "error": str(result)} if isinstance(result, Exception) else result for job_info, result in zip(job_infos, results)]
+
+def load_batch_job_ids(file_path: str) -> List[dict]:
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"The file {file_path} does not exist.")
+    with open(file_path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+async def run_local_batch(request_file: str, store_path: str, questions_files_path: List[str], model_name: str | None = None, provider: str | None = None, concurrency: int = 32, requests_per_minute: float | None = None, max_retries: int = 3, resume: bool = False, llm_cache: str | None = None, llm_cache_ttl: float | None = None) -> dict:
+    """
+    Execute the requests of a Batch API input file locally and write the output as the Batch API would.
+
+    Args:
+        request_file (str): request_bodies.jsonl written by build_agent.py in batch mode.
+        store_path (str): Result directory for raw_responses.jsonl and function_generation_results.jsonl.
+        questions_files_path (List[str]): The questions in the order of the request file.
+        model_name (str, optional): Model to send the requests to instead of the one in the request bodies.
+        provider (str, optional): Provider in llm_providers.PROVIDERS to use instead of the model's default, e.g. 'local'.
+        concurrency (int): Maximum number of requests in flight.
+        requests_per_minute (float, optional): Request budget shared by all models of the same provider.
+        max_retries (int): Retries of transient API errors per request.
+        resume (bool): Only send the requests without a successful response in raw_responses.jsonl.
+        llm_cache (str, optional): SQLite file of an LLM response cache.
+        llm_cache_ttl (float, optional): Seconds after which cached responses are requested again.
+
+    Returns:
+        dict: Numbers of answers and failed requests.
+    """
+    with open(request_file, 'r', encoding="utf-8") as f:
+        requests = [json.loads(line) for line in f if line.strip()]
+    model_name = model_name or requests[0]["body"]["model"]
+    writer = BatchResultWriter(store_path, questions_files_path, resume=resume)
+    pending = [request for request in requests if not writer.is_done(request["custom_id"])]
+    logger.info(f"{len(requests) - len(pending)} requests of {request_file} already answered, sending {len(pending)} to {model_name}.")
+    client = load_async_llm(llm_name=model_name, cache_path=llm_cache, provider=provider, cache_ttl=llm_cache_ttl)
+    rate_limiter = get_rate_limiter(get_llm_provider(client), requests_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = tqdm(total=len(pending), desc="Batch requests")
+
+    async def execute(request: dict):
+        body = {**request["body"], "model": model_name}
+        output_line = {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"], "response": None, "error": None}
+        async with semaphore:
+            try:
+                with span("generate", model=model_name):
+                    response = await call_with_retry(lambda: client.chat.completions.create(**body), rate_limiter=rate_limiter, max_retries=max_retries)
+                    record_usage(response)
+                output_line["response"] = {"status_code": 200, "request_id": response.id, "body": response.model_dump()}
+            except APIStatusError as e:
+                output_line["response"] = {"status_code": e.status_code, "request_id": e.request_id, "body": e.body}
+            except Exception as e:
+                output_line["error"] = {"code": type(e).__name__, "message": str(e)}
+        writer.write(output_line)
+        progress.update(1)
+
+    try:
+        await asyncio.gather(*(execute(request) for request in pending))
+    finally:
+        progress.close()
+        await client.close()
+    result = writer.finalize()
+    logger.info(f"Local batch of {model_name} done: {result['answers']} answers, {result['failed']} failed requests.")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Wait for OpenAI batch jobs or run a batch locally. Example input: wait pure_agent_test/batch_job_ids_20250330_003704.jsonl")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    wait_parser = subparsers.add_parser("wait", help="Poll the batch jobs of a batch_job_ids_*.jsonl file and write the results of every job as soon as it ends.")
+    wait_parser.add_argument("batch_job_ids_file", type=str, help="File written by build_agent.py --batch_mode.")
+    wait_parser.add_argument("--poll_interval", type=float, default=30, help="Seconds between status checks, doubled while a job makes no progress. Default is 30.")
+    wait_parser.add_argument("--max_poll_interval", type=float, default=600, help="Upper bound of the polling interval in seconds. Default is 600.")
+    wait_parser.add_argument("--timeout", type=float, default=None, help="Stop waiting after this many seconds. Default is no limit.")
+    run_parser = subparsers.add_parser("run", help="Send the requests of a request_bodies.jsonl to an OpenAI-compatible endpoint and write the results like a batch job.")
+    run_parser.add_argument("request_file", type=str, help="Batch API input file, e.g. pure_agent_test/gpt-4o-2024-08-06/request_bodies.jsonl.")
+    run_parser.add_argument("--model_name", type=str, default=None, help="Model to answer the requests. Default is the model in the request bodies.")
+    run_parser.add_argument("--provider", type=str, default=None, help="Provider in llm_providers.py to send the requests to, e.g. local. Default is the provider of the model.")
+    run_parser.add_argument("--concurrency", type=int, default=32, help="Maximum number of requests in flight. Default is 32.")
+    run_parser.add_argument("--requests_per_minute", type=float, default=None, help="Maximum requests per minute per provider. Default is unlimited.")
+    run_parser.add_argument("--resume", action="store_true", default=False, help="Only send the requests without a successful response in raw_responses.jsonl.")
+    run_parser.add_argument("--llm_cache", type=str, default=None, help="SQLite file of an LLM response cache.")
+    run_parser.add_argument("--llm_cache_ttl", type=float, default=None, help="Seconds after which entries of --llm_cache are requested again. Default is no expiry.")
+    run_parser.add_argument("--events_file", type=str, default=None, help="File name in the model directory the generate spans are appended to, e.g. events.jsonl.")
+    for subparser in (wait_parser, run_parser):
+        subparser.add_argument("--question_dir", type=str, default=DEFAULT_QUESTION_DIR, help=f"Questions the requests were generated from. Default is {DEFAULT_QUESTION_DIR}.")
+    args = parser.parse_args()
+
+    if args.command == "wait":
+        results = asyncio.run(wait_for_batches(load_batch_job_ids(args.batch_job_ids_file), args.question_dir, args.poll_interval, args.max_poll_interval, args.timeout))
+        for result in results:
+            print(json.dumps(result))
+    else:
+        with open(args.request_file, 'r', encoding="utf-8") as f:
+            model_name = args.model_name or json.loads(f.readline())["body"]["model"]
+        store_path = f"pure_agent_test/{model_name}/"
+        configure(args.events_file and os.path.join(store_path, args.events_file), model=model_name, method="pure")
+        questions_files_path = load_questions_path_from_directories(args.question_dir)
+        result = asyncio.run(run_local_batch(args.request_file, store_path, questions_files_path, model_name, args.provider, args.concurrency, args.requests_per_minute, resume=args.resume, llm_cache=args.llm_cache, llm_cache_ttl=args.llm_cache_ttl))
+        print(json.dumps(result))
@@ -2,13 +2,16 @@
 This file is used to build the LLM agents to generate solution and check correctness of results.
 '''
 import argparse
+import asyncio
 from datetime import datetime
 import json
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from tqdm import tqdm
 import sys
 sys.path.append("..")
-from src.call_llms import load_llm
+from src.call_llms import load_llm, load_async_llm, get_llm_provider, get_rate_limiter, call_with_retry
+from src.generation_checkpoint import GenerationCheckpoint
+from src.instrumentation import configure, span, record_usage
 import os
 from typing import List
 from mtb_logger import MatToolBenLogger
@@ -50,16 +53,87 @@ def get_answer(client: OpenAI, message: str, model_args: dict) -> str:
     mtb_logger.info(f"Model_args: {model_args}")
     mtb_logger.info(f"Message sent to LLM: {message_to_log}")
     message = "\n".join([message, ANSWER_FORMAT])
-    response = client.chat.completions.create(
-        messages=[{"role": "user", "content": message}],
-        **model_args
-    )
+    with span("generate", model=model_args['model']):
+        response = client.chat.completions.create(
+            messages=[{"role": "user", "content": message}],
+            **model_args
+        )
+        record_usage(response)
     processed_response = response.choices[0].message.content.replace('\n', ' ')
     mtb_logger.info(f"Received response from LLM: {processed_response}")
     mtb_logger.info(f"Conversation ID: {response.id} | Created: {response.created} | Model: {response.model} | System Fingerprint: {response.system_fingerprint}")
     mtb_logger.info(f"Usage: {response.usage}")
     return response.choices[0].message.content
 
+async def get_answer_async(client: AsyncOpenAI, message: str, model_args: dict, index: int, rate_limiter=None, max_retries: int = 3) -> str:
+    """
+    Asyncio counterpart of get_answer, rate limited and retried with jittered backoff.
+
+    Args:
+        client (AsyncOpenAI): The asyncio LLM client used to get the response.
+        message (str): The message to send to the LLM.
+        index (int): Position of the question, used to tell interleaved log lines apart.
+        rate_limiter (AsyncRateLimiter, optional): The limiter of the client's provider.
+        max_retries (int): Number of retries of transient API errors.
+
+    Returns:
+        str: The content of the response from the LLM.
+    """
+    message_to_log = message.replace('\n', ' ')
+    mtb_logger.info(f"[{index + 1}] Model_args: {model_args}")
+    mtb_logger.info(f"[{index + 1}] Message sent to LLM: {message_to_log}")
+    message = "\n".join([message, ANSWER_FORMAT])
+    with span("generate", model=model_args['model']):
+        response = await call_with_retry(
+            lambda: client.chat.completions.create(messages=[{"role": "user", "content": message}], **model_args),
+            rate_limiter=rate_limiter,
+            max_retries=max_retries,
+        )
+        record_usage(response)
+    processed_response = response.choices[0].message.content.replace('\n', ' ')
+    mtb_logger.info(f"[{index + 1}] Received response from LLM: {processed_response}")
+    mtb_logger.info(f"[{index + 1}] Conversation ID: {response.id} | Created: {response.created} | Model: {response.model} | System Fingerprint: {response.system_fingerprint}")
+    mtb_logger.info(f"[{index + 1}] Usage: {response.usage}")
+    return response.choices[0].message.content
+
+async def evaluate_all_questions_async(questions_files_path: List[str], llm_name: str, model_args: dict, concurrency: int, requests_per_minute: float | None = None, checkpoint: GenerationCheckpoint | None = None, llm_cache: str | None = None, llm_cache_ttl: float | None = None) -> List[str]:
+    """
+    Get the responses for all questions with at most `concurrency` requests in flight.
+
+    Args:
+        questions_files_path (List[str]): A list of file paths to question files.
+        concurrency (int): Maximum number of concurrent requests.
+        requests_per_minute (float, optional): Request budget shared by all models of the same provider.
+        checkpoint (GenerationCheckpoint, optional): Every extracted answer is recorded here as soon as it arrives.
+        llm_cache (str, optional): SQLite file of an LLM response cache.
+        llm_cache_ttl (float, optional): Seconds after which cached responses are requested again.
+
+    Returns:
+        List[str]: The responses in question order, whatever order they arrived in.
+    """
+    client = load_async_llm(llm_name=llm_name, cache_path=llm_cache, cache_ttl=llm_cache_ttl)
+    rate_limiter = get_rate_limiter(get_llm_provider(client), requests_per_minute)
+    semaphore = asyncio.Semaphore(concurrency)
+    progress = tqdm(total=len(questions_files_path), desc="Processing", file=tqdm_logger)
+
+    async def answer(index: int, question_file_path: str) -> str:
+        async with semaphore:
+            mtb_logger.info(f"[{index + 1}] Path to question file: {question_file_path}")
+            with open(question_file_path, 'r') as file:
+                message = file.read().strip()
+            with span("question", question_file=question_file_path):
+                response = await get_answer_async(client, message, model_args, index, rate_limiter)
+            if checkpoint:
+                checkpoint.record(question_file_path, *extract_response(response))
+            progress.update(1)
+            return response
+
+    try:
+        return await asyncio.gather(*(answer(i, q) for i, q in enumerate(questions_files_path)))
+    finally:
+        progress.close()
+        await client.close()
+
 def generate_request_bodies(questions_files_path: List[str], model_args: dict) -> List[dict]:
     request_bodies = []
     for index, question_file_path in enumerate(questions_files_path):
@@ -80,20 +154,28 @@ def generate_request_bodies(questions_files_path: List[str], model_args: dict) -
         mtb_logger.info(f"Generated request body for question {index + 1}: {request_body}")
     return request_bodies
 
-def evaluate_all_questions(questions_files_path: List[str], llm_name: str, model_args: dict, batch_mode=False) -> List[str]:
+def evaluate_all_questions(questions_files_path: List[str], llm_name: str, model_args: dict, batch_mode=False, concurrency: int = 1, requests_per_minute: float | None = None, checkpoint: GenerationCheckpoint | None = None, llm_cache: str | None = None, batch_backend: str = "openai", resume: bool = False, llm_cache_ttl: float | None = None) -> List[str]:
     """
     Evaluate all questions by getting responses from the LLM.
 
     Args:
         questions (List[str]): A list of file paths to question files.
+        concurrency (int): Number of concurrent requests. Values above 1 use the asyncio path.
+        requests_per_minute (float, optional): Per-provider request budget of the asyncio path.
+        checkpoint (GenerationCheckpoint, optional): Questions already answered in it are skipped, new answers are appended to it.
+        llm_cache (str, optional): SQLite file of an LLM response cache. Identical requests are replayed from it.
+        batch_backend (str): 'openai' uploads the batch to the OpenAI Batch API and returns the batch job ID,
+            'local' runs it with batch_manager.run_local_batch on any model and writes the results directly.
+        resume (bool): With the local backend, only send the requests without a successful response.
+        llm_cache_ttl (float, optional): Seconds after which entries of llm_cache are requested again. Default is no expiry.
 
     Returns:
         List[str]: A list of responses from the LLM for each question.
     """
-    client = load_llm(llm_name=llm_name)
+    client = load_llm(llm_name=llm_name, cache_path=llm_cache, cache_ttl=llm_cache_ttl)
     mtb_logger.info(f"Total number of questions: {len(questions_files_path)}")
     mtb_logger.info(f"Loaded LLM client: {llm_name}")
-    if batch_mode == True and 'gpt' in llm_name:
+    if batch_mode == True and (batch_backend == "local" or 'gpt' in llm_name):
         mtb_logger.info("Batch mode enabled. Processing all questions.")
         request_bodies = generate_request_bodies(questions_files_path, model_args)
         # Save request_bodies to a JSONL file
@@ -102,18 +184,34 @@ def evaluate_all_questions(questions_files_path: List[str], llm_name: str, model
             for request_body in request_bodies:
                 jsonl_file.write(json.dumps(request_body) + '\n')
         mtb_logger.info(f"Saved request bodies to {jsonl_file_path}")
+        if batch_backend == "local":
+            result = asyncio.run(run_local_batch(jsonl_file_path, store_path, questions_files_path, llm_name, concurrency=concurrency, requests_per_minute=requests_per_minute, resume=resume, llm_cache=llm_cache, llm_cache_ttl=llm_cache_ttl))
+            mtb_logger.info(f"Local batch finished: {result}")
+            return None
         batch_file = client.files.create(file=open(jsonl_file_path, "rb"),purpose="batch")
         batch_job = client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h", metadata={"description": f"evaluate questions on model {model_args['model']}"})
         mtb_logger.info(f"Created batch file: {batch_file} | Created batch job: {batch_job} | Batch job ID: {batch_job.id}")
         mtb_logger.info("Please visit the OpenAI official website to view the status.")
         return batch_job.id
+    if checkpoint:
+        pending_questions = checkpoint.pending(questions_files_path)
+        mtb_logger.info(f"{len(questions_files_path) - len(pending_questions)} questions already answered in {checkpoint.output_file}, {len(pending_questions)} remaining.")
+        questions_files_path = pending_questions
+    if concurrency > 1:
+        mtb_logger.info(f"Processing questions with concurrency {concurrency}.")
+        llm_responses = asyncio.run(evaluate_all_questions_async(questions_files_path, llm_name, model_args, concurrency, requests_per_minute, checkpoint, llm_cache, llm_cache_ttl))
+        mtb_logger.info("All tasks completed successfully.")
+        return llm_responses
     else:   
         llm_responses = []
         for question_file_path in tqdm(questions_files_path, desc="Processing", file=tqdm_logger):
             mtb_logger.info(f"Path to question file: {question_file_path}")
             with open(question_file_path, 'r') as file:
                 message = file.read().strip()
-            llm_responses.append(get_answer(client, message, model_args))
+            with span("question", question_file=question_file_path):
+                llm_responses.append(get_answer(client, message, model_args))
+            if checkpoint:
+                checkpoint.record(question_file_path, *extract_response(llm_responses[-1]))
         mtb_logger.info("All tasks completed successfully.")
         return llm_responses
 
@@ -142,8 +240,24 @@ if __name__ == "__main__":
                       help='Names of models to evaluate (can specify multiple). Example: gpt-4o-mini gpt-3.5-turbo')
     parser.add_argument('--batch_mode', action='store_true', default=False,
                       help='Enable batch mode processing. Use this flag to process all questions in batch mode.')
+    parser.add_argument('--batch_backend', type=str, default='openai', choices=['openai', 'local'],
+                      help='Backend of --batch_mode. openai: OpenAI Batch API (gpt models only); local: send the batch requests with --concurrency requests in flight to the endpoint of any model and write the results directly.')
+    parser.add_argument('--wait', action='store_true', default=False,
+                      help='With --batch_mode, poll the OpenAI batch jobs until they end and write function_generation_results.jsonl of every model as soon as its job is done.')
     parser.add_argument('--temperature', type=lambda x: max(0, float(x)), default=0.7,
                       help='Temperature setting for the model. Default is 0.7. Minimum value is 0.')
+    parser.add_argument('--concurrency', type=int, default=1,
+                      help='Number of questions sent to the model concurrently. Default is 1 (sequential).')
+    parser.add_argument('--resume', action='store_true', default=False,
+                      help='Keep the answers already in function_generation_results.jsonl and only ask the remaining questions.')
+    parser.add_argument('--llm_cache', type=str, default=None,
+                      help='SQLite file of an LLM response cache (e.g. llm_cache/responses.sqlite3). Identical requests are replayed from it instead of calling the provider.')
+    parser.add_argument('--llm_cache_ttl', type=float, default=None,
+                      help='Seconds after which entries of --llm_cache are requested again. Default is no expiry.')
+    parser.add_argument('--requests_per_minute', type=float, default=None,
+                      help='Maximum requests per minute per provider when --concurrency is above 1. Default is unlimited.')
+    parser.add_argument('--events_file', type=str, default=None,
+                      help='File name in the model directory the question and generate spans are appended to, e.g. events.jsonl. Summarize it with `python instrumentation.py report`.')
     args = parser.parse_args()
     
     model_names = args.model_names
@@ -156,6 +270,8 @@ if __name__ == "__main__":
     
     if batch_mode:
         batch_job_ids = []
+        # imported here because batch_manager imports this module
+        from batch_manager import run_local_batch, wait_for_batches
          
     mtb_logger = MatToolBenLogger()
     id_for_logger = None
@@ -170,37 +286,47 @@ if __name__ == "__main__":
         tqdm_logger = None
         if not batch_mode:
             tqdm_logger = mtb_logger.get_tqdm_logger()
+        output_file = os.path.join(store_path, "function_generation_results.jsonl")
+        checkpoint = None
+        if not batch_mode:
+            checkpoint = GenerationCheckpoint(output_file, resume=args.resume)
+        configure(args.events_file and os.path.join(store_path, args.events_file), model=model_name, method="pure")
         try:
             # Evaluate all questions
             results = evaluate_all_questions(
                 questions_files_path,
                 llm_name=model_name,
                 model_args=model_args,
-                batch_mode=batch_mode
+                batch_mode=batch_mode,
+                concurrency=args.concurrency,
+                requests_per_minute=args.requests_per_minute,
+                checkpoint=checkpoint,
+                llm_cache=args.llm_cache,
+                llm_cache_ttl=args.llm_cache_ttl,
+                batch_backend=args.batch_backend,
+                resume=args.resume
             )
             if batch_mode:
-                batch_job_ids.append({"model_name": model_name, "batch_job_id": results})
+                # only the OpenAI backend returns a batch job ID, the local backend has written the results already
+                if isinstance(results, str):
+                    batch_job_ids.append({"model_name": model_name, "batch_job_id": results})
             else:
-                # Extract the responses
-                results = [extract_response(r) for r in results]
-                # Save the responses to a JSON file
-                output_data = [
-                    {"question_file_path": os.path.basename(os.path.dirname(q)), "function": r[0], "function_name": r[1]}
-                    for q, r in zip(questions_files_path, results)
-                ]
-                output_file = os.path.join(store_path, "function_generation_results.jsonl")
-                with open(output_file, "w", encoding="utf-8") as f:
-                    for entry in output_data:
-                        f.write(json.dumps(entry) + "\n")
-
+                # Put the answers appended so far back in question order
+                checkpoint.finalize(questions_files_path)
                 mtb_logger.info(f"Saved responses to {output_file}")
         except Exception as e:
             mtb_logger.error(f"An error occurred for model {model_name}: {e}")
+        finally:
+            if checkpoint:
+                checkpoint.close()
             
-    if batch_mode:
+    if batch_mode and batch_job_ids:
         current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
         with open(f'pure_agent_test/batch_job_ids_{current_time}.jsonl', 'w') as f:
             for batch_job_id in batch_job_ids:
                 f.write(json.dumps(batch_job_id) + "\n")
+        if args.wait:
+            for result in asyncio.run(wait_for_batches(batch_job_ids, base_directory)):
+                mtb_logger.info(f"Batch job result: {result}")
     
     
@@ -1,6 +1,8 @@
 import os
 import json
-from docker_sandbox import DockerSandbox
+from docker_sandbox import DockerSandbox, DockerSandboxPool
+from sandbox_cache import SandboxResultCache, CachedSandbox
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from typing import List, Dict
 import json
@@ -9,6 +11,14 @@ import argparse
 from datetime import datetime
 import pandas as pd
 from utils import ComplexDictParser
+from instrumentation import configure, span, annotate_span
+
+logger = logging.getLogger()
+
+TOTAL_TASKS_NUMBER = 49
+TOTAL_SUB_TASKS = 138
+UNIT_TEST_PATH_TEMPLATE = "question_segments/pymatgen_analysis_defects/{path}/new_unit_test.py"
+REF_SUB_TASKS_LIST = [10, 4, 1, 2, 18, 3, 4, 1, 1, 3, 1, 1, 1, 2, 3, 1, 2, 2, 2, 1, 1, 2, 1, 9, 1, 3, 1, 2, 1, 2, 11, 2, 4, 2, 2, 2, 1, 2, 4, 2, 1, 3, 2, 1, 3, 2, 3, 3, 2]
 
 # Initialize logger
 def setup_logger(generated_function_path: str):
@@ -75,7 +85,8 @@ def code_validation(codeinfo: dict, sandbox: DockerSandbox) -> str:
         code = codeinfo['function']
         code_name = f"print({codeinfo['function_name']}())"
         execution_code = "\n".join([code, code_name])
-        code_execution_result = sandbox.execute_code(execution_code)
+        with span("sandbox_execute"):
+            code_execution_result = sandbox.execute_code(execution_code)
         logger.info(f"Code validation for {codeinfo['function_name']} completed successfully.")
         logger.info(f"Code execution result: {code_execution_result}")
         return code_execution_result
@@ -96,11 +107,12 @@ def run_test(unit_test_file_path: str, generated_output: dict, sandbox: DockerSa
     """
     try:
         logger.info(f"Running tests for function {function_name} using file {unit_test_file_path}.")
-        test_result = sandbox.execute_file(
-            params_dict=generated_output, 
-            py_filename=unit_test_file_path, 
-            function_name=function_name
-        )
+        with span("unit_test", test_function=function_name):
+            test_result = sandbox.execute_file(
+                params_dict=generated_output, 
+                py_filename=unit_test_file_path, 
+                function_name=function_name
+            )
         
         if type(test_result) == str and "ok" in test_result:
             logger.info(f"Test passed for function {function_name}.")
@@ -117,8 +129,9 @@ def run_test(unit_test_file_path: str, generated_output: dict, sandbox: DockerSa
         return f"Error during test execution: {str(e)}"
 
 def parse_complex_string(input_str):
-    parser = ComplexDictParser()
-    return parser.parse(input_str)
+    with span("parse"):
+        parser = ComplexDictParser()
+        return parser.parse(input_str)
 
 def evaluate_generated_code(i:int, unit_test_file_path: str, codeinfo: dict, sandbox: DockerSandbox) -> str:
     """
@@ -158,6 +171,57 @@ def evaluate_generated_code(i:int, unit_test_file_path: str, codeinfo: dict, san
         logger.error(f"Error during evaluation for function {codeinfo['function_name']}: {str(e)}")
         return f"Error during test execution: {str(e)}"
 
+def evaluate_generated_code_combined(i: int, unit_test_file_path: str, codeinfo: dict, sandbox: DockerSandbox) -> str:
+    """
+    Evaluates the generated code and runs its unit test in a single sandbox execution.
+    The output dict is parsed back from its str inside the container, as evaluate_generated_code does with the
+    printed output, and handed to the test function there instead of being pickled into a second container,
+    so extra prints in the generated code no longer break the parsing.
+    Args:
+        unit_test_file_path (str): The path to the unit test file.
+        codeinfo (dict): The generated code information.
+        sandbox (DockerSandbox): The DockerSandbox instance.
+    Returns:
+        str: The evaluation result (either 'ok', a list of errors, or an error message).
+    """
+    try:
+        logger.info(f"------Evaluating generated code {i} for function {codeinfo['function_name']} (combined)------")
+        with span("sandbox_execute", combined=True):
+            result = sandbox.execute_with_test(
+                code=codeinfo['function'],
+                function_name=codeinfo['function_name'],
+                py_filename=unit_test_file_path,
+                test_function_name=codeinfo['question_file_path']
+            )
+        logger.info(f"Code execution result: {result}")
+        if isinstance(result, str):
+            raise RuntimeError(result)
+
+        report = result['report']
+        if report is None or report['stage'] != "test":
+            error = report['error'] if report else result['stderr']
+            logger.error(f"FunctionError: Unable to process the result for {codeinfo['function_name']}. Error: {error}. Output: {result}")
+            return "FunctionError"
+        logger.info(f"Code execution successful for {codeinfo['function_name']}. Output: {report['output']}")
+
+        test_result = report['test_result']
+        if report['error'] is not None:
+            logger.error(f"Error during test execution for function {codeinfo['question_file_path']}: {report['error']}")
+            return f"Error during test execution: {report['error']}"
+        if test_result == "ok":
+            logger.info(f"Test passed for function {codeinfo['question_file_path']}.")
+            return "ok"
+        elif isinstance(test_result, list):
+            logger.info(f"Test partially passed for function {codeinfo['question_file_path']}, returned result: {test_result}")
+            return test_result
+        else:
+            logger.error(f"Test failed for function {codeinfo['question_file_path']}, result: {test_result}")
+            return f"Error: The code did not pass the unit tests. Output: {test_result}"
+
+    except Exception as e:
+        logger.error(f"Error during evaluation for function {codeinfo['function_name']}: {str(e)}")
+        return f"Error during test execution: {str(e)}"
+
 def print_accuracy_summary(correct_tasks, partially_correct_tasks, incorrect_tasks, function_errors, result_errors, success_count, total_tasks, correct_subtasks, incorrect_subtasks, total_subtasks, file_name="accuracy_summary.xlsx"):
     """
     Print a summary table of the accuracy and error types, and save it as an Excel file.
@@ -198,44 +262,43 @@ def print_accuracy_summary(correct_tasks, partially_correct_tasks, incorrect_tas
 
     return error_summary
     
-
-if __name__ == "__main__":
+def evaluate_all_generated_code(function_lists: List[Dict], base_path: str, sandbox: DockerSandbox | DockerSandboxPool, workers: int = 1, combined: bool = False) -> list:
     """
-    Main script to evaluate the generated functions by running tests in a Docker sandbox environment.
-    The script tracks the number of successful tasks, tasks with errors, and the accuracy of the sub-tasks.
+    Evaluate every generated function, optionally fanning the tasks out over a thread pool.
+    Args:
+        function_lists (List[Dict]): The generated code information, one entry per task.
+        base_path (str): Unit test path template with a '{path}' placeholder for the question folder.
+        sandbox (DockerSandbox | DockerSandboxPool): The sandbox used to execute the code.
+        workers (int): Number of tasks evaluated concurrently. 1 keeps the sequential behaviour.
+        combined (bool): Run each function and its unit test in one execution (evaluate_generated_code_combined).
+    Returns:
+        list: The evaluation results in task order, whatever order the tasks finished in.
     """
-    # 预计是除非最后结果是ok或者返回list，否则都报错误信息。List则表明部分通过或者至少import正确。
-    # 分成三类，function error, result error, success
-    # 1. function error: 无法import或函数使用错误，则代码无法运行
-    # 2. result error: import成功，也使用了存在的pymatgen函数/方法，返回dict，但是dict的值与预期不符，结果错误，返回错误list
-    # 3. success: import成功，返回dict，dict的值与预期一致，返回ok
-    # In English:
-    # 1. FunctionError: Unable to import or use the necessary functions (code cannot run).
-    # 2. ResultError: Code runs, but the output is incorrect or does not match expectations.
-    # 3. Success: The code runs correctly and returns the expected result.
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--generated_function_path", type=str, default="", help="generated_function_path, e.g. 'thinking_agent_test/gpt-3.5-turbo-0125_method1/'")
-    args = parser.parse_args()
-    generated_function_path = args.generated_function_path
-    logger = setup_logger(generated_function_path)  # Initialize logger with the generated function path
-    generated_function_path_with_jsonl = os.path.join(generated_function_path, "function_generation_results.jsonl")
-    logger.info(f"------Starting evaluation process for functions at {generated_function_path_with_jsonl}------")
-    
-    function_lists = read_function_generation_results(generated_function_path_with_jsonl)
-    total_tasks_number = 49
-    total_sub_tasks = 138
-    
-    if len(function_lists) != total_tasks_number:
-        logger.error(f"Total tasks number is not equal to {total_tasks_number}")
-        raise ValueError(f"Total tasks number is not equal to {total_tasks_number}")
-    if not check_file_name_consistency(function_lists):
-        logger.error("File names are not consistent.")
-        raise ValueError("File names are not consistent.")
-        
-    sandbox = DockerSandbox()
-    base_path = "question_segments/pymatgen_analysis_defects/{path}/new_unit_test.py"
-    ref_sub_tasks_list = [10, 4, 1, 2, 18, 3, 4, 1, 1, 3, 1, 1, 1, 2, 3, 1, 2, 2, 2, 1, 1, 2, 1, 9, 1, 3, 1, 2, 1, 2, 11, 2, 4, 2, 2, 2, 1, 2, 4, 2, 1, 3, 2, 1, 3, 2, 3, 3, 2]
+    evaluate = evaluate_generated_code_combined if combined else evaluate_generated_code
+
+    def evaluate_task(indexed_codeinfo):
+        i, codeinfo = indexed_codeinfo
+        unit_test_file_path = base_path.format(path=codeinfo['question_file_path'])
+        with span("question", question_file=codeinfo['question_file_path']):
+            result = evaluate(i, unit_test_file_path, codeinfo, sandbox)
+            annotate_span(result="ok" if result == "ok" else "partial" if isinstance(result, list) else "error")
+        return result
+
+    if workers <= 1:
+        return [evaluate_task(item) for item in enumerate(function_lists)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(evaluate_task, enumerate(function_lists)))
 
+def tally_evaluation_results(function_lists: List[Dict], evaluation_results: list, ref_sub_tasks_list: List[int]) -> dict:
+    """
+    Aggregate the per-task evaluation results into the task and sub-task counters, in task order.
+    Args:
+        function_lists (List[Dict]): The generated code information, one entry per task.
+        evaluation_results (list): The evaluation result of each task, in the same order.
+        ref_sub_tasks_list (List[int]): The number of sub-tasks of each task.
+    Returns:
+        dict: The counters used by print_accuracy_summary.
+    """
     correct_tasks = 0
     partially_correct_tasks = 0
     incorrect_tasks = 0
@@ -245,10 +308,7 @@ if __name__ == "__main__":
     result_errors = 0
     success_count = 0
 
-    for i, codeinfo in enumerate(function_lists):
-        unit_test_file_path = base_path.format(path=codeinfo['question_file_path'])
-        evaluation_result = evaluate_generated_code(i, unit_test_file_path, codeinfo, sandbox)
-        
+    for i, (codeinfo, evaluation_result) in enumerate(zip(function_lists, evaluation_results)):
         # Count correct and incorrect results based on the evaluation
         if "ok" in evaluation_result:
             correct_tasks += 1
@@ -270,11 +330,79 @@ if __name__ == "__main__":
             
         logger.info(f"Evaluation result for function | {codeinfo['function_name']} | {evaluation_result}")
         logger.info(f"-------------------------------------------------------------")
+
+    return {
+        "correct_tasks": correct_tasks,
+        "partially_correct_tasks": partially_correct_tasks,
+        "incorrect_tasks": incorrect_tasks,
+        "function_errors": function_errors,
+        "result_errors": result_errors,
+        "success_count": success_count,
+        "correct_subtasks": correct_subtasks,
+        "incorrect_subtasks": incorrect_subtasks,
+    }
+
+if __name__ == "__main__":
+    """
+    Main script to evaluate the generated functions by running tests in a Docker sandbox environment.
+    The script tracks the number of successful tasks, tasks with errors, and the accuracy of the sub-tasks.
+    """
+    # 预计是除非最后结果是ok或者返回list，否则都报错误信息。List则表明部分通过或者至少import正确。
+    # 分成三类，function error, result error, success
+    # 1. function error: 无法import或函数使用错误，则代码无法运行
+    # 2. result error: import成功，也使用了存在的pymatgen函数/方法，返回dict，但是dict的值与预期不符，结果错误，返回错误list
+    # 3. success: import成功，返回dict，dict的值与预期一致，返回ok
+    # In English:
+    # 1. FunctionError: Unable to import or use the necessary functions (code cannot run).
+    # 2. ResultError: Code runs, but the output is incorrect or does not match expectations.
+    # 3. Success: The code runs correctly and returns the expected result.
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--generated_function_path", type=str, default="", help="generated_function_path, e.g. 'thinking_agent_test/gpt-3.5-turbo-0125_method1/'")
+    parser.add_argument("--sandbox_cache", type=str, default=None, help="Path of a sandbox result cache (e.g. 'sandbox_cache/results.sqlite3'). Programs already executed on the same image are not run again.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of tasks evaluated concurrently on a pool of sandbox containers. Default is 1 (sequential).")
+    parser.add_argument("--combined", action="store_true", default=False, help="Run each generated function and its unit test in a single sandbox execution and get the result back as JSON.")
+    parser.add_argument("--events_file", type=str, default=None, help="File name in generated_function_path the question, sandbox_execute, parse and unit_test spans are appended to (e.g. 'evaluation_events.jsonl'). Summarize it with `python instrumentation.py report`.")
+    args = parser.parse_args()
+    generated_function_path = args.generated_function_path
+    logger = setup_logger(generated_function_path)  # Initialize logger with the generated function path
+    configure(args.events_file and os.path.join(generated_function_path, args.events_file), model=os.path.basename(os.path.normpath(generated_function_path)), method="evaluation")
+    generated_function_path_with_jsonl = os.path.join(generated_function_path, "function_generation_results.jsonl")
+    logger.info(f"------Starting evaluation process for functions at {generated_function_path_with_jsonl}------")
+    
+    function_lists = read_function_generation_results(generated_function_path_with_jsonl)
+    total_tasks_number = TOTAL_TASKS_NUMBER
+    total_sub_tasks = TOTAL_SUB_TASKS
     
+    if len(function_lists) != total_tasks_number:
+        logger.error(f"Total tasks number is not equal to {total_tasks_number}")
+        raise ValueError(f"Total tasks number is not equal to {total_tasks_number}")
+    if not check_file_name_consistency(function_lists):
+        logger.error("File names are not consistent.")
+        raise ValueError("File names are not consistent.")
+        
+    base_path = UNIT_TEST_PATH_TEMPLATE
+    ref_sub_tasks_list = REF_SUB_TASKS_LIST
+
+    sandbox_cache = SandboxResultCache(args.sandbox_cache) if args.sandbox_cache else None
+    if args.workers > 1:
+        logger.info(f"Evaluating with {args.workers} workers on a sandbox pool.")
+        with DockerSandboxPool(size=args.workers) as sandbox:
+            if sandbox_cache:
+                sandbox = CachedSandbox(sandbox, sandbox_cache)
+            evaluation_results = evaluate_all_generated_code(function_lists, base_path, sandbox, args.workers, args.combined)
+    else:
+        sandbox = DockerSandbox()
+        if sandbox_cache:
+            sandbox = CachedSandbox(sandbox, sandbox_cache)
+        evaluation_results = evaluate_all_generated_code(function_lists, base_path, sandbox, combined=args.combined)
+    if sandbox_cache:
+        logger.info(f"Sandbox cache statistics: {sandbox_cache.stats()}")
+    counters = tally_evaluation_results(function_lists, evaluation_results, ref_sub_tasks_list)
+
     # Print the summary including task and sub-task accuracies, errors, and types
     error_summary = print_accuracy_summary(
-        correct_tasks, partially_correct_tasks, incorrect_tasks, function_errors, result_errors, success_count, 
-        total_tasks_number, correct_subtasks, incorrect_subtasks, total_sub_tasks
+        counters["correct_tasks"], counters["partially_correct_tasks"], counters["incorrect_tasks"], counters["function_errors"], counters["result_errors"], counters["success_count"],
+        total_tasks_number, counters["correct_subtasks"], counters["incorrect_subtasks"], total_sub_tasks
     )
 
     # Store the error summary in an Excel file
@@ -0,0 +1,161 @@
+'''
+Store of precomputed retrieval results shared by the RAG generators.
+The documents retrieved for a question are keyed by (question, retriever_type, k, vector store version), where the
+question is identified by the sha256 of its text and the version by retrievers.vector_store_version. They are
+computed once with `python retrieval_store.py prefetch`, so a sweep over many models reads identical contexts
+without embedding the questions or touching the vector store again.
+'''
+import sys
+sys.path.append("..")
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from typing import Callable, List
+from langchain_core.documents import Document
+from src.retrievers import VECTOR_STORE_CONFIGS, VECTOR_BACKENDS, vector_store_version
+from src.instrumentation import count_span
+
+DEFAULT_STORE_PATH = "retrieval_store/retrievals.sqlite3"
+
+class RetrievalStore:
+    """
+    SQLite-backed store of retrieved documents.
+    """
+    def __init__(self, db_path: str = DEFAULT_STORE_PATH):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS retrievals ("
+                "question_hash TEXT, retriever_type TEXT, k INTEGER, store_version TEXT, "
+                "question_file TEXT, documents TEXT, created_at REAL, "
+                "PRIMARY KEY (question_hash, retriever_type, k, store_version))"
+            )
+
+    @staticmethod
+    def question_hash(question: str) -> str:
+        return hashlib.sha256(question.encode("utf-8")).hexdigest()
+
+    def get(self, question: str, retriever_type: str, k: int, store_version: str) -> List[Document] | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT documents FROM retrievals WHERE question_hash = ? AND retriever_type = ? AND k = ? AND store_version = ?",
+                (self.question_hash(question), retriever_type, k, store_version)
+            ).fetchone()
+        if row is None:
+            return None
+        return [Document(page_content=record["page_content"], metadata=record["metadata"]) for record in json.loads(row[0])]
+
+    def put(self, question: str, retriever_type: str, k: int, store_version: str, documents: List[Document], question_file: str | None = None):
+        records = [{"page_content": document.page_content, "metadata": document.metadata} for document in documents]
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO retrievals (question_hash, retriever_type, k, store_version, question_file, documents, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.question_hash(question), retriever_type, k, store_version, question_file, json.dumps(records, ensure_ascii=False), time.time())
+            )
+
+    def clear(self, retriever_type: str | None = None) -> int:
+        with self.lock, self.connection:
+            if retriever_type is None:
+                cursor = self.connection.execute("DELETE FROM retrievals")
+            else:
+                cursor = self.connection.execute("DELETE FROM retrievals WHERE retriever_type = ?", (retriever_type,))
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT retriever_type, store_version, k, COUNT(*) FROM retrievals GROUP BY retriever_type, store_version, k"
+            ).fetchall()
+        return {f"{retriever_type} (version {store_version}, k={k})": {"entries": entries} for retriever_type, store_version, k, entries in rows}
+
+    def close(self):
+        self.connection.close()
+
+class StoredVectorStore:
+    """
+    Serves similarity_search from a RetrievalStore. On a miss the vector store is loaded on first use, queried,
+    and the result is stored, so questions not prefetched (e.g. critic queries of mtr_rag) are retrieved only once too.
+    """
+    def __init__(self, store: RetrievalStore, retriever_type: str, store_version: str, load_vector_store: Callable):
+        """
+        Args:
+            store (RetrievalStore): The retrieval store.
+            retriever_type (str): Retriever type of the stored entries.
+            store_version (str): Version of the vector store, see retrievers.vector_store_version.
+            load_vector_store (Callable): Returns the vector store queried on a miss.
+        """
+        self.store = store
+        self.retriever_type = retriever_type
+        self.store_version = store_version
+        self.load_vector_store = load_vector_store
+        self.vector_store = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        documents = self.store.get(query, self.retriever_type, k, self.store_version)
+        if documents is not None:
+            self.hits += 1
+            count_span("cache_hits")
+            return documents
+        self.misses += 1
+        with self.lock:
+            if self.vector_store is None:
+                self.vector_store = self.load_vector_store()
+        documents = self.vector_store.similarity_search(query, k=k)
+        self.store.put(query, self.retriever_type, k, self.store_version, documents)
+        return documents
+
+def prefetch(store: RetrievalStore, vector_store, retriever_type: str, store_version: str, questions_files_path: List[str], k: int = 5, overwrite: bool = False) -> int:
+    """
+    Retrieve and store the documents of every question file.
+    Returns:
+        int: The number of questions that were retrieved, i.e. not already in the store.
+    """
+    count = 0
+    for question_file_path in questions_files_path:
+        with open(question_file_path, 'r', encoding="utf-8") as file:
+            question = file.read().strip()
+        if not overwrite and store.get(question, retriever_type, k, store_version) is not None:
+            continue
+        documents = vector_store.similarity_search(question, k=k)
+        store.put(question, retriever_type, k, store_version, documents, question_file=question_file_path)
+        count += 1
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute, inspect or clear stored retrieval results. Example input: prefetch --retriever_type llm-doc-full")
+    parser.add_argument("command", choices=["prefetch", "stats", "clear"], help="prefetch: retrieve the documents of all questions; stats: show entry counts; clear: remove entries.")
+    parser.add_argument("--db_path", type=str, default=DEFAULT_STORE_PATH, help=f"Store database. Default is {DEFAULT_STORE_PATH}.")
+    parser.add_argument("--retriever_type", type=str, default=None, choices=list(VECTOR_STORE_CONFIGS), help="prefetch: vector store to query (required); clear: only remove entries of this retriever type.")
+    parser.add_argument("--vector_backend", type=str, default="chroma", choices=VECTOR_BACKENDS, help="prefetch: vector store backend. Default is chroma.")
+    parser.add_argument("--k", type=int, default=5, help="prefetch: documents retrieved per question. Default is 5, as used by the generators.")
+    parser.add_argument("--question_dir", type=str, default="question_segments/pymatgen_analysis_defects/", help="prefetch: directory searched for question.txt files.")
+    parser.add_argument("--embedding_cache", type=str, default=None, help="prefetch: SQLite file of a query embedding cache.")
+    parser.add_argument("--overwrite", action="store_true", default=False, help="prefetch: retrieve again questions that are already stored.")
+    args = parser.parse_args()
+
+    store = RetrievalStore(args.db_path)
+    if args.command == "prefetch":
+        if args.retriever_type is None:
+            parser.error("prefetch needs --retriever_type")
+        from src.call_llms import load_embedding_model
+        from src.retrievers import load_vector_store
+        questions_files_path = [os.path.join(root, 'question.txt') for root, _, files in os.walk(args.question_dir) if 'question.txt' in files]
+        vector_store = load_vector_store(args.retriever_type, load_embedding_model("text-embedding-3-large", cache_path=args.embedding_cache), backend=args.vector_backend)
+        version = vector_store_version(args.retriever_type, args.vector_backend)
+        count = prefetch(store, vector_store, args.retriever_type, version, questions_files_path, k=args.k, overwrite=args.overwrite)
+        print(f"Retrieved {count} of {len(questions_files_path)} questions for '{args.retriever_type}' (version {version}) into {args.db_path}")
+    elif args.command == "stats":
+        print(json.dumps(store.stats(), indent=2))
+    else:
+        print(f"Removed {store.clear(args.retriever_type)} entries from {args.db_path}")
+    store.close()
@@ -0,0 +1,249 @@
+'''
+Vector store backends for the RAG pipelines.
+The default backend is the persisted Chroma collection of each retriever type. The FAISS backend loads the same
+document embeddings, exported once with `python retrievers.py build`, into an in-process (optionally memory-mapped)
+FAISS index and caches query embeddings, so a retrieval no longer needs a network round-trip to the vector database.
+'''
+import os
+import json
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from typing import List, Tuple
+import numpy as np
+import faiss
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+
+# retriever_type -> (Chroma collection name, Chroma persist directory, FAISS index directory)
+VECTOR_STORE_CONFIGS = {
+    'code': ("pymatgen", "vector_store/vs_method1/", "vector_store/faiss_method1/"),
+    'doc': ("pymatgen-doc", "vector_store/vs_method2/", "vector_store/faiss_method2/"),
+    'llm-doc': ("pymatgen_llm_doc", "vector_store/vs_method3/", "vector_store/faiss_method3/"),
+    'llm-doc-full': ("pymatgen_llm_doc_full", "vector_store/vs_method4/", "vector_store/faiss_method4/"),
+}
+VECTOR_BACKENDS = ['chroma', 'faiss']
+
+class FaissVectorStore:
+    """
+    Read-only FAISS index over exported document embeddings, duck-typed to the Chroma similarity_search API.
+    """
+    INDEX_FILE = "index.faiss"
+    DOCUMENTS_FILE = "documents.jsonl"
+    OFFSETS_FILE = "offsets.npy"
+    META_FILE = "meta.json"
+
+    def __init__(self, index_dir: str, embedding_function, mmap: bool = True, ef_search: int = 128, query_cache_size: int = 10000):
+        """
+        Args:
+            index_dir (str): Directory written by FaissVectorStore.build.
+            embedding_function: The embedding model used for the documents, e.g. load_embedding_model("text-embedding-3-large").
+            mmap (bool): Memory-map the index instead of reading it into RAM.
+            ef_search (int): Search breadth of HNSW indexes. Ignored for flat indexes.
+            query_cache_size (int): Number of query embeddings kept in memory.
+        """
+        with open(os.path.join(index_dir, self.META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        io_flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        self.index = faiss.read_index(os.path.join(index_dir, self.INDEX_FILE), io_flags)
+        if self.meta["index_type"] == "hnsw":
+            self.index.hnsw.efSearch = ef_search
+        self.offsets = np.load(os.path.join(index_dir, self.OFFSETS_FILE), mmap_mode="r")
+        self.documents_fd = os.open(os.path.join(index_dir, self.DOCUMENTS_FILE), os.O_RDONLY)
+        self.embedding_function = embedding_function
+        self.query_cache = OrderedDict()
+        self.query_cache_lock = threading.Lock()
+        self.query_cache_size = query_cache_size
+
+    @classmethod
+    def build(cls, index_dir: str, embeddings: np.ndarray, documents: List[Document], index_type: str = "flat", hnsw_m: int = 32, source: str = "") -> None:
+        """
+        Write a FAISS index and its documents to index_dir.
+        Args:
+            embeddings (np.ndarray): One embedding per document, shape (n, dimension).
+            documents (List[Document]): The documents, in the order of embeddings.
+            index_type (str): 'flat' for exact search or 'hnsw' for approximate search.
+            hnsw_m (int): Number of neighbours per node of an HNSW index.
+            source (str): Description of where the embeddings come from, kept in meta.json.
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        dimension = embeddings.shape[1]
+        # L2 distance, the Chroma default, so both backends rank documents the same way
+        if index_type == "flat":
+            index = faiss.IndexFlatL2(dimension)
+        elif index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(dimension, hnsw_m)
+            index.hnsw.efConstruction = 200
+        else:
+            raise ValueError(f"Invalid index_type: {index_type}. Expected one of ['flat', 'hnsw'].")
+        index.add(embeddings)
+
+        os.makedirs(index_dir, exist_ok=True)
+        faiss.write_index(index, os.path.join(index_dir, cls.INDEX_FILE))
+        offsets = []
+        with open(os.path.join(index_dir, cls.DOCUMENTS_FILE), "wb") as f:
+            for document in documents:
+                offsets.append(f.tell())
+                f.write(json.dumps({"page_content": document.page_content, "metadata": document.metadata}, ensure_ascii=False).encode("utf-8") + b"\n")
+            offsets.append(f.tell())
+        np.save(os.path.join(index_dir, cls.OFFSETS_FILE), np.array(offsets, dtype=np.int64))
+        with open(os.path.join(index_dir, cls.META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"index_type": index_type, "dimension": dimension, "count": len(documents), "source": source}, f, indent=4)
+
+    def _document(self, position: int) -> Document:
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        record = json.loads(os.pread(self.documents_fd, end - start, start))
+        return Document(page_content=record["page_content"], metadata=record["metadata"])
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embed the query, reusing the embedding of a recently seen identical query."""
+        return self.embed_queries([query])[0]
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed several queries, sending all those not in the query cache to the embedding model in one request."""
+        embeddings = {}
+        with self.query_cache_lock:
+            for query in dict.fromkeys(queries):
+                if query in self.query_cache:
+                    self.query_cache.move_to_end(query)
+                    embeddings[query] = self.query_cache[query]
+        missing = [query for query in dict.fromkeys(queries) if query not in embeddings]
+        if missing:
+            new_embeddings = {query: np.asarray(embedding, dtype=np.float32) for query, embedding in zip(missing, self.embedding_function.embed_documents(missing))}
+            embeddings.update(new_embeddings)
+            with self.query_cache_lock:
+                self.query_cache.update(new_embeddings)
+                while len(self.query_cache) > self.query_cache_size:
+                    self.query_cache.popitem(last=False)
+        return np.stack([embeddings[query] for query in queries])
+
+    def batch_similarity_search(self, queries: List[str], k: int = 4) -> List[List[Tuple[str, Document]]]:
+        """
+        Search all queries with one k-NN call over the query matrix.
+        Returns:
+            List[List[Tuple[str, Document]]]: Per query, the (document id, document) pairs ranked by distance.
+        """
+        if not queries:
+            return []
+        _, positions = self.index.search(self.embed_queries(queries), k)
+        return [[(str(position), self._document(position)) for position in row if position != -1] for row in positions]
+
+    def similarity_search_by_vector_with_score(self, embedding, k: int = 4) -> List[Tuple[Document, float]]:
+        distances, positions = self.index.search(np.asarray(embedding, dtype=np.float32).reshape(1, -1), k)
+        return [(self._document(position), float(distance)) for position, distance in zip(positions[0], distances[0]) if position != -1]
+
+    def similarity_search_by_vector(self, embedding, k: int = 4) -> List[Document]:
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4) -> List[Document]:
+        """Return the k documents closest to the query, like Chroma.similarity_search."""
+        return self.similarity_search_by_vector(self.embed_query(query), k)
+
+    def close(self):
+        os.close(self.documents_fd)
+
+def reciprocal_rank_fusion(ranked_lists: List[List[Tuple[str, Document]]], rrf_k: int = 60) -> List[Document]:
+    """
+    Fuse several ranked result lists: every document scores sum(1 / (rrf_k + rank)) over the lists it appears in.
+    Documents are deduplicated by id and then by content, ties keep the order of first appearance.
+    """
+    scores = {}
+    documents = {}
+    for ranked_list in ranked_lists:
+        for rank, (document_id, document) in enumerate(ranked_list, start=1):
+            scores[document_id] = scores.get(document_id, 0.0) + 1.0 / (rrf_k + rank)
+            documents.setdefault(document_id, document)
+    fused = sorted(scores, key=lambda document_id: scores[document_id], reverse=True)
+    unique = {}
+    for document_id in fused:
+        unique.setdefault(documents[document_id].page_content, documents[document_id])
+    return list(unique.values())
+
+def multi_query_search(vector_store, queries: List[str], k: int = 5, rrf_k: int = 60) -> List[Document]:
+    """
+    Retrieve the top k documents of every query with one batched embedding request and one vectorized search,
+    then fuse the per-query rankings with reciprocal rank fusion.
+    Args:
+        vector_store (Chroma | FaissVectorStore): The vector store to search.
+        queries (List[str]): The queries, e.g. the queries generated from one question.
+        k (int): Documents retrieved per query.
+        rrf_k (int): Rank offset of reciprocal rank fusion.
+    Returns:
+        List[Document]: The unique documents, best fused rank first.
+    """
+    if not queries:
+        return []
+    if isinstance(vector_store, FaissVectorStore):
+        ranked_lists = vector_store.batch_similarity_search(queries, k)
+    elif isinstance(vector_store, Chroma):
+        query_embeddings = vector_store.embeddings.embed_documents(queries)
+        results = vector_store._collection.query(query_embeddings=query_embeddings, n_results=k, include=["documents", "metadatas"])
+        ranked_lists = [
+            [(document_id, Document(page_content=text, metadata=metadata or {})) for document_id, text, metadata in zip(ids, texts, metadatas)]
+            for ids, texts, metadatas in zip(results["ids"], results["documents"], results["metadatas"])
+        ]
+    else:
+        ranked_lists = [[(document.page_content, document) for document in vector_store.similarity_search(query, k=k)] for query in queries]
+    return reciprocal_rank_fusion(ranked_lists, rrf_k)
+
+def load_vector_store(retriever_type: str, embedding_model, backend: str = "chroma"):
+    """
+    Load the vector store of the given retriever type.
+    Args:
+        retriever_type (str): One of VECTOR_STORE_CONFIGS, e.g. 'llm-doc-full'.
+        embedding_model: The embedding model used for queries.
+        backend (str): 'chroma' for the persisted Chroma collection, 'faiss' for the exported FAISS index.
+    Returns:
+        Chroma | FaissVectorStore: An object providing similarity_search(query, k).
+    """
+    if retriever_type not in VECTOR_STORE_CONFIGS:
+        raise ValueError(f"Invalid retriever_type: {retriever_type}. Expected one of {list(VECTOR_STORE_CONFIGS)}.")
+    collection_name, persist_directory, faiss_directory = VECTOR_STORE_CONFIGS[retriever_type]
+    if backend == "chroma":
+        return Chroma(collection_name=collection_name, embedding_function=embedding_model, persist_directory=persist_directory)
+    elif backend == "faiss":
+        return FaissVectorStore(faiss_directory, embedding_model)
+    else:
+        raise ValueError(f"Invalid vector backend: {backend}. Expected one of {VECTOR_BACKENDS}.")
+
+def vector_store_version(retriever_type: str, backend: str = "chroma", embedding_model_name: str = "text-embedding-3-large") -> str:
+    """
+    Fingerprint of a persisted vector store: backend, embedding model and the names and sizes of the store files.
+    Rebuilding or re-exporting the store changes it, merely opening the store does not.
+    """
+    collection_name, persist_directory, faiss_directory = VECTOR_STORE_CONFIGS[retriever_type]
+    directory = persist_directory if backend == "chroma" else faiss_directory
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if not name.endswith(("-wal", "-shm", "-journal")):
+                path = os.path.join(root, name)
+                files.append((os.path.relpath(path, directory), os.path.getsize(path)))
+    payload = json.dumps([backend, collection_name, embedding_model_name, sorted(files)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def export_chroma_to_faiss(retriever_type: str, index_type: str = "flat") -> int:
+    """
+    Export the embeddings and documents of a persisted Chroma collection into a FAISS index directory.
+    Returns:
+        int: The number of exported documents.
+    """
+    collection_name, persist_directory, faiss_directory = VECTOR_STORE_CONFIGS[retriever_type]
+    data = Chroma(collection_name=collection_name, persist_directory=persist_directory).get(include=["embeddings", "documents", "metadatas"])
+    documents = [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(data["documents"], data["metadatas"])]
+    FaissVectorStore.build(faiss_directory, np.asarray(data["embeddings"]), documents, index_type=index_type, source=f"chroma:{persist_directory}{collection_name}")
+    return len(documents)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a Chroma vector store to a local FAISS index. Example input: build --retriever_type llm-doc-full --index_type hnsw")
+    parser.add_argument("command", choices=["build"], help="build: export the Chroma collection of the retriever type to vector_store/faiss_method<N>/.")
+    parser.add_argument("--retriever_type", type=str, default="llm-doc-full", choices=list(VECTOR_STORE_CONFIGS), help="Vector store to export.")
+    parser.add_argument("--index_type", type=str, default="flat", choices=["flat", "hnsw"], help="flat: exact search; hnsw: approximate search. Default is flat.")
+    args = parser.parse_args()
+
+    count = export_chroma_to_faiss(args.retriever_type, args.index_type)
+    print(f"Exported {count} documents of '{args.retriever_type}' to {VECTOR_STORE_CONFIGS[args.retriever_type][2]}")
@@ -0,0 +1,236 @@
+'''
+Content-addressed cache of sandbox execution results.
+Entries are keyed by a hash of the executed code, the Docker image digest and (for unit tests) the test file,
+so reruns of result_analysis.py or the mtr_rag_test critic loop skip programs that were already executed.
+'''
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import argparse
+import threading
+import docker
+
+try:
+    from src.instrumentation import count_span
+    from src.docker_sandbox import load_output_parser_source
+except ImportError:  # run from src/ without the repository root on sys.path, e.g. result_analysis.py
+    from instrumentation import count_span
+    from docker_sandbox import load_output_parser_source
+
+DEFAULT_CACHE_PATH = "sandbox_cache/results.sqlite3"
+
+# Results starting with these prefixes come from the sandbox infrastructure (Docker unavailable, bad arguments, ...)
+# rather than from the executed program, so they are never cached.
+INFRASTRUCTURE_ERROR_PREFIXES = (
+    "Docker error during execution:",
+    "Error during execution:",
+    "Docker 错误:",
+    "执行过程中发生异常:",
+    "参数序列化失败:",
+    "Error: File ",
+)
+
+# Runs killed by the pool time limit depend on host load and concurrency rather than on the program, so they are not cached either.
+TRANSIENT_FAILURE_MARKERS = (
+    "Job exceeded the time limit of",
+)
+
+def is_cacheable(result: str | dict) -> bool:
+    """Whether a sandbox result comes from the executed program alone and may be stored."""
+    if isinstance(result, dict):
+        output = result.get("stderr", "")
+    elif isinstance(result, str):
+        if result.startswith(INFRASTRUCTURE_ERROR_PREFIXES):
+            return False
+        output = result
+    else:
+        return False
+    return not any(marker in output for marker in TRANSIENT_FAILURE_MARKERS)
+
+class SandboxResultCache:
+    """
+    SQLite-backed store of sandbox results with least-recently-used eviction.
+    """
+    def __init__(self, db_path: str = DEFAULT_CACHE_PATH, max_entries: int = 100000):
+        """
+        Args:
+            db_path (str): The SQLite database file. Its directory is created if needed.
+            max_entries (int): Least recently used entries are evicted beyond this number.
+        """
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.image_digests = {}
+        self.connection = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, kind TEXT, image_digest TEXT, result TEXT, "
+                "created_at REAL, last_access REAL, hits INTEGER DEFAULT 0)"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+
+    @staticmethod
+    def make_key(*parts: str | bytes) -> str:
+        """Hash the given parts into a cache key. Parts are length-prefixed so they cannot run into each other."""
+        digest = hashlib.sha256()
+        for part in parts:
+            data = part.encode("utf-8") if isinstance(part, str) else part
+            digest.update(len(data).to_bytes(8, "big"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def image_digest(self, sandbox) -> str:
+        """Return the content digest of the sandbox image, so rebuilding the image invalidates its entries."""
+        if sandbox.image not in self.image_digests:
+            self.image_digests[sandbox.image] = sandbox.client.images.get(sandbox.image).id
+        return self.image_digests[sandbox.image]
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.connection.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            with self.connection:
+                self.connection.execute("UPDATE results SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, kind: str, image_digest: str, result):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results (key, kind, image_digest, result, created_at, last_access, hits) VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, kind, image_digest, json.dumps(result, ensure_ascii=False), now, now)
+            )
+            self._evict(self.max_entries)
+
+    def _evict(self, max_entries: int) -> int:
+        count = self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if count <= max_entries:
+            return 0
+        self.connection.execute(
+            "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_access ASC LIMIT ?)",
+            (count - max_entries,)
+        )
+        return count - max_entries
+
+    def prune(self, max_entries: int | None = None, max_age_days: float | None = None) -> int:
+        """
+        Evict least recently used entries beyond max_entries and entries not used for max_age_days.
+        Returns:
+            int: The number of removed entries.
+        """
+        removed = 0
+        with self.lock, self.connection:
+            if max_age_days is not None:
+                cursor = self.connection.execute("DELETE FROM results WHERE last_access < ?", (time.time() - max_age_days * 86400,))
+                removed += cursor.rowcount
+            removed += self._evict(self.max_entries if max_entries is None else max_entries)
+        return removed
+
+    def clear(self, image_digest: str | None = None) -> int:
+        """
+        Invalidate all entries, or only those produced with the given image digest.
+        Returns:
+            int: The number of removed entries.
+        """
+        with self.lock, self.connection:
+            if image_digest is None:
+                cursor = self.connection.execute("DELETE FROM results")
+            else:
+                cursor = self.connection.execute("DELETE FROM results WHERE image_digest = ?", (image_digest,))
+        return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self.lock:
+            rows = self.connection.execute("SELECT kind, COUNT(*), COALESCE(SUM(hits), 0) FROM results GROUP BY kind").fetchall()
+        return {kind: {"entries": entries, "hits": hits} for kind, entries, hits in rows}
+
+    def close(self):
+        self.connection.close()
+
+class CachedSandbox:
+    """
+    Wraps a DockerSandbox or DockerSandboxPool and serves execute_code / execute_file from a SandboxResultCache.
+    """
+    def __init__(self, sandbox, cache: SandboxResultCache):
+        self.sandbox = sandbox
+        self.cache = cache
+
+    def execute_code(self, code: str) -> str|dict:
+        """Execute the given Python code, reusing the stored stdout/stderr if this program already ran on this image."""
+        try:
+            image_digest = self.cache.image_digest(self.sandbox)
+        except Exception:
+            return self.sandbox.execute_code(code)
+        key = SandboxResultCache.make_key("execute_code", image_digest, code)
+        cached = self.cache.get(key)
+        if cached is not None:
+            count_span("cache_hits")
+            return cached
+        result = self.sandbox.execute_code(code)
+        if isinstance(result, dict) and is_cacheable(result):
+            self.cache.put(key, "execute_code", image_digest, result)
+        return result
+
+    def execute_file(self, params_dict: dict, py_filename: str, function_name: str) -> str:
+        """Run the unit test function, reusing the stored output for the same test file, function and parameters."""
+        try:
+            image_digest = self.cache.image_digest(self.sandbox)
+            with open(py_filename, 'rb') as f:
+                source_code = f.read()
+            params_bytes = pickle.dumps(params_dict)
+        except Exception:
+            return self.sandbox.execute_file(params_dict, py_filename, function_name)
+        key = SandboxResultCache.make_key("execute_file", image_digest, source_code, function_name, hashlib.sha256(params_bytes).digest())
+        cached = self.cache.get(key)
+        if cached is not None:
+            count_span("cache_hits")
+            return cached
+        result = self.sandbox.execute_file(params_dict, py_filename, function_name)
+        if isinstance(result, str) and is_cacheable(result):
+            self.cache.put(key, "execute_file", image_digest, result)
+        return result
+
+    def execute_with_test(self, code: str, function_name: str, py_filename: str, test_function_name: str) -> str|dict:
+        """Run the generated function and its unit test, reusing the stored report for the same code and test file."""
+        try:
+            image_digest = self.cache.image_digest(self.sandbox)
+            with open(py_filename, 'rb') as f:
+                test_source = f.read()
+            parser_source = load_output_parser_source()
+        except Exception:
+            return self.sandbox.execute_with_test(code, function_name, py_filename, test_function_name)
+        # the output parser is part of the executed script, so a parser change invalidates the stored reports
+        key = SandboxResultCache.make_key("execute_with_test", image_digest, code, function_name, test_source, test_function_name, parser_source)
+        cached = self.cache.get(key)
+        if cached is not None:
+            count_span("cache_hits")
+            return cached
+        result = self.sandbox.execute_with_test(code, function_name, py_filename, test_function_name)
+        if isinstance(result, dict) and is_cacheable(result):
+            self.cache.put(key, "execute_with_test", image_digest, result)
+        return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the sandbox result cache. Example input: clear --image mat-tool-ben")
+    parser.add_argument("command", choices=["stats", "clear", "prune"], help="stats: show entry counts; clear: invalidate entries; prune: apply the eviction policy.")
+    parser.add_argument("--db_path", type=str, default=DEFAULT_CACHE_PATH, help=f"Cache database. Default is {DEFAULT_CACHE_PATH}.")
+    parser.add_argument("--image", type=str, default=None, help="clear: only invalidate entries produced with the current digest of this image.")
+    parser.add_argument("--max_entries", type=int, default=100000, help="prune: keep at most this many most recently used entries.")
+    parser.add_argument("--max_age_days", type=float, default=None, help="prune: also drop entries not used for this many days.")
+    args = parser.parse_args()
+
+    cache = SandboxResultCache(args.db_path, max_entries=args.max_entries)
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), indent=2))
+    elif args.command == "clear":
+        image_digest = docker.from_env().images.get(args.image).id if args.image else None
+        print(f"Removed {cache.clear(image_digest)} entries from {args.db_path}")
+    else:
+        print(f"Removed {cache.prune(args.max_entries, args.max_age_days)} entries from {args.db_path}")
+    cache.close()
@@ -3,7 +3,28 @@ import ast
 import numpy as np
 from pymatgen.core import Element
 
+# 一次扫描即可找到所有数组和 Element 表达式
+_OBJECT_PATTERN = re.compile(
+    r"(?<!\w)(?:np\.|numpy\.)?array\("
+    r"|Element\(['\"](?P<quoted_symbol>\w+)['\"]\)"
+    r"|Element\s+(?P<symbol>\w+)"
+)
+_PARENTHESIS = re.compile(r"[()]")
+_KEYWORD_ARGUMENT = re.compile(r",\s*(\w+)\s*=\s*(\([^)]*\)|'[^']*'|\"[^\"]*\"|[\w.]+)")
+_NUMERIC_DATA = re.compile(r"[\[\]\s,0-9eE+\-.nafiNF]*")
+_FLOAT_MARKERS = re.compile(r"[.eEnN]")
+_SEPARATORS = str.maketrans("[],", "   ")
+# ragged object arrays print their rows as list([...])
+_LIST_WRAPPER = re.compile(r"(?<![\w.'\"])list\(")
+
 class ComplexDictParser:
+    """
+    Parses the printed result dict of a generated function, a Python literal that may also contain
+    numpy array reprs (array(...), np.array(...), with dtype=... such as float128) and pymatgen Elements
+    (Element X, Element('X')).
+    The input is scanned once: arrays and Elements are replaced by placeholders and built directly,
+    numeric arrays from their number spans without eval, before ast.literal_eval parses the rest.
+    """
     def __init__(self):
         self.element_dict = {}  # 存储 Element 对象
         self.array_dict = {}    # 存储数组对象
@@ -16,123 +37,125 @@ class ComplexDictParser:
     
     def preprocess_string(self, input_str):
         """预处理字符串，替换复杂对象为占位符"""
-        # 首先完整处理所有数组表达式
-        result = self._process_arrays(input_str)
-        # 然后处理 Element 表达式
-        result = self._process_elements_all_formats(result)
-        return result
-    
-    def _find_matching_parenthesis(self, s, start_pos):
-        """找到与start_pos位置的左括号匹配的右括号位置"""
-        count = 1  # 已找到一个左括号
-        pos = start_pos + 1
-        
-        while pos < len(s) and count > 0:
-            if s[pos] == '(':
-                count += 1
-            elif s[pos] == ')':
-                count -= 1
-            pos += 1
-            
-        return pos - 1 if count == 0 else -1
-    
-    def _process_arrays(self, input_str):
-        """处理字符串中的所有数组表达式"""
-        result_str = input_str
-        # 查找 array( 和 np.array( 模式
-        array_patterns = [r'array\(', r'np\.array\(']
-        
-        for pattern in array_patterns:
-            # 不断查找直到找不到为止
-            i = 0
-            while i < len(result_str):
-                match = re.search(pattern, result_str[i:])
-                if not match:
-                    break
-                
-                # 计算绝对位置
-                start_idx = i + match.start()
-                # 查找匹配的右括号
-                open_paren_pos = i + match.end() - 1
-                close_paren_pos = self._find_matching_parenthesis(result_str, open_paren_pos)
-                
+        pieces = []
+        pos = 0
+        match = _OBJECT_PATTERN.search(input_str)
+        while match:
+            start, end = match.span()
+            if match.lastgroup is None:
+                # 数组表达式：找到匹配的右括号
+                close_paren_pos = self._find_matching_parenthesis(input_str, end - 1)
                 if close_paren_pos == -1:
-                    # 没找到匹配的右括号，跳过这个匹配
-                    i = start_idx + 1
+                    match = _OBJECT_PATTERN.search(input_str, start + 1)
+                    continue
+                array = self._build_array(input_str[end:close_paren_pos])
+                end = close_paren_pos + 1
+                if array is None:
+                    match = _OBJECT_PATTERN.search(input_str, end)
                     continue
-                
-                # 提取完整的数组表达式
-                array_expr = result_str[start_idx:close_paren_pos+1]
-                
-                # 创建占位符
                 placeholder = self.get_new_placeholder("ARRAY")
-                
+                self.array_dict[placeholder] = array
+            else:
                 try:
-                    # 解析数组表达式
-                    # 处理 dtype=float128 的情况
-                    if 'float128' in array_expr:
-                        array_code = array_expr.replace('float128', 'np.float64')
-                        if not array_code.startswith('np.'):
-                            array_code = 'np.' + array_code
-                    else:
-                        if array_expr.startswith('array('):
-                            array_code = 'np.' + array_expr
-                        else:
-                            array_code = array_expr
-                    
-                    # 执行代码创建数组
-                    self.array_dict[placeholder] = eval(array_code)
-                    
-                    # 替换原始表达式为占位符
-                    result_str = result_str[:start_idx] + f"'{placeholder}'" + result_str[close_paren_pos+1:]
-                    
-                    # 由于字符串长度已改变，从替换位置重新开始
-                    i = start_idx + len(f"'{placeholder}'")
-                    
-                except Exception as e:
-                    print(f"无法解析数组表达式 '{array_expr}': {e}")
-                    # 跳过这个表达式
-                    i = start_idx + 1
-        
-        return result_str
-    
-    def _process_elements_all_formats(self, input_str):
-        """处理所有格式的 Element 表达式"""
-        result_str = input_str
-        
-        # 1. 处理 Element('X') 格式
-        pattern1 = r"Element\(['\"](\w+)['\"]\)"
-        result_str = self._replace_elements(result_str, pattern1, lambda m: m.group(1))
-        
-        # 2. 处理 Element X 格式
-        pattern2 = r"Element\s+(\w+)"
-        result_str = self._replace_elements(result_str, pattern2, lambda m: m.group(1))
-        
-        return result_str
-    
-    def _replace_elements(self, input_str, pattern, symbol_extractor):
-        """使用给定的模式和符号提取器替换 Element 表达式"""
-        result_str = input_str
-        element_matches = list(re.finditer(pattern, input_str))
-        
-        offset = 0
-        for match in element_matches:
-            start, end = match.span()
-            start += offset
-            end += offset
-            
-            try:
-                element_symbol = symbol_extractor(match)
+                    element = Element(match.group(match.lastgroup))
+                except Exception:
+                    match = _OBJECT_PATTERN.search(input_str, end)
+                    continue
                 placeholder = self.get_new_placeholder("ELEMENT")
-                self.element_dict[placeholder] = Element(element_symbol)
-                
-                # 替换 Element 表达式为占位符
-                result_str = result_str[:start] + f"'{placeholder}'" + result_str[end:]
-                offset += len(f"'{placeholder}'") - (end - start)
-            except Exception as e:
-                print(f"无法创建 Element 对象: {e}")
-        
-        return result_str
+                self.element_dict[placeholder] = element
+            pieces.append(input_str[pos:start])
+            pieces.append(f"'{placeholder}'")
+            pos = end
+            match = _OBJECT_PATTERN.search(input_str, end)
+        pieces.append(input_str[pos:])
+        return "".join(pieces)
+    
+    def _find_matching_parenthesis(self, s, start_pos):
+        """找到与start_pos位置的左括号匹配的右括号位置"""
+        count = 1  # 已找到一个左括号
+        for paren in _PARENTHESIS.finditer(s, start_pos + 1):
+            count += 1 if paren.group() == '(' else -1
+            if count == 0:
+                return paren.start()
+        return -1
+
+    @staticmethod
+    def _split_array_arguments(arguments):
+        """把 array(...) 的参数拆分为数据部分和关键字参数，例如 dtype=float128 或 shape=(0, 3)。"""
+        data_end = len(arguments)
+        keyword_start = re.search(r",\s*\w+\s*=", arguments)
+        if keyword_start and arguments.count('[', 0, keyword_start.start()) == arguments.count(']', 0, keyword_start.start()):
+            data_end = keyword_start.start()
+        keywords = dict(_KEYWORD_ARGUMENT.findall(arguments, data_end))
+        return arguments[:data_end].strip(), keywords
+
+    @staticmethod
+    def _parse_dtype(dtype):
+        dtype = dtype.strip("'\"")
+        if dtype in ('float128', 'longdouble'):
+            # 与原实现一致，float128 按 float64 读取
+            return np.float64
+        return np.dtype(dtype.removeprefix('np.'))
+
+    @staticmethod
+    def _numeric_array(data):
+        """用数字片段直接构建数组；数据不是纯数字时返回 None。"""
+        if not _NUMERIC_DATA.fullmatch(data):
+            return None
+        tokens = data.translate(_SEPARATORS).split()
+        # 与 numpy 一致：空数组和含小数/科学记数法/nan/inf 的数组为 float64，否则为 int64
+        is_float = not tokens or any(_FLOAT_MARKERS.search(token) for token in tokens)
+        try:
+            values = np.array(tokens, dtype=np.float64 if is_float else np.int64)
+        except (ValueError, OverflowError):
+            # 超出 int64 范围的整数交给 literal_eval，与 numpy 一样得到 uint64、float64 或 object 数组
+            return None
+        if not data.startswith('['):
+            return values.reshape(()) if len(values) == 1 else None
+        # 形状由中括号的嵌套决定：每一层的各个列表都必须有相同数量的子列表，最内层的列表有相同数量的逗号
+        codes = np.frombuffer(data.encode('ascii'), dtype=np.uint8)
+        opening = codes == ord('[')
+        depth = np.cumsum(opening.astype(np.int64) - (codes == ord(']')))
+        positions = np.flatnonzero(opening)
+        depths = depth[positions]
+        if depths[0] != 1 or np.count_nonzero(depths == 1) != 1 or depth[-1] != 0:
+            return None
+        max_depth = int(depths.max())
+        shape = []
+        for d in range(1, max_depth + 1):
+            parents = positions[depths == d]
+            if d < max_depth:
+                children = positions[depths == d + 1]
+            else:
+                children = np.flatnonzero((codes == ord(',')) & (depth == max_depth))
+            counts = np.diff(np.searchsorted(children, np.append(parents, len(codes))))
+            if np.any(counts != counts[0]):
+                return None
+            shape.append(int(counts[0]))
+        # 最内层：n 个逗号对应 n + 1 个元素，空列表没有元素
+        innermost_lists = int(np.prod(shape[:-1]))
+        shape[-1] = len(values) // innermost_lists if innermost_lists else 0
+        if int(np.prod(shape)) != len(values):
+            return None
+        return values.reshape(shape)
+
+    def _build_array(self, arguments):
+        """构建 array(...) 表达式对应的 numpy 数组，无法解析时返回 None。"""
+        data, keywords = self._split_array_arguments(arguments)
+        try:
+            dtype = self._parse_dtype(keywords['dtype']) if 'dtype' in keywords else None
+            array = self._numeric_array(data)
+            if array is None:
+                if dtype == np.dtype(object):
+                    data = _LIST_WRAPPER.sub("(", data)
+                array = np.array(ast.literal_eval(data), dtype=dtype)
+            elif dtype is not None:
+                array = array.astype(dtype)
+            if 'shape' in keywords:
+                array = array.reshape(ast.literal_eval(keywords['shape']))
+            return array
+        except (ValueError, TypeError, SyntaxError, OverflowError, MemoryError, RecursionError):
+            return None
     
     def restore_objects(self, obj):
         """还原所有占位符为原始对象"""
@@ -161,7 +184,7 @@ class ComplexDictParser:
         return obj
     
     def parse(self, input_str):
-        """解析复杂字符串为 Python 对象"""
+        """解析复杂字符串为 Python 对象，失败时返回 None"""
         try:
             # 预处理字符串
             preprocessed_str = self.preprocess_string(input_str)
@@ -170,17 +193,8 @@ class ComplexDictParser:
             parsed_obj = ast.literal_eval(preprocessed_str)
             
             # 还原所有占位符
-            result = self.restore_objects(parsed_obj)
-            print(f"输入字符串: {input_str}")
-            print(f"预处理后的字符串: {preprocessed_str}")
-            print(f"解析成功: {result}")
-            print("-------------------------------")
-            return result
-        except Exception as e:
-            print(f"输入字符串: {input_str}")
-            print(f"预处理后的字符串: {preprocessed_str}")
-            print(f"解析错误: {e}")
-            print("-------------------------------")
+            return self.restore_objects(parsed_obj)
+        except Exception:
             return None
 
 # Example usage
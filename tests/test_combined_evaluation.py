@@ -0,0 +1,87 @@
+import os
+import sys
+import json
+import pickle
+import subprocess
+import pytest
+from src.utils import ComplexDictParser
+from src.docker_sandbox import build_wrapper_script, build_combined_script, parse_combined_report
+
+# A unit test in the style of question_segments/*/new_unit_test.py
+TEST_SOURCE = '''
+def test_candidate(properties):
+    import numpy as np
+    expected_properties = {
+        "count": {"format": "int", "value": 3},
+        "converged": {"format": "bool", "value": True},
+        "energy": {"format": "float", "value": 1.5},
+        "forces": {"format": "np.allclose", "value": [0.5, 1.0]},
+    }
+    errors = []
+    for property_name, expected_info in expected_properties.items():
+        expected_value = expected_info['value']
+        expected_format = expected_info['format']
+        if property_name not in properties:
+            errors.append(f"{property_name} not found in input properties")
+            continue
+        actual_value = properties[property_name]
+        if expected_format != "np.allclose" and not isinstance(actual_value, eval(expected_format)):
+            errors.append(f"{property_name} is not of type {expected_format}")
+            continue
+        if expected_format == "np.allclose":
+            if not np.allclose(actual_value, expected_value):
+                errors.append(f"{property_name}: Expected value close to {expected_value} but got {actual_value}")
+        elif actual_value != expected_value:
+            errors.append(f"{property_name}: Expected {expected_value} but got {actual_value}")
+    if errors:
+        errors.append(len(errors))
+        errors.append(len(expected_properties))
+        return errors
+    return "ok"
+'''
+
+CANDIDATES = {
+    "python_values": "def f():\n    return {'count': 3, 'converged': True, 'energy': 1.5, 'forces': [0.5, 1.0]}\n",
+    "numpy_scalars": (
+        "import numpy as np\n"
+        "def f():\n"
+        "    return {'count': np.int64(3), 'converged': np.bool_(True), 'energy': np.float32(1.5), 'forces': np.array([0.5, 1.0])}\n"
+    ),
+    "numpy_wrong_values": (
+        "import numpy as np\n"
+        "def f():\n"
+        "    return {'count': np.int64(4), 'converged': np.bool_(False), 'energy': np.float64(2.5), 'forces': np.array([0.5, 2.0])}\n"
+    ),
+    "not_a_dict": "import numpy as np\ndef f():\n    return np.arange(3)\n",
+}
+
+def run_python(script, cwd):
+    path = os.path.join(cwd, "main.py")
+    with open(path, "w") as f:
+        f.write(script)
+    return subprocess.run([sys.executable, path], cwd=cwd, capture_output=True, text=True, env=os.environ.copy()).stdout.strip()
+
+def default_path(code, tmp_path):
+    """Print the output, parse it on the host and pickle it into the unit test wrapper, like evaluate_generated_code."""
+    parsed = ComplexDictParser().parse(run_python(code + "print(f())", str(tmp_path)))
+    if not isinstance(parsed, dict) or parsed == {}:
+        return "FunctionError"
+    with open(tmp_path / "params.pkl", "wb") as f:
+        pickle.dump(parsed, f)
+    return json.loads(run_python(build_wrapper_script(TEST_SOURCE, "test_candidate"), str(tmp_path)))
+
+def combined_path(code, tmp_path):
+    report = parse_combined_report(run_python(build_combined_script(code, "f", TEST_SOURCE, "test_candidate"), str(tmp_path)))
+    if report is None or report["stage"] != "test":
+        return "FunctionError"
+    return report["test_result"]
+
+@pytest.mark.parametrize("name", CANDIDATES)
+def test_combined_path_scores_like_the_default_path(name, tmp_path):
+    code = CANDIDATES[name]
+    (tmp_path / "default").mkdir()
+    (tmp_path / "combined").mkdir()
+    assert combined_path(code, tmp_path / "combined") == default_path(code, tmp_path / "default")
+
+def test_python_values_pass_both_paths(tmp_path):
+    assert combined_path(CANDIDATES["python_values"], tmp_path) == "ok"
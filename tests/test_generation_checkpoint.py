@@ -0,0 +1,81 @@
+import json
+import os
+from src.generation_checkpoint import GenerationCheckpoint
+
+QUESTIONS = [
+    "question_segments/pymatgen_analysis_defects/test_vacancy/question.txt",
+    "question_segments/pymatgen_analysis_defects/test_interstitial/question.txt",
+    "question_segments/pymatgen_analysis_defects/test_substitution/question.txt",
+]
+
+def read_entries(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+def test_record_is_keyed_by_question_folder(tmp_path):
+    checkpoint = GenerationCheckpoint(str(tmp_path / "results.jsonl"))
+    entry = checkpoint.record(QUESTIONS[1], "def f():\n    return {}", "f")
+    checkpoint.close()
+    assert entry == {"question_file_path": "test_interstitial", "function": "def f():\n    return {}", "function_name": "f"}
+    assert checkpoint.is_done(QUESTIONS[1])
+    # another path to the same question folder is the same question
+    assert checkpoint.is_done("elsewhere/test_interstitial/question.txt")
+    assert not checkpoint.is_done(QUESTIONS[0])
+    assert checkpoint.pending(QUESTIONS) == [QUESTIONS[0], QUESTIONS[2]]
+    assert read_entries(tmp_path / "results.jsonl") == [entry]
+
+def test_resume_keeps_answers_and_truncates_partial_last_line(tmp_path):
+    output_file = tmp_path / "results.jsonl"
+    checkpoint = GenerationCheckpoint(str(output_file))
+    checkpoint.record(QUESTIONS[0], "code0", "f0")
+    checkpoint.close()
+    complete_size = os.path.getsize(output_file)
+    # a crash in the middle of a write leaves an incomplete line
+    with open(output_file, "a", encoding="utf-8") as f:
+        f.write('{"question_file_path": "test_interstitial", "func')
+
+    checkpoint = GenerationCheckpoint(str(output_file), resume=True)
+    assert os.path.getsize(output_file) == complete_size
+    assert checkpoint.pending(QUESTIONS) == QUESTIONS[1:]
+    checkpoint.record(QUESTIONS[1], "code1", "f1")
+    checkpoint.close()
+
+    entries = read_entries(output_file)
+    assert [entry["question_file_path"] for entry in entries] == ["test_vacancy", "test_interstitial"]
+    # the next resume sees every answer written after the crash
+    assert GenerationCheckpoint(str(output_file), resume=True).pending(QUESTIONS) == QUESTIONS[2:]
+
+def test_resume_drops_unterminated_last_line(tmp_path):
+    output_file = tmp_path / "results.jsonl"
+    entry = {"question_file_path": "test_vacancy", "function": "code0", "function_name": "f0"}
+    # valid JSON, but the newline was never written
+    output_file.write_text(json.dumps(entry), encoding="utf-8")
+    checkpoint = GenerationCheckpoint(str(output_file), resume=True)
+    checkpoint.close()
+    assert checkpoint.pending(QUESTIONS) == QUESTIONS
+    assert output_file.read_text(encoding="utf-8") == ""
+
+def test_without_resume_the_file_is_started_afresh(tmp_path):
+    output_file = tmp_path / "model" / "results.jsonl"
+    GenerationCheckpoint(str(output_file)).record(QUESTIONS[0], "code0", "f0")
+    checkpoint = GenerationCheckpoint(str(output_file))
+    checkpoint.close()
+    assert checkpoint.pending(QUESTIONS) == QUESTIONS
+    assert read_entries(output_file) == []
+
+def test_finalize_restores_question_order(tmp_path):
+    output_file = tmp_path / "results.jsonl"
+    checkpoint = GenerationCheckpoint(str(output_file))
+    for index in (2, 0):
+        checkpoint.record(QUESTIONS[index], f"code{index}", f"f{index}")
+    ordered = checkpoint.finalize(QUESTIONS)
+    # records after finalize are appended to the rewritten file
+    checkpoint.record(QUESTIONS[1], "code1", "f1")
+    checkpoint.close()
+    assert [entry["function_name"] for entry in ordered] == ["f0", "f2"]
+    assert [entry["function_name"] for entry in read_entries(output_file)] == ["f0", "f2", "f1"]
+    checkpoint = GenerationCheckpoint(str(output_file), resume=True)
+    assert [entry["function_name"] for entry in checkpoint.finalize(QUESTIONS)] == ["f0", "f1", "f2"]
+    checkpoint.close()
+    assert [entry["function_name"] for entry in read_entries(output_file)] == ["f0", "f1", "f2"]
+    assert not os.path.exists(str(output_file) + ".tmp")
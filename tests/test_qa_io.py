@@ -0,0 +1,94 @@
+import json
+import os
+import sys
+import pytest
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "qa_benchmark", "pymatgen-qa-generation", "src"))
+from qa_io import iter_json_array, build_index, QAReader, INDEX_SUFFIX
+
+ARRAY = [
+    1.5, -20, 3e-7, 12345678901234567890, 0, -0.25E+3,
+    "text with \"escapes\", commas] and brackets",
+    {"source": {"metadata": {"name": "Structure"}}, "questions": [{"question_id": 1, "score": 0.75}]},
+    [1, [2.5, []], {}], True, False, None, 42,
+]
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 16, 1 << 20])
+@pytest.mark.parametrize("indent", [None, 4])
+def test_elements_split_across_chunks(tmp_path, chunk_size, indent):
+    path = tmp_path / "array.json"
+    path.write_text(json.dumps(ARRAY, indent=indent), encoding="utf-8")
+    assert list(iter_json_array(str(path), chunk_size=chunk_size)) == ARRAY
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 1 << 20])
+def test_number_at_chunk_boundary(tmp_path, chunk_size):
+    path = tmp_path / "array.json"
+    path.write_text("[\n    1.5\n]", encoding="utf-8")
+    assert list(iter_json_array(str(path), chunk_size=chunk_size)) == [1.5]
+
+@pytest.mark.parametrize("content", ["[]", "  [ ]  ", "\n[\n]\n"])
+def test_empty_array(tmp_path, content):
+    path = tmp_path / "array.json"
+    path.write_text(content, encoding="utf-8")
+    assert list(iter_json_array(str(path), chunk_size=1)) == []
+
+@pytest.mark.parametrize("content", ["", "{}", "[1, 2", "[1.5"])
+def test_invalid_files_raise(tmp_path, content):
+    path = tmp_path / "array.json"
+    path.write_text(content, encoding="utf-8")
+    with pytest.raises(ValueError):
+        list(iter_json_array(str(path), chunk_size=2))
+
+def qa_item(code_source_file, name, question_ids):
+    return {
+        "source": {"metadata": {"code_source_file": code_source_file, "name": name}},
+        "questions": [{"question_id": question_id, "question": f"{name} {question_id}"} for question_id in question_ids],
+    }
+
+QA_ITEMS = [
+    qa_item("pymatgen/core/structure.py", "Structure", [1, 2]),
+    qa_item("pymatgen/core/lattice.py", "Lattice", ["1", "2"]),
+    qa_item("pymatgen/core/structure.py", "Structure", [3]),
+]
+
+@pytest.fixture
+def qa_file(tmp_path):
+    path = tmp_path / "qa.jsonl"
+    path.write_text("".join(json.dumps(item) + "\n" for item in QA_ITEMS), encoding="utf-8")
+    return str(path)
+
+def test_build_index(qa_file):
+    index = build_index(qa_file)
+    with open(qa_file, "rb") as f:
+        lines = f.readlines()
+    assert index["offsets"] == [0, len(lines[0]), len(lines[0]) + len(lines[1])]
+    assert index["data_size"] == os.path.getsize(qa_file)
+    assert index["sources"] == ["pymatgen/core/structure.py/Structure", "pymatgen/core/lattice.py/Lattice", "pymatgen/core/structure.py/Structure"]
+    assert index["question_ids"] == [[1, 2], ["1", "2"], [3]]
+    with open(qa_file + INDEX_SUFFIX, encoding="utf-8") as f:
+        assert json.load(f) == index
+
+@pytest.mark.parametrize("item_index, question_id", [(0, 2), (0, "2"), (1, 2), (1, "2"), (2, 3)])
+def test_get_question_with_int_and_str_ids(qa_file, item_index, question_id):
+    reader = QAReader(qa_file)
+    question = reader.get_question(item_index, question_id)
+    assert str(question["question_id"]) == str(question_id)
+    assert question["question"].endswith(f" {question_id}")
+    reader.close()
+
+def test_get_question_missing_id(qa_file):
+    reader = QAReader(qa_file)
+    with pytest.raises(KeyError):
+        reader.get_question(0, 3)
+    reader.close()
+
+def test_reader_lookups_and_stale_index(qa_file):
+    build_index(qa_file)
+    with open(qa_file, "a", encoding="utf-8") as f:
+        f.write(json.dumps(qa_item("pymatgen/core/sites.py", "Site", [1])) + "\n")
+    reader = QAReader(qa_file)
+    assert len(reader) == 4
+    assert reader[3]["source"]["metadata"]["name"] == "Site"
+    assert reader.sources() == ["pymatgen/core/structure.py/Structure", "pymatgen/core/lattice.py/Lattice", "pymatgen/core/sites.py/Site"]
+    assert reader.items_for_source("pymatgen/core/structure.py/Structure") == [QA_ITEMS[0], QA_ITEMS[2]]
+    assert [question["question_id"] for _, _, question in reader.iter_questions([1, 0])] == ["1", "2", 1, 2]
+    reader.close()
@@ -0,0 +1,63 @@
+import json
+import pytest
+from src.json_handler import SymbolIndex, JsonFileProcessor
+
+def record(code_source_file, name):
+    return {
+        "page_content": f"md of {name}",
+        "metadata": {"code_source_file": code_source_file, "name": name, "code_content": f"code of {name}\n"},
+    }
+
+DATA = [
+    record("pymatgen/core/structure.py", "Structure"),
+    record("pymatgen/core/structure.py", "get_structure"),
+    record("pymatgen/io/vasp/inputs.py", "getstructure"),
+    record("pymatgen/core/sites.py", "_foo"),
+    record("pymatgen/core/lattice.py", "foo"),
+    record("pymatgen/core/lattice.py", "Lattice"),
+    record("pymatgen/io/cif.py", "Lattice"),
+]
+
+@pytest.fixture
+def index():
+    return SymbolIndex(DATA)
+
+def md(records):
+    return sorted(md_content for _, md_content in records)
+
+def test_exact_lookup_is_the_default(index):
+    assert md(index.lookup("Structure")) == ["md of Structure"]
+    assert md(index.lookup("Lattice")) == ["md of Lattice", "md of Lattice"]
+    assert index.lookup("pymatgen.core.structure.Structure") == []
+    assert index.lookup("structure") == []
+    assert index.lookup("Structure()") == []
+
+def test_qualified_lookup(index):
+    assert md(index.lookup("pymatgen.core.structure.Structure", qualified=True)) == ["md of Structure"]
+    # a qualified name picks the record of its module, the plain name returns all of them
+    assert len(index.lookup("pymatgen.io.cif.Lattice", qualified=True)) == 1
+    # unknown modules fall back to the last component
+    assert md(index.lookup("pymatgen.core.Structure", qualified=True)) == ["md of Structure"]
+    assert index.lookup("pymatgen.core.Missing", qualified=True) == []
+
+@pytest.mark.parametrize("search_text", ["structure", "STRUCTURE", "Structure()", "Struc_ture", "pymatgen.core.structure"])
+def test_fuzzy_lookup(index, search_text):
+    assert md(index.lookup(search_text, fuzzy=True)) == ["md of Structure"]
+
+@pytest.mark.parametrize("search_text", ["GetStructure", "get_Structure()", "Foo", "__foo"])
+def test_fuzzy_lookup_ignores_colliding_names(index, search_text):
+    # get_structure / getstructure and _foo / foo share a fuzzy key, so neither is returned for a near miss
+    assert index.lookup(search_text, fuzzy=True) == []
+
+@pytest.mark.parametrize("search_text", ["get_structure", "getstructure", "_foo", "foo"])
+def test_exact_names_win_over_fuzzy_collisions(index, search_text):
+    assert md(index.lookup(search_text, qualified=True, fuzzy=True)) == [f"md of {search_text}"]
+
+def test_search_code_contents_by_name(tmp_path):
+    db_path = tmp_path / "db.json"
+    db_path.write_text(json.dumps(DATA), encoding="utf-8")
+    processor = JsonFileProcessor(str(db_path))
+    assert processor.search_code_contents_by_name(str(db_path), "'structure'") == (["No matching item found."], ["No matching item found."])
+    code, md_contents = processor.search_code_contents_by_name(str(db_path), "'structure'", fuzzy=True)
+    assert md_contents == ["md of Structure"]
+    assert code[0].startswith("--------------\n\npymatgen/core/structure.py\n\ncode of Structure")